@@ -1,15 +1,87 @@
-from django.contrib.auth.models import AnonymousUser
-from django.shortcuts import render, redirect
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.http import Http404, HttpResponseNotAllowed
+from django.shortcuts import get_object_or_404, render, redirect
+from django.urls import path, reverse
 from django.utils import timezone
 from django.contrib import admin
 from django.contrib.admin import SimpleListFilter
 from django.utils.html import format_html
+from django.views.decorators.csrf import csrf_exempt
+from django.db import models
+from utils.permissions import ALL_ROLES, Permission, PermissionMatrixMixin, requires_object
+from utils.pagination import KeysetPaginationMixin, format_cursor, parse_cursor
+from utils.search import FullTextSearchMixin
+from utils.user_picker import InlineUserPickerMixin, UserPickerMixin
+from . import exports, uploads, visibility
+from .forms import AudienceRuleForm, SubmittingForm
 from .models import *
 
 
+# 发布者有权限
+def is_publisher(request, obj):
+    if obj and obj.publisher_id == request.user.id:
+        return True
+
+
+# 新建收集时或发布者有权限
+def is_new_or_publisher(request, obj):
+    if obj is None or obj.publisher_id == request.user.id:
+        return True
+
+
+# 提交者只可修改草稿或被驳回的提交
+def owner_edits_draft(request, obj):
+    if obj.user_id == request.user.id:
+        return obj.status in (Submitting.DRAFT, Submitting.REJECTED)
+
+
+# 提交者只可删除已处理的提交
+def owner_deletes_handled(request, obj):
+    if obj and obj.user_id == request.user.id:
+        return obj.status == Submitting.HANDLED
+
+
+# 受众规则
+class AudienceRuleInline(PermissionMatrixMixin, InlineUserPickerMixin, admin.TabularInline):
+    model = AudienceRule
+    form = AudienceRuleForm
+    extra = 0
+    fields = ('purpose', 'exclude', 'user', 'college', 'campus', 'type', 'organization')
+    user_picker_fields = ('user', 'organization')
+
+    # 权限矩阵：管理员和发布者有权限，新建收集时所有可发布收集的用户有权限
+    permissions = {
+        'view': Permission(User.ADMIN, rules=(is_new_or_publisher,)),
+        'add': Permission(User.ADMIN, rules=(is_new_or_publisher,)),
+        'change': Permission(User.ADMIN, rules=(is_new_or_publisher,)),
+        'delete': Permission(User.ADMIN, rules=(is_new_or_publisher,)),
+    }
+
+    # 社团不允许发布强制提交的收集
+    def formfield_for_choice_field(self, db_field, request, **kwargs):
+        if db_field.name == 'purpose' and request.user.type == User.CLUB:
+            kwargs['choices'] = ((AudienceRule.VIEW, '有权限查看'),)
+        return super(AudienceRuleInline, self).formfield_for_choice_field(db_field, request, **kwargs)
+
+    # 可选用户与AudienceRuleForm的校验范围一致：管理员可选所有用户，其他用户只可选下级用户，组织另可选自己
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name in self.user_picker_fields and request.user.type != User.ADMIN:
+            if db_field.name == 'user':
+                kwargs['queryset'] = request.user.descendants()
+            else:
+                kwargs['queryset'] = User.objects.filter(models.Q(pk=request.user.pk) | models.Q(pk__in=request.user.descendants()))
+        return super(AudienceRuleInline, self).formfield_for_foreignkey(db_field, request, **kwargs)
+
+    # 表单校验时需要知道当前用户
+    def get_formset(self, request, obj=None, **kwargs):
+        kwargs['form'] = type('AudienceRuleForm', (self.form,), {'request_user': request.user})
+        return super(AudienceRuleInline, self).get_formset(request, obj, **kwargs)
+
+
 # 收集管理
 @admin.register(Collecting)
-class CollectingAdmin(admin.ModelAdmin):
+class CollectingAdmin(PermissionMatrixMixin, FullTextSearchMixin, KeysetPaginationMixin, UserPickerMixin, admin.ModelAdmin):
 
     # 自定义筛选是否本人发布
     class UserPublishedFilter(SimpleListFilter):
@@ -42,15 +114,12 @@ class CollectingAdmin(admin.ModelAdmin):
             )
 
         def queryset(self, request, queryset):
-            # 自己必须提交的
-            if self.value() == '0':
-                forced_collectings = request.user.forced_collectings.distinct()
-                for collecting in forced_collectings:
-                    queryset = queryset.exclude(id=collecting.id)
-                return queryset.distinct()
             # 自己不必提交的
+            if self.value() == '0':
+                return queryset.not_forced_on(request.user)
+            # 自己必须提交的
             elif self.value() == '1':
-                return (queryset.distinct() & request.user.forced_collectings.distinct()).distinct()
+                return queryset.forced_on(request.user)
 
     # 自定义筛选是否超时
     class DueTimeMissedFilter(SimpleListFilter):
@@ -104,28 +173,32 @@ class CollectingAdmin(admin.ModelAdmin):
             )
 
         def queryset(self, request, queryset):
-            submittings = request.user.user_submittings.all()
-            # 自己已提交
-            if self.value() == '0':
-                collectings = Collecting.objects.exclude(publisher=request.user)
-                for submitting in submittings:
-                    collectings = collectings.exclude(id=submitting.collecting.id)
-                return queryset.distinct() & collectings.distinct()
             # 自己未提交
+            if self.value() == '0':
+                return queryset.exclude(publisher=request.user).not_submitted_by(request.user)
+            # 自己已提交
             elif self.value() == '1':
-                collectings = Collecting.objects.none()
-                for submitting in submittings:
-                    collectings = collectings | Collecting.objects.filter(id=submitting.collecting.id)
-                return queryset.distinct() & collectings.distinct()
+                return queryset.submitted_by(request.user)
 
     # 内容显示html
     def content_html(self, collecting):
         return format_html(collecting.content)
     content_html.short_description = '内容'
 
+    # 必须提交者的提交进度
+    def progress(self, collecting):
+        if not collecting.forced:
+            return '-'
+        return '%d / %d' % (collecting.required_submitted_count, collecting.required_count)
+    progress.short_description = '已提交 / 必须提交'
+    progress.admin_order_field = 'required_submitted_count'
+
     # 初始化列表页
     list_per_page = 10
-    list_display = ['title', 'publisher', 'publish_time', 'due_time', 'allow_multiple', 'private', 'forced']
+    keyset_field = 'publish_time'
+    status_per_page = 100
+    related_per_page = 50
+    list_display = ['title', 'publisher', 'publish_time', 'due_time', 'allow_multiple', 'upload_limit', 'private', 'forced', 'submit_count', 'submitted_count', 'handled_count', 'rejected_count', 'progress']
     list_filter = [UserPublishedFilter, UserForcedFilter, DueTimeMissedFilter, Submitted, 'allow_multiple', 'private', 'forced']
     search_fields = ('title', 'content', 'publisher__name')
 
@@ -135,11 +208,12 @@ class CollectingAdmin(admin.ModelAdmin):
             'fields': ('title', 'content', 'publisher', 'publish_time')
         }),
         ('提交限制', {
-            'fields': ('due_time', 'allow_multiple', 'private', 'valid_users', 'forced', 'collect_from')
+            'fields': ('due_time', 'allow_multiple', 'upload_limit', 'private', 'valid_users', 'forced', 'collect_from')
         })
     )
-    filter_horizontal = ('valid_users', 'collect_from',)
+    user_picker_fields = ('publisher', 'valid_users', 'collect_from')
     readonly_fields = ('publish_time',)
+    inlines = [AudienceRuleInline]
 
     # 重置查询集
     def get_queryset(self, request):
@@ -147,104 +221,34 @@ class CollectingAdmin(admin.ModelAdmin):
         # 管理员允许查看所有收集
         if request.user.type == User.ADMIN:
             return qs
-        # 学生只允许查看公开的和有权限查看的收集
-        elif request.user.type == User.STUDENT:
-            return (qs.filter(private=False) | request.user.opened_collectings.all()).distinct()
-        # 团学组织只允许查看自己创建的或公开的和有权限查看的收集
-        elif request.user.type == User.ORGANIZATION:
-            return (qs.filter(publisher=request.user) | qs.filter(private=False) | request.user.opened_collectings.all()).distinct()
-        # 社团只允许查看自己创建的或公开的和有权限查看的收集
-        elif request.user.type == User.CLUB:
-            return (qs.filter(publisher=request.user) | qs.filter(private=False) | request.user.opened_collectings.all()).distinct()
-
-    # 收集模块权限
-    def has_module_permission(self, request):
-        # 未登录用户无权限
-        if isinstance(request.user, AnonymousUser):
-            return False
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生有权限
-        elif request.user.type == User.STUDENT:
-            return True
-        # 团学组织有权限
-        elif request.user.type == User.ORGANIZATION:
-            return True
-        # 社团有权限
-        elif request.user.type == User.CLUB:
-            return True
-
-    # 查看收集权限
-    def has_view_permission(self, request, obj=None):
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生有权限
-        elif request.user.type == User.STUDENT:
-            return True
-        # 团学组织有权限
-        elif request.user.type == User.ORGANIZATION:
-            return True
-        # 社团有权限
-        elif request.user.type == User.CLUB:
-            return True
-
-    # 新建收集权限
-    def has_add_permission(self, request):
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生无权限
-        elif request.user.type == User.STUDENT:
-            return False
-        # 团学组织有权限
-        elif request.user.type == User.ORGANIZATION:
-            return True
-        # 社团有权限
-        elif request.user.type == User.CLUB:
-            return True
-
-    # 修改收集权限
-    def has_change_permission(self, request, obj=None):
-        # 首页不显示编辑按钮
-        if not obj:
-            return False
-        # 具体对象的编辑权限
-        else:
-            # 自己有权限
-            if obj.publisher == request.user:
-                return True
-            # 管理员有权限
-            if request.user.type == User.ADMIN:
-                return True
-            # 学生无权限
-            elif request.user.type == User.STUDENT:
-                return False
-            # 团学组织无权限
-            elif request.user.type == User.ORGANIZATION:
-                return False
-            # 社团无权限
-            elif request.user.type == User.CLUB:
-                return False
-
-    # 删除收集权限
-    def has_delete_permission(self, request, obj=None):
-        # 自己有权限
-        if obj and (obj.publisher == request.user):
-            return True
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生无权限
-        elif request.user.type == User.STUDENT:
-            return False
-        # 团学组织无权限
-        elif request.user.type == User.ORGANIZATION:
-            return False
-        # 社团无权限
-        elif request.user.type == User.CLUB:
-            return False
+        # 其他用户只允许查看自己发布的或公开的和有权限查看的收集
+        return qs.filter(visibility.visible_filter(request.user) | models.Q(publisher=request.user))
+
+    # 权限矩阵：学生不可发布收集，发布者可修改和删除自己的收集
+    permissions = {
+        'module': Permission(*ALL_ROLES),
+        'view': Permission(*ALL_ROLES),
+        'add': Permission(User.ADMIN, User.ORGANIZATION, User.CLUB),
+        'change': Permission(User.ADMIN, rules=(requires_object, is_publisher)),
+        'delete': Permission(User.ADMIN, rules=(is_publisher,)),
+    }
+
+    # 同一请求内只查询一次收集对象
+    def get_object(self, request, object_id, from_field=None):
+        cache = request.__dict__.setdefault('_collecting_objects', {})
+        key = (str(object_id), from_field)
+        if key not in cache:
+            cache[key] = super(CollectingAdmin, self).get_object(request, object_id, from_field)
+        return cache[key]
+
+    # 当前用户在该收集中的提交状态，同一请求内只查询一次
+    def get_submit_state(self, request, obj):
+        cache = request.__dict__.setdefault('_collecting_submit_states', {})
+        if obj.pk not in cache:
+            cache[obj.pk] = Collecting.objects.filter(pk=obj.pk).with_user_summary(request.user).values(
+                'user_submit_count', 'user_latest_submit', 'user_forced'
+            ).get()
+        return cache[obj.pk]
 
     # 根据用户角色决定必须提交的用户可选列表
     def formfield_for_manytomany(self, db_field, request, **kwargs):
@@ -252,9 +256,9 @@ class CollectingAdmin(admin.ModelAdmin):
             # 管理员允许指定所有用户提交
             if request.user.type == User.ADMIN:
                 kwargs["queryset"] = User.objects.all()
-            # 非管理员只允许指定下级用户提交
+            # 非管理员只允许指定直接和间接下级用户提交
             else:
-                kwargs["queryset"] = request.user.members.all()
+                kwargs["queryset"] = request.user.descendants()
         elif db_field.name == 'valid_users':
             # 管理员允许指定所有用户查看
             if request.user.type == User.ADMIN:
@@ -264,53 +268,56 @@ class CollectingAdmin(admin.ModelAdmin):
                 kwargs["queryset"] = User.objects.exclude(type=User.ADMIN)
         return super(CollectingAdmin, self).formfield_for_manytomany(db_field, request, **kwargs)
 
-    # 根据用户角色变更添加页面的内容
-    def modify_add_form(self, request):
+    # 根据用户角色决定添加页面的内容
+    def get_add_layout(self, request):
+        fieldsets, readonly_fields = self.fieldsets, ()
         # 管理员允许自定义发布者
         if request.user.type == User.ADMIN:
-            self.readonly_fields = ()
-            self.fieldsets = (
+            readonly_fields = ()
+            fieldsets = (
                 (None, {
                     'fields': ('title', 'content', 'publisher')
                 }),
                 ('提交限制', {
-                    'fields': ('due_time', 'allow_multiple', 'private', 'valid_users', 'forced', 'collect_from')
+                    'fields': ('due_time', 'allow_multiple', 'upload_limit', 'private', 'valid_users', 'forced', 'collect_from')
                 })
             )
         # 团学组织允许发布强制提交的收集
         elif request.user.type == User.ORGANIZATION:
-            self.readonly_fields = ()
-            self.fieldsets = (
+            readonly_fields = ()
+            fieldsets = (
                 (None, {
                     'fields': ('title', 'content')
                 }),
                 ('提交限制', {
-                    'fields': ('due_time', 'allow_multiple', 'private', 'valid_users', 'forced', 'collect_from')
+                    'fields': ('due_time', 'allow_multiple', 'upload_limit', 'private', 'valid_users', 'forced', 'collect_from')
                 })
             )
         # 社团不允许发布强制提交的收集
         elif request.user.type == User.CLUB:
-            self.readonly_fields = ()
-            self.fieldsets = (
+            readonly_fields = ()
+            fieldsets = (
                 (None, {
                     'fields': ('title', 'content')
                 }),
                 ('提交限制', {
-                    'fields': ('due_time', 'allow_multiple', 'private', 'valid_users')
+                    'fields': ('due_time', 'allow_multiple', 'upload_limit', 'private', 'valid_users')
                 })
             )
+        return fieldsets, readonly_fields
 
-    # 根据用户角色变更修改页面的内容
-    def modify_change_form(self, request, obj):
+    # 根据用户角色决定修改页面的内容
+    def get_change_layout(self, request, obj):
+        fieldsets, readonly_fields = self.fieldsets, self.readonly_fields
         # 管理员拥有一切查看和修改权限
         if request.user.type == User.ADMIN:
-            self.readonly_fields = ('publish_time',)
-            self.fieldsets = (
+            readonly_fields = ('publish_time',)
+            fieldsets = (
                 (None, {
                     'fields': ('title', 'content', 'publisher', 'publish_time')
                 }),
                 ('提交限制', {
-                    'fields': ('due_time', 'allow_multiple', 'private', 'valid_users', 'forced', 'collect_from')
+                    'fields': ('due_time', 'allow_multiple', 'upload_limit', 'private', 'valid_users', 'forced', 'collect_from')
                 })
             )
         # 非管理员用户根据用户角色及是否为发布者决定权限
@@ -319,68 +326,86 @@ class CollectingAdmin(admin.ModelAdmin):
             if obj.publisher == request.user:
                 # 团学组织允许发布强制收集
                 if request.user.type == User.ORGANIZATION:
-                    self.readonly_fields = ('publish_time',)
-                    self.fieldsets = (
+                    readonly_fields = ('publish_time',)
+                    fieldsets = (
                         (None, {
                             'fields': ('title', 'content', 'publish_time')
                         }),
                         ('提交限制', {
-                            'fields': ('due_time', 'allow_multiple', 'private', 'valid_users', 'forced', 'collect_from')
+                            'fields': ('due_time', 'allow_multiple', 'upload_limit', 'private', 'valid_users', 'forced', 'collect_from')
                         })
                     )
                 # 社团不允许发布强制收集
                 elif request.user.type == User.CLUB:
-                    self.readonly_fields = ('publish_time',)
-                    self.fieldsets = (
+                    readonly_fields = ('publish_time',)
+                    fieldsets = (
                         (None, {
                             'fields': ('title', 'content', 'publish_time')
                         }),
                         ('提交限制', {
-                            'fields': ('due_time', 'allow_multiple', 'private', 'valid_users')
+                            'fields': ('due_time', 'allow_multiple', 'upload_limit', 'private', 'valid_users')
                         })
                     )
             # 非发布者只允许查看
             else:
-                self.readonly_fields = ('title', 'content_html', 'publisher', 'publish_time', 'due_time',  'allow_multiple',)
-                self.fieldsets = (
+                readonly_fields = ('title', 'content_html', 'publisher', 'publish_time', 'due_time',  'allow_multiple', 'upload_limit')
+                fieldsets = (
                     (None, {
                         'fields': ('title', 'content_html', 'publisher', 'publish_time')
                     }),
                     ('提交限制', {
-                        'fields': ('due_time',  'allow_multiple',)
+                        'fields': ('due_time',  'allow_multiple', 'upload_limit')
                     })
                 )
+        return fieldsets, readonly_fields
 
-    # 根据用户角色修改列表页内容
-    def changelist_view(self, request, extra_context=None):
-        # 有未提交内容时提示
-        collectings = request.user.forced_collectings.all().filter(due_time__gte=timezone.now())
-        for submitting in request.user.user_submittings.all():
-            collectings = collectings.exclude(id=submitting.collecting.id)
-        if len(collectings.all()) != 0:
-            self.message_user(request, "你有必须提交但尚未提交的内容，请注意查看并及时提交。", 'warning')
+    # 根据用户角色决定列表页的列
+    def get_list_display(self, request):
+        # 管理员的列
+        if request.user.type == User.ADMIN:
+            return ['title', 'publisher', 'publish_time', 'due_time', 'allow_multiple', 'upload_limit', 'private', 'forced', 'submit_count', 'submitted_count', 'handled_count', 'rejected_count', 'progress']
+        # 学生的列
+        elif request.user.type == User.STUDENT:
+            return ['title', 'publisher', 'publish_time', 'due_time', 'allow_multiple']
+        # 团学组织的列
+        elif request.user.type == User.ORGANIZATION:
+            return ['title', 'publisher', 'publish_time', 'due_time', 'allow_multiple', 'upload_limit', 'private', 'forced', 'submit_count', 'submitted_count', 'handled_count', 'rejected_count', 'progress']
+        # 社团的列
+        elif request.user.type == User.CLUB:
+            return ['title', 'publisher', 'publish_time', 'due_time', 'allow_multiple', 'upload_limit', 'private', 'forced', 'submit_count', 'submitted_count', 'handled_count', 'rejected_count', 'progress']
+
+    # 根据用户角色决定列表页的筛选器
+    def get_list_filter(self, request):
         # 管理员的筛选器
         if request.user.type == User.ADMIN:
-            self.list_display = ['title', 'publisher', 'publish_time', 'due_time', 'allow_multiple', 'private', 'forced']
-            self.list_filter = [self.UserPublishedFilter, self.UserForcedFilter, self.DueTimeMissedFilter, self.Submitted, 'allow_multiple', 'private', 'forced']
+            return [self.UserPublishedFilter, self.UserForcedFilter, self.DueTimeMissedFilter, self.Submitted, 'allow_multiple', 'private', 'forced']
         # 学生的筛选器
         elif request.user.type == User.STUDENT:
-            self.list_display = ['title', 'publisher', 'publish_time', 'due_time', 'allow_multiple']
-            self.list_filter = [self.UserForcedFilter, self.DueTimeMissedFilter, self.Submitted, 'allow_multiple']
+            return [self.UserForcedFilter, self.DueTimeMissedFilter, self.Submitted, 'allow_multiple']
         # 团学组织的筛选器
         elif request.user.type == User.ORGANIZATION:
-            self.list_display = ['title', 'publisher', 'publish_time', 'due_time', 'allow_multiple', 'private', 'forced']
-            self.list_filter = [self.UserPublishedFilter, self.UserForcedFilter, self.DueTimeMissedFilter, self.Submitted, 'allow_multiple', 'private', 'forced']
+            return [self.UserPublishedFilter, self.UserForcedFilter, self.DueTimeMissedFilter, self.Submitted, 'allow_multiple', 'private', 'forced']
         # 社团的筛选器
         elif request.user.type == User.CLUB:
-            self.list_display = ['title', 'publisher', 'publish_time', 'due_time', 'allow_multiple', 'private', 'forced']
-            self.list_filter = [self.UserPublishedFilter, self.UserForcedFilter, self.DueTimeMissedFilter, self.Submitted, 'allow_multiple', 'private', 'forced']
+            return [self.UserPublishedFilter, self.UserForcedFilter, self.DueTimeMissedFilter, self.Submitted, 'allow_multiple', 'private', 'forced']
+
+    # 根据用户角色修改列表页内容
+    def changelist_view(self, request, extra_context=None):
+        # 有未提交内容时提示
+        if Collecting.objects.pending_for(request.user, timezone.now()).exists():
+            self.message_user(request, "你有必须提交但尚未提交的内容，请注意查看并及时提交。", 'warning')
         return super().changelist_view(request, extra_context)
 
-    # 增加收集前设置表单字段
-    def add_view(self, request, form_url='', extra_context=None):
-        self.modify_add_form(request)
-        return self.changeform_view(request, None, form_url, extra_context)
+    # 每次请求根据用户角色计算表单字段，不修改共享的实例属性
+    def get_fieldsets(self, request, obj=None):
+        if obj is None:
+            return self.get_add_layout(request)[0]
+        return self.get_change_layout(request, obj)[0]
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is None:
+            return self.get_add_layout(request)[1]
+        return self.get_change_layout(request, obj)[1]
 
     # 修改收集前的操作
     def change_view(self, request, object_id, form_url='', extra_context=None):
@@ -401,52 +426,92 @@ class CollectingAdmin(admin.ModelAdmin):
             # 由提交页面跳转来时返回链接将指向来源的提交
             if request.GET.get('from_subimtting'):
                 return_url = "/CollectingAndSubmitting/submitting/" + str(request.GET['from_subimtting']) + "/change/"
-            STATUS_CHOICE = ('草稿', '已提交', '已处理', '已驳回')
+            # 按当前筛选条件导出全部相关提交
+            if request.GET.get('export') in exports.TABLE_FORMATS:
+                return exports.table_response(
+                    exports.SUBMITTING_HEADS,
+                    exports.submitting_rows(submittings.seek()),
+                    obj.title + '_相关提交',
+                    request.GET['export'],
+                    '相关提交'
+                )
+            # 按游标取出一页提交，并一次性关联查询提交者、收集和发布者
+            page = list(submittings.select_related('user', 'collecting__publisher').seek(parse_cursor(request.GET.get('cursor')))[:self.related_per_page + 1])
+            next_url = None
+            if len(page) > self.related_per_page:
+                page = page[:self.related_per_page]
+                params = request.GET.copy()
+                params['cursor'] = format_cursor(page[-1].submit_time, page[-1].id)
+                next_url = request.path + '?' + params.urlencode()
+            # 第一页和导出链接均不带游标
+            params = request.GET.copy()
+            params.pop('cursor', None)
+            first_url = None
+            if request.GET.get('cursor'):
+                first_url = request.path + '?' + params.urlencode()
+            STATUS_CHOICE = dict(Submitting.STATUS_CHOICE)
             results = [((
                 s.title or '无标题',
                 s.user,
                 s.collecting,
-                s.submit_time.strftime(u'%Y{y}%m{m}%d{d} %H:%M').format(y='年', m='月', d='日'),
+                timezone.localtime(s.submit_time).strftime(u'%Y{y}%m{m}%d{d} %H:%M').format(y='年', m='月', d='日'),
                 STATUS_CHOICE[s.status]
             ), (
                 # 收集者查看草稿状态时无跳转链接
                 None if ((s.status == Submitting.DRAFT) and (request.user == s.collecting.publisher))
                 # 提交者或管理员显示草稿的跳转链接
                 else ("/CollectingAndSubmitting/submitting/" + str(s.id) + "/change/"))
-            ) for s in submittings]
+            ) for s in page]
             heads = ['标题', '提交者', '提交到', '提交时间', '提交状态', '操作']
             content = {
                 "collecting_title": obj.title,
                 "heads": heads,
                 "rows": results,
+                "first_url": first_url,
+                "next_url": next_url,
+                "export_query": params.urlencode(),
                 "return_url": return_url
             }
             return render(request, 'admin/CollectingAndSubmitting/CustomPages/related_list.html', content)
+        # 发布者和管理员下载所有非草稿提交的附件
+        if 'download' in request.GET:
+            if (request.user != obj.publisher) and (request.user.type != User.ADMIN):
+                raise PermissionDenied
+            submittings = Submitting.objects.filter(collecting=obj).exclude(status=Submitting.DRAFT)
+            return exports.zip_response(submittings, obj.title + '.zip')
         # 查看强制提交的提交状态
         if 'submit_status' in request.GET:
-            submitted = []
-            not_submitted = []
-            users = obj.collect_from.all()
-            for user in users:
-                if len(user.user_submittings.distinct() & obj.collecting_submittings.distinct()) != 0:
-                    submitted.append(user)
-                else:
-                    not_submitted.append(user)
-            TYPE_CHOICE = ('管理员', '学生', '团学组织', '社团')
-            CAMPUS_CHOICE = ('跨校区', '八里台', '津南', '泰达', )
+            users = obj.collect_from_status()
+            # 发布者和管理员可导出全部用户的提交情况
+            can_export = (request.user == obj.publisher) or (request.user.type == User.ADMIN)
+            if request.GET.get('export') in exports.TABLE_FORMATS:
+                if not can_export:
+                    raise PermissionDenied
+                return exports.table_response(
+                    exports.SUBMIT_STATUS_HEADS,
+                    exports.submit_status_rows(users),
+                    obj.title + '_提交情况',
+                    request.GET['export'],
+                    '提交情况'
+                )
+            submitted = Paginator(users.filter(submit_count__gt=0), self.status_per_page).get_page(request.GET.get('submitted_page'))
+            not_submitted = Paginator(users.filter(submit_count=0), self.status_per_page).get_page(request.GET.get('not_submitted_page'))
+            STATUS_CHOICE = dict(Submitting.STATUS_CHOICE)
             submitted_results = [((
                 u.name,
-                TYPE_CHOICE[u.type],
-                CAMPUS_CHOICE[u.campus],
-                u.college or '-'
+                u.get_type_display(),
+                u.get_campus_display(),
+                u.college or '-',
+                timezone.localtime(u.latest_submit_time).strftime(u'%Y{y}%m{m}%d{d} %H:%M').format(y='年', m='月', d='日'),
+                STATUS_CHOICE[u.latest_status]
             ), (request.path + "?related=1&user=" + str(u.id))) for u in submitted]
             not_submitted_results = [(
                 u.name,
-                TYPE_CHOICE[u.type],
-                u.campus or '无',
+                u.get_type_display(),
+                u.get_campus_display(),
                 u.college or '无'
             ) for u in not_submitted]
-            submitted_heads = ['名称', '用户类型', '校区', '学院', '操作']
+            submitted_heads = ['名称', '用户类型', '校区', '学院', '最近提交时间', '提交状态', '操作']
             not_submitted_heads = ['名称', '用户类型', '校区', '学院']
             return_url = "/CollectingAndSubmitting/collecting/" + str(object_id) + "/change/"
             content = {
@@ -455,58 +520,51 @@ class CollectingAdmin(admin.ModelAdmin):
                 "not_submitted_heads": not_submitted_heads,
                 "submitted_results": submitted_results,
                 "not_submitted_results": not_submitted_results,
+                "submitted_page": submitted,
+                "not_submitted_page": not_submitted,
+                "can_export": can_export,
                 "return_url": return_url
             }
             return render(request, 'admin/CollectingAndSubmitting/CustomPages/collecting_submit_status.html', content)
         # 非发布者且非管理员则允许提交
         if (request.user != obj.publisher) and (request.user.type != User.ADMIN):
+            state = self.get_submit_state(request, obj)
             # 未超时允许提交
             if (not obj.due_time) or obj.due_time > timezone.now():
                 # 允许多份提交或尚未提交则显示新建提交按钮
-                if obj.allow_multiple or len(obj.collecting_submittings.all() & request.user.user_submittings.all()) == 0:
+                if obj.allow_multiple or state['user_submit_count'] == 0:
                     extra_context['new_submit'] = True
                 # 如果已有一个提交则显示修改提交按钮
-                if len(obj.collecting_submittings.all() & request.user.user_submittings.all()) == 1:
-                    submit = (obj.collecting_submittings.all() & request.user.user_submittings.all())[0].id
-                    extra_context['modify_submit'] = "/CollectingAndSubmitting/submitting/" + str(submit) + "/change/"
+                if state['user_submit_count'] == 1:
+                    extra_context['modify_submit'] = "/CollectingAndSubmitting/submitting/" + str(state['user_latest_submit']) + "/change/"
                 # 如果已有多个提交则显示提交列表按钮
-                if len(obj.collecting_submittings.all() & request.user.user_submittings.all()) > 1:
+                if state['user_submit_count'] > 1:
                     extra_context['user_submit_list'] = request.path + "?related=1"
                 # 如果已有提交则提示
-                if len(obj.collecting_submittings.all() & request.user.user_submittings.all()) != 0:
+                if state['user_submit_count'] != 0:
                     self.message_user(request, "你已提交。")
                 # 如果未提交且需要提交则警告
-                else:
-                    if obj.forced:
-                        try:
-                            request.user.forced_collectings.get(id=object_id)
-                            self.message_user(request, "你必须提交这份材料但尚未提交，请注意及时提交。", 'warning')
-                        except Collecting.DoesNotExist:
-                            pass
+                elif obj.forced and state['user_forced']:
+                    self.message_user(request, "你必须提交这份材料但尚未提交，请注意及时提交。", 'warning')
             # 超时不允许提交
             else:
                 # 如果已有提交则提示
-                if len(obj.collecting_submittings.all() & request.user.user_submittings.all()) != 0:
+                if state['user_submit_count'] != 0:
                     self.message_user(request, "你已提交。")
                 # 如果未提交，则根据是否强制决定显示内容
+                elif obj.forced and state['user_forced']:
+                    self.message_user(request, "你必须提交这份材料但超时未提交，已无法提交。", 'error')
                 else:
-                    if obj.forced:
-                        try:
-                            request.user.forced_collectings.get(id=object_id)
-                            self.message_user(request, "你必须提交这份材料但超时未提交，已无法提交。", 'error')
-                        except Collecting.DoesNotExist:
-                            self.message_user(request, "已超时，不允许提交。", 'warning')
-                    else:
-                        self.message_user(request, "已超时，不允许提交。", 'warning')
+                    self.message_user(request, "已超时，不允许提交。", 'warning')
         # 发布者和管理员允许查看相关提交和提交情况
         if (request.user == obj.publisher) or (request.user.type == User.ADMIN):
             # 允许查看相关提交
             extra_context['collecting_submit_list'] = request.path + "?related=1"
+            # 允许下载所有附件
+            extra_context['download_all'] = request.path + "?download=1"
             # 强制收集的提交显示收集状况
             if obj.forced:
                 extra_context['submit_status'] = request.path + "?submit_status=1"
-        # 设置表单字段
-        self.modify_change_form(request, obj)
         return self.changeform_view(request, object_id, form_url, extra_context)
 
     # 点击按钮
@@ -541,12 +599,6 @@ class CollectingAdmin(admin.ModelAdmin):
         # 取消勾选强制提交时删除必须提交的用户
         if not form.cleaned_data.get('forced'):
             form.cleaned_data['collect_from'] = []
-        # 允许查看的用户为空则取消勾选
-        if (not form.cleaned_data.get('valid_users')) or (len(form.cleaned_data.get('valid_users')) == 0):
-            obj.private = False
-        # 强制提交的用户为空则取消勾选
-        if (not form.cleaned_data.get('collect_from')) or (len(form.cleaned_data.get('collect_from')) == 0):
-            obj.forced = False
         # 强制提交的用户不被允许查看则清除强制提交
         if form.cleaned_data.get('valid_users') and form.cleaned_data.get('collect_from'):
             if len(form.cleaned_data.get('collect_from').difference(form.cleaned_data.get('valid_users')).all()) != 0:
@@ -554,10 +606,29 @@ class CollectingAdmin(admin.ModelAdmin):
                 form.cleaned_data['valid_users'] = form.cleaned_data['valid_users'] | form.cleaned_data['collect_from']
         super(CollectingAdmin, self).save_model(request, obj, form, change)
 
+    # 保存名单和受众规则后的操作
+    def save_related(self, request, form, formsets, change):
+        super(CollectingAdmin, self).save_related(request, form, formsets, change)
+        obj = form.instance
+        # 取消勾选指定用户查看时删除查看规则
+        if not obj.private:
+            obj.audience_rules.filter(purpose=AudienceRule.VIEW).delete()
+        # 取消勾选强制提交时删除提交规则
+        if not obj.forced:
+            obj.audience_rules.filter(purpose=AudienceRule.COLLECT).delete()
+        # 允许查看的用户和规则均为空则取消勾选
+        if obj.private and not (obj.valid_users.exists() or obj.audience_rules.filter(purpose=AudienceRule.VIEW, exclude=False).exists()):
+            obj.private = False
+            obj.save(update_fields=['private'])
+        # 强制提交的用户和规则均为空则取消勾选
+        if obj.forced and not (obj.collect_from.exists() or obj.audience_rules.filter(purpose=AudienceRule.COLLECT, exclude=False).exists()):
+            obj.forced = False
+            obj.save(update_fields=['forced'])
+
 
 # 提交管理
 @admin.register(Submitting)
-class SubmittingAdmin(admin.ModelAdmin):
+class SubmittingAdmin(PermissionMatrixMixin, FullTextSearchMixin, KeysetPaginationMixin, admin.ModelAdmin):
 
     # 自定义根据提交关系筛选
     class Type(SimpleListFilter):
@@ -574,10 +645,7 @@ class SubmittingAdmin(admin.ModelAdmin):
             if self.value() == '0':
                 return queryset.filter(user=request.user)
             elif self.value() == '1':
-                for submitting in queryset:
-                    if submitting.collecting.publisher != request.user:
-                        queryset = queryset.exclude(id=submitting.id)
-                return queryset
+                return queryset.filter(collecting__publisher=request.user)
 
     # 内容显示html
     def content_html(self, submitting):
@@ -586,10 +654,13 @@ class SubmittingAdmin(admin.ModelAdmin):
 
     # 初始化列表页
     list_per_page = 10
+    keyset_field = 'submit_time'
     list_display = ['title', 'user', 'collecting', 'submit_time', 'status']
     list_filter = [Type, 'status']
     search_fields = ('title', 'content', 'collecting__title', 'user__name')
+    actions = ['download_files']
 
+    form = SubmittingForm
     fieldsets = (
         (None, {
             'fields': ('title', 'collecting', 'content', 'file')
@@ -608,152 +679,149 @@ class SubmittingAdmin(admin.ModelAdmin):
             return qs
         # 学生只允许查看自己的提交
         elif request.user.type == User.STUDENT:
-            return (qs.distinct() & request.user.user_submittings.distinct()).distinct()
+            return qs.filter(user=request.user)
         # 团学组织只允许查看提交给自己的或自己的提交
         elif request.user.type == User.ORGANIZATION:
-            user_submittings = qs.distinct() & request.user.user_submittings.distinct()
-            for submitting in qs:
-                if submitting.collecting.publisher != request.user:
-                    qs = qs.exclude(id=submitting.id)
-                qs = qs.exclude(status=Submitting.DRAFT)
-            qs = (qs.distinct() | user_submittings).distinct()
-            return qs
+            return qs.visible_to(request.user)
         # 社团只允许查看提交给自己的或自己的提交
         elif request.user.type == User.CLUB:
-            user_submittings = qs.distinct() & request.user.user_submittings.distinct()
-            for submitting in qs:
-                if submitting.collecting.publisher != request.user:
-                    qs = qs.exclude(id=submitting.id)
-                qs = qs.exclude(status=Submitting.DRAFT)
-            qs = (qs.distinct() | user_submittings).distinct()
-            return qs
-
-    # 提交模块权限
-    def has_module_permission(self, request):
-        # 未登录用户无权限
-        if isinstance(request.user, AnonymousUser):
-            return False
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生无权限
-        elif request.user.type == User.STUDENT:
-            return True
-        # 团学组织有权限
-        elif request.user.type == User.ORGANIZATION:
-            return True
-        # 社团有权限
-        elif request.user.type == User.CLUB:
-            return True
-
-    # 查看提交权限
-    def has_view_permission(self, request, obj=None):
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生有权限
-        elif request.user.type == User.STUDENT:
-            return True
-        # 团学组织有权限
-        elif request.user.type == User.ORGANIZATION:
-            return True
-        # 社团有权限
-        elif request.user.type == User.CLUB:
-            return True
-
-    # 任何人都没有主动添加提交的权限
-    def has_add_permission(self, request):
-        # 管理员无权限
+            return qs.visible_to(request.user)
+
+    # 权限矩阵：任何人都不能主动添加提交，提交者只可修改草稿或被驳回的提交
+    permissions = {
+        'module': Permission(*ALL_ROLES),
+        'view': Permission(*ALL_ROLES),
+        'add': Permission(),
+        'change': Permission(User.ADMIN, rules=(requires_object, owner_edits_draft)),
+        'delete': Permission(User.ADMIN, rules=(owner_deletes_handled,)),
+    }
+
+    # 根据用户角色决定修改页面的内容
+    def get_change_layout(self, request, obj):
+        fieldsets, readonly_fields = self.fieldsets, self.readonly_fields
+        # 管理员拥有一切查看和修改权限
         if request.user.type == User.ADMIN:
-            return False
-        # 学生无权限
-        elif request.user.type == User.STUDENT:
-            return False
-        # 团学组织无权限
-        elif request.user.type == User.ORGANIZATION:
-            return False
-        # 社团无权限
-        elif request.user.type == User.CLUB:
-            return False
-
-    # 修改提交的权限
-    def has_change_permission(self, request, obj=None):
-        # 首页不显示编辑按钮
-        if not obj:
-            return False
-        # 具体对象的编辑权限
+            readonly_fields = ('submit_time',)
+        # 非管理员根据是否为提交者决定权限
         else:
-            # 自己有权限修改草根或被驳回的提交
+            # 添加者可以编辑
             if obj.user == request.user:
-                if obj.status == Submitting.DRAFT or obj.status == Submitting.REJECTED:
-                    return True
-                else:
-                    return False
-            # 管理员有权限
-            if request.user.type == User.ADMIN:
-                return True
-            # 学生无权限
-            elif request.user.type == User.STUDENT:
-                return False
-            # 团学组织无权限
-            elif request.user.type == User.ORGANIZATION:
-                return False
-            # 社团无权限
-            elif request.user.type == User.CLUB:
-                return False
-
-    # 除管理员外任何人都只可删除自己的提交
-    def has_delete_permission(self, request, obj=None):
-        # 自己有权限删除未批准的提交
-        if obj and (obj.user == request.user):
-            if obj.status != Submitting.HANDLED:
-                return False
+                readonly_fields = ('collecting', 'user', 'submit_time', 'status')
+            # 非自己的提交不允许修改
             else:
-                return True
-        # 管理员有权限
+                readonly_fields = ('title', 'collecting', 'content_html', 'file', 'user', 'submit_time', 'status')
+        return fieldsets, readonly_fields
+
+    # 分块上传接口
+    def get_urls(self):
+        urls = [
+            path(
+                '<path:object_id>/upload/',
+                self.admin_site.admin_view(self.upload_start_view),
+                name='CollectingAndSubmitting_submitting_upload'
+            ),
+            path(
+                'upload/<str:token>/',
+                self.admin_site.admin_view(self.upload_view),
+                name='CollectingAndSubmitting_submitting_upload_chunk'
+            ),
+            path(
+                'upload/<str:token>/finalize/',
+                self.admin_site.admin_view(self.upload_finalize_view),
+                name='CollectingAndSubmitting_submitting_upload_finalize'
+            ),
+        ]
+        admin_urls = super(SubmittingAdmin, self).get_urls()
+        change_name = '%s_%s_change' % (self.model._meta.app_label, self.model._meta.model_name)
+        for i, pattern in enumerate(admin_urls):
+            if getattr(pattern, 'name', None) == change_name:
+                admin_urls[i] = path(
+                    str(pattern.pattern),
+                    self.limit_uploads(self.admin_site.admin_view(self.change_view)),
+                    name=change_name
+                )
+        return urls + admin_urls
+
+    # 修改页面随表单上传附件时按所属收集的上限边接收边计数；CSRF检查会读取请求体，
+    # 因此外层免除中间件的检查，安装上传处理器后再由admin_view内的csrf_protect检查
+    def limit_uploads(self, view):
+        @csrf_exempt
+        def wrapper(request, object_id, *args, **kwargs):
+            if request.method == 'POST' and object_id.isdigit():
+                collecting = Collecting.objects.filter(collecting_submittings=object_id).first()
+                if collecting is not None:
+                    request.upload_handlers.insert(0, uploads.UploadLimitHandler(collecting.upload_limit_bytes(), request))
+            return view(request, object_id, *args, **kwargs)
+        return wrapper
+
+    # 将上传时超出上限的字段交给表单
+    def get_form(self, request, obj=None, **kwargs):
+        form = super(SubmittingAdmin, self).get_form(request, obj, **kwargs)
+        return type(form.__name__, (form,), {'upload_limit_exceeded': getattr(request, 'upload_limit_exceeded', None)})
+
+    # 当前用户能否修改该提交的附件
+    def can_upload(self, request, obj):
+        return self.has_change_permission(request, obj) and 'file' not in self.get_readonly_fields(request, obj)
+
+    # 取得当前用户可上传附件的提交
+    def get_upload_target(self, request, object_id):
+        obj = self.get_object(request, object_id)
+        if obj is None:
+            raise Http404
+        if not self.can_upload(request, obj):
+            raise PermissionDenied
+        return obj
+
+    # 创建上传会话
+    def upload_start_view(self, request, object_id):
+        if request.method != 'POST':
+            return HttpResponseNotAllowed(['POST'])
+        return uploads.start(request, self.get_upload_target(request, object_id))
+
+    # 查询已接收的大小或接收一个分块
+    def upload_view(self, request, token):
+        session = get_object_or_404(UploadSession, token=token, user=request.user)
+        self.get_upload_target(request, str(session.submitting_id))
+        if request.method == 'GET':
+            return uploads.status(session)
+        if request.method in ('PUT', 'POST'):
+            return uploads.receive(request, session)
+        return HttpResponseNotAllowed(['GET', 'PUT', 'POST'])
+
+    # 完成上传
+    def upload_finalize_view(self, request, token):
+        if request.method != 'POST':
+            return HttpResponseNotAllowed(['POST'])
+        session = get_object_or_404(UploadSession, token=token, user=request.user)
+        self.get_upload_target(request, str(session.submitting_id))
+        return uploads.finalize(request, session)
+
+    # 根据用户角色决定列表页的筛选器
+    def get_list_filter(self, request):
+        # 管理员的筛选器
         if request.user.type == User.ADMIN:
-            return True
-        # 学生无权限
+            return [self.Type, 'status']
+        # 学生的筛选器
         elif request.user.type == User.STUDENT:
-            return False
-        # 团学组织无权限
+            return ['status']
+        # 团学组织的筛选器
         elif request.user.type == User.ORGANIZATION:
-            return False
-        # 社团无权限
+            return [self.Type, 'status']
+        # 社团的筛选器
         elif request.user.type == User.CLUB:
-            return False
+            return [self.Type, 'status']
 
-    # 根据用户角色变更修改页面的内容
-    def modify_change_form(self, request, obj):
-        # 管理员拥有一切查看和修改权限
-        if request.user.type == User.ADMIN:
-            self.readonly_fields = ('submit_time',)
-        # 非管理员根据是否为提交者决定权限
-        else:
-            # 添加者可以编辑
-            if obj.user == request.user:
-                self.readonly_fields = ('collecting', 'user', 'submit_time', 'status')
-            # 非自己的提交不允许修改
-            else:
-                self.readonly_fields = ('title', 'collecting', 'content_html', 'file', 'user', 'submit_time', 'status')
+    # 每次请求根据用户角色计算只读字段，不修改共享的实例属性
+    def get_readonly_fields(self, request, obj=None):
+        if obj is None:
+            return self.readonly_fields
+        return self.get_change_layout(request, obj)[1]
 
     # 根据用户角色修改列表页内容
     def changelist_view(self, request, extra_context=None):
         # 有被驳回的提交时提醒
         if len(request.user.user_submittings.filter(status=Submitting.REJECTED)) != 0:
             self.message_user(request, "你有被驳回的提交，请及时修改并重新提交。", 'warning')
-        # 管理员的筛选器
-        if request.user.type == User.ADMIN:
-            self.list_filter = [self.Type, 'status']
-        # 学生的筛选器
-        elif request.user.type == User.STUDENT:
-            self.list_filter = ['status']
-        # 团学组织的筛选器
-        if request.user.type == User.ORGANIZATION:
-            self.list_filter = [self.Type, 'status']
-        # 社团的筛选器
-        if request.user.type == User.CLUB:
-            self.list_filter = [self.Type, 'status']
         return super().changelist_view(request, extra_context)
 
     # 修改收集前的操作
@@ -780,8 +848,13 @@ class SubmittingAdmin(admin.ModelAdmin):
             extra_context['collecting_submit_list'] = "/CollectingAndSubmitting/collecting/" + str(obj.collecting.id) + "/change/?related=1&from_subimtting=" + str(obj.id)
         # 显示对应的收集
         extra_context['collecting'] = "/CollectingAndSubmitting/collecting/" + str(obj.collecting.id) + "/change/"
-        # 设置表单字段
-        self.modify_change_form(request, obj)
+        # 可修改附件时较大的附件分块上传
+        if self.can_upload(request, obj):
+            extra_context['chunked_upload'] = {
+                'url': reverse('admin:CollectingAndSubmitting_submitting_upload', args=[obj.id]),
+                'chunk_size': uploads.CHUNK_SIZE,
+                'limit': obj.collecting.upload_limit_bytes(),
+            }
         return self.changeform_view(request, object_id, form_url, extra_context)
 
     # 点击按钮
@@ -812,6 +885,11 @@ class SubmittingAdmin(admin.ModelAdmin):
             return redirect("/CollectingAndSubmitting/submitting/")
         return super().response_change(request, obj)
 
+    # 批量下载所选提交的附件
+    def download_files(self, request, queryset):
+        return exports.zip_response(queryset, '提交附件.zip')
+    download_files.short_description = '下载所选提交的附件'
+
     # 保存模型前的操作
     def save_model(self, request, obj, form, change):
         if change and request.user.type != User.ADMIN:
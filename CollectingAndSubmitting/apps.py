@@ -5,3 +5,7 @@ class CollectingAndSubmittingConfig(AppConfig):
     name = 'CollectingAndSubmitting'
     verbose_name = '团学组织材料收集与提交系统'
     verbose_name_plural = verbose_name
+
+    # 注册信号
+    def ready(self):
+        from . import signals
@@ -0,0 +1,273 @@
+import csv
+import io
+import itertools
+import os
+import re
+import zipfile
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from .models import Submitting
+
+# 超过该大小的附件使用ZIP64格式写入
+ZIP64_LIMIT = zipfile.ZIP64_LIMIT
+
+# 导出表格时每次从数据库游标取出的行数
+EXPORT_CHUNK_SIZE = 2000
+
+# 累积到该大小后输出一段响应
+FLUSH_SIZE = 64 * 1024
+
+# 支持导出的表格格式
+TABLE_FORMATS = ('csv', 'xlsx')
+
+# XML中不允许出现的控制字符
+XML_ILLEGAL = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# 表格软件会当作公式执行的开头字符
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+# 只含一张工作表的XLSX文件的固定部分
+XLSX_PARTS = (
+    ('[Content_Types].xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+     '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+     '<Default Extension="xml" ContentType="application/xml"/>'
+     '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+     '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+     '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+     '</Types>'),
+    ('_rels/.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+     '</Relationships>'),
+    ('xl/_rels/workbook.xml.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+     '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+     '</Relationships>'),
+    # 第二个单元格格式带有quotePrefix，编辑单元格后仍作为文本而不是公式
+    ('xl/styles.xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+     '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+     '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+     '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+     '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+     '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+     '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0" quotePrefix="1"/></cellXfs>'
+     '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+     '</styleSheet>'),
+)
+
+
+# 供zipfile写入的不可定位输出流，生成器每写完一段就取走已写入的数据
+class StreamBuffer:
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+# 下载文件名
+def attachment_response(response, filename):
+    response['Content-Disposition'] = "attachment; filename*=UTF-8''" + quote(filename)
+    return response
+
+
+# 压缩包内附件的文件名：学号_姓名_提交编号_原文件名
+def entry_name(submitting):
+    name = '%s_%s_%d_%s' % (
+        submitting.user.username,
+        submitting.user.name,
+        submitting.id,
+        os.path.basename(submitting.file.name)
+    )
+    return name.replace('/', '_').replace('\\', '_')
+
+
+def local_time(value):
+    return timezone.localtime(value).strftime('%Y-%m-%d %H:%M:%S')
+
+
+# 逐个读取附件写入压缩包，每读一块即输出一块，不使用临时文件
+def iter_zip(submittings, chunk_size=64 * 1024):
+    submittings = submittings.select_related('user__college').order_by('user__username', 'id')
+    status_choice = dict(Submitting.STATUS_CHOICE)
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        # 先写入提交清单
+        with archive.open('清单.csv', 'w') as raw:
+            manifest = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+            writer = csv.writer(manifest)
+            writer.writerow(['学号', '姓名', '学院', '校区', '标题', '提交状态', '提交时间', '附件'])
+            for submitting in submittings.iterator():
+                if not submitting.file:
+                    attachment = '无附件'
+                elif not submitting.file.storage.exists(submitting.file.name):
+                    attachment = '文件缺失'
+                else:
+                    attachment = entry_name(submitting)
+                writer.writerow(csv_row([
+                    submitting.user.username,
+                    submitting.user.name,
+                    submitting.user.college or '',
+                    submitting.user.get_campus_display(),
+                    submitting.title or '',
+                    status_choice[submitting.status],
+                    local_time(submitting.submit_time),
+                    attachment
+                ]))
+                manifest.flush()
+                yield buffer.drain()
+            manifest.close()
+        yield buffer.drain()
+        # 再逐个写入附件
+        for submitting in submittings.exclude(file='').exclude(file=None).iterator():
+            try:
+                source = submitting.file.open('rb')
+            except OSError:
+                continue
+            with source:
+                info = zipfile.ZipInfo(entry_name(submitting), timezone.localtime(submitting.submit_time).timetuple()[:6])
+                with archive.open(info, 'w', force_zip64=submitting.file.size >= ZIP64_LIMIT) as target:
+                    for chunk in source.chunks(chunk_size):
+                        target.write(chunk)
+                        yield buffer.drain()
+            yield buffer.drain()
+    # 写入中央目录
+    yield buffer.drain()
+
+
+# 以流式响应下载提交的附件压缩包
+def zip_response(submittings, filename):
+    response = StreamingHttpResponse(iter_zip(submittings), content_type='application/zip')
+    return attachment_response(response, filename)
+
+
+# 以公式字符开头的文本可能被表格软件执行，CSV中在前面加单引号
+def is_formula(value):
+    return isinstance(value, str) and value.startswith(FORMULA_PREFIXES)
+
+
+def csv_row(row):
+    return ["'" + value if is_formula(value) else value for value in row]
+
+
+# 逐行输出CSV，带BOM以便Excel识别编码
+def iter_csv(heads, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(csv_row(heads))
+    for row in rows:
+        writer.writerow(csv_row(row))
+        if buffer.tell() >= FLUSH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# 文本一律写为内联字符串，以公式字符开头的再加上quotePrefix格式
+def xlsx_cell(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return '<c><v>%s</v></c>' % value
+    value = XML_ILLEGAL.sub('', '' if value is None else str(value))
+    style = ' s="1"' if is_formula(value) else ''
+    return '<c t="inlineStr"%s><is><t xml:space="preserve">%s</t></is></c>' % (style, escape(value))
+
+
+# 逐行写入工作表并压缩输出，单元格使用内联字符串，不需要共享字符串表
+def iter_xlsx(heads, rows, sheet_name='Sheet1'):
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS:
+            archive.writestr(name, content)
+        archive.writestr(
+            'xl/workbook.xml',
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            '<sheets><sheet name="%s" sheetId="1" r:id="rId1"/></sheets></workbook>' % escape(sheet_name, {'"': '&quot;'})
+        )
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            ).encode())
+            for row in itertools.chain([heads], rows):
+                sheet.write(('<row>%s</row>' % ''.join(xlsx_cell(value) for value in row)).encode())
+                if buffer.size >= FLUSH_SIZE:
+                    yield buffer.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield buffer.drain()
+
+
+# 以流式响应导出表格，format为csv或xlsx
+def table_response(heads, rows, filename, format, sheet_name='Sheet1'):
+    if format == 'xlsx':
+        response = StreamingHttpResponse(
+            iter_xlsx(heads, rows, sheet_name),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+    else:
+        response = StreamingHttpResponse(iter_csv(heads, rows), content_type='text/csv; charset=utf-8')
+    return attachment_response(response, filename + '.' + format)
+
+
+# 提交情况导出的表头
+SUBMIT_STATUS_HEADS = ['学号', '名称', '用户类型', '校区', '学院', '提交次数', '最近提交时间', '提交状态']
+
+
+# 提交情况导出的数据行，users为Collecting.collect_from_status()的结果
+def submit_status_rows(users):
+    status_choice = dict(Submitting.STATUS_CHOICE)
+    for user in users.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        submitted = user.submit_count > 0
+        yield [
+            user.username,
+            user.name,
+            user.get_type_display(),
+            user.get_campus_display(),
+            user.college or '',
+            user.submit_count,
+            local_time(user.latest_submit_time) if submitted else '',
+            status_choice[user.latest_status] if submitted else '未提交'
+        ]
+
+
+# 相关提交导出的表头
+SUBMITTING_HEADS = ['标题', '学号', '提交者', '学院', '校区', '提交时间', '提交状态']
+
+
+# 相关提交导出的数据行
+def submitting_rows(submittings):
+    status_choice = dict(Submitting.STATUS_CHOICE)
+    for submitting in submittings.select_related('user__college').iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield [
+            submitting.title or '无标题',
+            submitting.user.username,
+            submitting.user.name,
+            submitting.user.college or '',
+            submitting.user.get_campus_display(),
+            local_time(submitting.submit_time),
+            status_choice[submitting.status]
+        ]
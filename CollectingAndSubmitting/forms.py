@@ -0,0 +1,54 @@
+from django import forms
+from django.core.files.uploadedfile import UploadedFile
+from utils.models import User
+from .models import AudienceRule, Submitting
+
+
+# 提交表单：随表单上传的附件不能超过所属收集的大小上限
+class SubmittingForm(forms.ModelForm):
+    class Meta:
+        model = Submitting
+        fields = '__all__'
+
+    # 上传时已超出上限而被跳过的字段，由SubmittingAdmin.get_form设置
+    upload_limit_exceeded = None
+
+    def clean_file(self):
+        file = self.cleaned_data.get('file')
+        if self.upload_limit_exceeded == 'file' and self.instance.collecting_id:
+            limit = self.instance.collecting.upload_limit_bytes()
+            raise forms.ValidationError('附件不能超过 %d MB。' % (limit // 1024 // 1024))
+        if isinstance(file, UploadedFile) and self.instance.collecting_id:
+            limit = self.instance.collecting.upload_limit_bytes()
+            if file.size > limit:
+                raise forms.ValidationError('附件不能超过 %d MB。' % (limit // 1024 // 1024))
+        return file
+
+
+# 受众规则表单：非管理员的必须提交规则只能指向自己的下级用户，或本组织及下级组织的成员
+class AudienceRuleForm(forms.ModelForm):
+    # 当前操作的用户，由AudienceRuleInline.get_formset设置
+    request_user = None
+
+    class Meta:
+        model = AudienceRule
+        fields = '__all__'
+
+    def clean(self):
+        cleaned_data = super(AudienceRuleForm, self).clean()
+        request_user = self.request_user
+        if request_user is None or request_user.type == User.ADMIN:
+            return cleaned_data
+        if cleaned_data.get('purpose') != AudienceRule.COLLECT or cleaned_data.get('exclude'):
+            return cleaned_data
+        user = cleaned_data.get('user')
+        organization = cleaned_data.get('organization')
+        descendants = request_user.descendants()
+        if user is not None:
+            if not descendants.filter(pk=user.pk).exists():
+                self.add_error('user', '只能指定本组织的下级用户提交。')
+        elif organization is None:
+            self.add_error('organization', '必须提交规则须限定为本组织或下级组织的成员。')
+        elif organization != request_user and not descendants.filter(pk=organization.pk).exists():
+            self.add_error('organization', '只能指定本组织或下级组织的成员提交。')
+        return cleaned_data
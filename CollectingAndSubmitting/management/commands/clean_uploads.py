@@ -0,0 +1,17 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from CollectingAndSubmitting.models import UploadSession
+
+
+# 清理过期的分块上传
+class Command(BaseCommand):
+    help = '删除超过指定时间未继续的分块上传会话及已接收的分块，可定时运行。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='超过该小时数未更新的会话视为过期')
+
+    def handle(self, *args, **options):
+        sessions = UploadSession.objects.filter(updated_time__lt=timezone.now() - timedelta(hours=options['hours']))
+        count = sessions.delete()[1].get(UploadSession._meta.label, 0)
+        self.stdout.write('已删除 %d 个过期的分块上传。' % count)
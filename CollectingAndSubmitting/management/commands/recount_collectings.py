@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from CollectingAndSubmitting.models import Collecting
+
+
+# 根据提交记录重新统计收集的计数
+class Command(BaseCommand):
+    help = '根据提交记录和受众重新统计各收集的提交计数；组织关系或用户信息变更后可运行以校正必须提交人数。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='只统计指定id的收集，默认统计全部')
+
+    def handle(self, *args, **options):
+        collectings = Collecting.objects.all()
+        if options['ids']:
+            collectings = collectings.filter(pk__in=options['ids'])
+        with transaction.atomic():
+            collectings.recount()
+        self.stdout.write('已重新统计 %d 个收集。' % collectings.count())
@@ -1,7 +1,183 @@
+import os
+import uuid
+from collections import defaultdict
+from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
 from ckeditor_uploader.fields import RichTextUploadingField
+from utils import pagination
 from utils.models import College, User
+from utils.storage import attachment_storage
+
+
+# 受众规则查询集
+class AudienceRuleQuerySet(models.QuerySet):
+    # 匹配指定用户的规则
+    def matching(self, user):
+        return self.filter(
+            models.Q(user=user) | (
+                models.Q(user=None)
+                & (models.Q(college=None) | models.Q(college=user.college_id))
+                & (models.Q(campus=None) | models.Q(campus=user.campus))
+                & (models.Q(type=None) | models.Q(type=user.type))
+                & (models.Q(organization=None) | models.Q(organization__in=user.ancestors()))
+            )
+        )
+
+    # 匹配外层查询中用户的规则，用于在用户查询集上展开规则
+    def matching_outer_user(self):
+        return self.filter(
+            models.Q(user=models.OuterRef('pk')) | (
+                models.Q(user=None)
+                & (models.Q(college=None) | models.Q(college=models.OuterRef('college')))
+                & (models.Q(campus=None) | models.Q(campus=models.OuterRef('campus')))
+                & (models.Q(type=None) | models.Q(type=models.OuterRef('type')))
+                & (models.Q(organization=None) | models.Q(organization__descendant_closures__descendant=models.OuterRef('pk')))
+            )
+        )
+
+    # 可能因指定组织的成员变化而改变匹配结果的规则：限定为这些组织或其上级组织
+    def for_organizations(self, organization_ids):
+        return self.filter(
+            models.Q(organization__in=organization_ids)
+            | models.Q(organization__descendant_closures__descendant__in=organization_ids)
+        )
+
+
+# 材料收集查询集
+class CollectingQuerySet(models.QuerySet):
+    # 标注指定用户是否在查看范围和提交范围内：在显式名单中或符合规则，且未被规则排除
+    def with_user_audience(self, user):
+        rules = AudienceRule.objects.filter(collecting=models.OuterRef('pk')).matching(user)
+        return self.annotate(
+            user_listed_view=models.Exists(
+                Collecting.valid_users.through.objects.filter(collecting=models.OuterRef('pk'), user=user)
+            ),
+            user_ruled_view=models.Exists(rules.filter(purpose=AudienceRule.VIEW, exclude=False)),
+            user_excluded_view=models.Exists(rules.filter(purpose=AudienceRule.VIEW, exclude=True)),
+            user_listed_collect=models.Exists(
+                Collecting.collect_from.through.objects.filter(collecting=models.OuterRef('pk'), user=user)
+            ),
+            user_ruled_collect=models.Exists(rules.filter(purpose=AudienceRule.COLLECT, exclude=False)),
+            user_excluded_collect=models.Exists(rules.filter(purpose=AudienceRule.COLLECT, exclude=True))
+        ).annotate(
+            user_viewable=models.Case(
+                models.When(
+                    (models.Q(user_listed_view=True) | models.Q(user_ruled_view=True)) & models.Q(user_excluded_view=False),
+                    then=models.Value(True)
+                ),
+                default=models.Value(False),
+                output_field=models.BooleanField()
+            ),
+            user_forced=models.Case(
+                models.When(
+                    (models.Q(user_listed_collect=True) | models.Q(user_ruled_collect=True)) & models.Q(user_excluded_collect=False),
+                    then=models.Value(True)
+                ),
+                default=models.Value(False),
+                output_field=models.BooleanField()
+            )
+        )
+
+    # 指定用户有权查看的收集，必须提交的用户同样有权查看
+    def visible_to(self, user):
+        return self.with_user_audience(user).filter(
+            models.Q(private=False) | models.Q(publisher=user) | models.Q(user_viewable=True) | models.Q(user_forced=True)
+        )
+
+    # 以关联子查询标注指定用户是否已提交及是否必须提交
+    def with_user_state(self, user):
+        return self.with_user_audience(user).annotate(
+            user_submitted=models.Exists(
+                Submitting.objects.filter(collecting=models.OuterRef('pk'), user=user)
+            )
+        )
+
+    # 在关联条件中限定提交者，标注指定用户的提交数、最近一次提交及是否必须提交
+    def with_user_summary(self, user):
+        return self.with_user_audience(user).annotate(
+            user_submittings=models.FilteredRelation(
+                'collecting_submittings',
+                condition=models.Q(collecting_submittings__user=user)
+            )
+        ).annotate(
+            user_submit_count=models.Count('user_submittings'),
+            user_latest_submit=models.Max('user_submittings__id')
+        )
+
+    # 指定用户已提交的收集，由该用户的提交反查收集，可使用(user, collecting)索引
+    def submitted_by(self, user):
+        return self.filter(pk__in=Submitting.objects.filter(user=user).values('collecting'))
+
+    # 指定用户未提交的收集
+    def not_submitted_by(self, user):
+        return self.exclude(pk__in=Submitting.objects.filter(user=user).values('collecting'))
+
+    # 指定用户必须提交的收集
+    def forced_on(self, user):
+        return self.with_user_audience(user).filter(user_forced=True)
+
+    # 指定用户不必提交的收集
+    def not_forced_on(self, user):
+        return self.with_user_audience(user).filter(user_forced=False)
+
+    # 指定用户必须提交但尚未提交且未超时的收集
+    def pending_for(self, user, now):
+        return self.with_user_state(user).filter(user_forced=True, user_submitted=False, due_time__gte=now)
+
+    # 以F表达式增减计数，并发更新时不会互相覆盖
+    def adjust_counters(self, **deltas):
+        deltas = {field: delta for field, delta in deltas.items() if delta}
+        if deltas:
+            self.update(**{field: models.F(field) + delta for field, delta in deltas.items()})
+
+    # 按提交记录重新统计所有计数
+    def recount(self):
+        submittings = Submitting.objects.filter(collecting=models.OuterRef('pk')).order_by().values('collecting')
+
+        def count(qs):
+            return Coalesce(models.Subquery(qs.annotate(count=models.Count('id')).values('count')), 0)
+
+        self.update(
+            submit_count=count(submittings),
+            submitted_count=count(submittings.filter(status=Submitting.SUBMITTED)),
+            handled_count=count(submittings.filter(status=Submitting.HANDLED)),
+            rejected_count=count(submittings.filter(status=Submitting.REJECTED))
+        )
+        self.recount_required()
+
+    # 必须提交名单受指定规则影响的收集，规则所涉及的用户属性或组织关系变化后需重新统计
+    def ruled_forced(self, rules):
+        return self.filter(forced=True, pk__in=rules.filter(purpose=AudienceRule.COLLECT).values('collecting'))
+
+    # 以一次UPDATE重新统计必须提交的人数及其中已提交的人数，受众名单或规则变化后调用
+    def recount_required(self):
+        # Django 2.2 无法正确解析嵌套的OuterRef，直接引用被更新表的主键列
+        quote = connection.ops.quote_name
+        collecting = RawSQL('%s.%s' % (quote(self.model._meta.db_table), quote(self.model._meta.pk.column)), ())
+        rules = AudienceRule.objects.filter(collecting=collecting, purpose=AudienceRule.COLLECT)
+        audience = User.objects.annotate(
+            listed=models.Exists(Collecting.collect_from.through.objects.filter(collecting=collecting, user=models.OuterRef('pk'))),
+            ruled=models.Exists(rules.filter(exclude=False).matching_outer_user()),
+            excluded=models.Exists(rules.filter(exclude=True).matching_outer_user())
+        ).filter(models.Q(listed=True) | models.Q(ruled=True), excluded=False).order_by()
+
+        # 不分组的COUNT，每个收集恰好得到一行
+        def count(qs):
+            return models.Case(
+                models.When(forced=True, then=models.Subquery(
+                    qs.annotate(count=models.Func(models.F('pk'), function='COUNT')).values('count')
+                )),
+                default=models.Value(0),
+                output_field=models.IntegerField()
+            )
+
+        submitted = audience.annotate(submitted=models.Exists(
+            Submitting.objects.filter(collecting=collecting, user=models.OuterRef('pk')).exclude(status=Submitting.DRAFT)
+        )).filter(submitted=True)
+        self.update(required_count=count(audience), required_submitted_count=count(submitted))
 
 
 # 材料收集
@@ -14,6 +190,8 @@ class Collecting(models.Model):
     file = models.FileField(
         blank=True,
         null=True,
+        max_length=255,
+        storage=attachment_storage,
         verbose_name='附件'
     )
     publisher = models.ForeignKey(
@@ -36,6 +214,12 @@ class Collecting(models.Model):
         help_text='若选中此项，将允许同一用户提交多份材料。',
         verbose_name='允许提交多份材料'
     )
+    upload_limit = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text='单个附件的大小上限，单位为MB；若不设置则使用系统默认上限。',
+        verbose_name='附件大小上限'
+    )
     private = models.BooleanField(
         help_text='若选中此项，须在下方添加有权查看的用户。',
         verbose_name='仅限指定用户查看'
@@ -58,14 +242,165 @@ class Collecting(models.Model):
         help_text='必须勾选“强制要求提交”；如果未勾选，保存时将清空选中的用户并设为非必须提交。',
         verbose_name='必须提交的用户'
     )
+    # 以下计数随提交状态变化增量维护，可通过recount_collectings命令重新统计
+    submit_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='提交总数'
+    )
+    submitted_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='待处理'
+    )
+    handled_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='已处理'
+    )
+    rejected_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='已驳回'
+    )
+    required_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='必须提交人数'
+    )
+    required_submitted_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='必须提交者中已提交人数'
+    )
+
+    objects = CollectingQuerySet.as_manager()
 
     class Meta:
         verbose_name = '材料收集'
         verbose_name_plural = verbose_name
+        # 按列表页筛选条件建立索引
+        indexes = [
+            models.Index(fields=['due_time'], name='collecting_due_time_idx'),
+            models.Index(fields=['private', 'due_time'], name='collecting_private_due_idx'),
+            # 列表页按(publish_time, id)键集分页
+            models.Index(fields=['publish_time'], name='collecting_publish_time_idx'),
+            # 下载附件时按文件名查找所属收集
+            models.Index(fields=['file'], name='collecting_file_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    # 单个附件的大小上限，单位为字节
+    def upload_limit_bytes(self):
+        return (self.upload_limit or getattr(settings, 'SUBMITTING_UPLOAD_LIMIT', 1024)) * 1024 * 1024
+
+    # 将显式名单和受众规则展开为具体的用户查询集，仅在需要具体名单时使用
+    def audience_users(self, purpose):
+        listed = self.valid_users if purpose == AudienceRule.VIEW else self.collect_from
+        rules = AudienceRule.objects.filter(collecting=self, purpose=purpose)
+        return User.objects.annotate(
+            listed=models.Exists(listed.through.objects.filter(collecting=self, user=models.OuterRef('pk'))),
+            ruled=models.Exists(rules.filter(exclude=False).matching_outer_user()),
+            excluded=models.Exists(rules.filter(exclude=True).matching_outer_user())
+        ).filter(models.Q(listed=True) | models.Q(ruled=True), excluded=False)
+
+    # 以一次分组查询标注必须提交的用户在本收集中的提交数、最近提交时间和最近提交状态
+    def collect_from_status(self):
+        latest = Submitting.objects.filter(collecting=self, user=models.OuterRef('pk')).order_by('-submit_time', '-id')
+        return self.audience_users(AudienceRule.COLLECT).select_related('college').annotate(
+            submit_count=models.Count('user_submittings', filter=models.Q(user_submittings__collecting=self)),
+            latest_submit_time=models.Max('user_submittings__submit_time', filter=models.Q(user_submittings__collecting=self)),
+            latest_status=models.Subquery(latest.values('status')[:1])
+        ).order_by('username')
+
+
+# 受众规则：同一规则内的条件同时满足才匹配，未填写的条件不限制
+class AudienceRule(models.Model):
+    collecting = models.ForeignKey(
+        to=Collecting,
+        related_name='audience_rules',
+        on_delete=models.CASCADE,
+        verbose_name='收集'
+    )
+    PURPOSE_CHOICE = (
+        (0, '有权限查看'),
+        (1, '必须提交')
+    )
+    purpose = models.PositiveSmallIntegerField(
+        choices=PURPOSE_CHOICE,
+        default=0,
+        verbose_name='用途'
+    )
+    exclude = models.BooleanField(
+        default=False,
+        help_text='若选中此项，符合条件的用户将被排除。',
+        verbose_name='排除'
+    )
+    user = models.ForeignKey(
+        to=User,
+        blank=True,
+        null=True,
+        related_name='+',
+        on_delete=models.CASCADE,
+        help_text='填写后仅匹配该用户，其余条件将被忽略。',
+        verbose_name='指定用户'
+    )
+    college = models.ForeignKey(
+        to=College,
+        blank=True,
+        null=True,
+        on_delete=models.CASCADE,
+        verbose_name='学院'
+    )
+    campus = models.PositiveSmallIntegerField(
+        choices=User.CAMPUS_CHOICE,
+        blank=True,
+        null=True,
+        verbose_name='校区'
+    )
+    type = models.PositiveSmallIntegerField(
+        choices=User.TYPE_CHOICE,
+        blank=True,
+        null=True,
+        verbose_name='用户类型'
+    )
+    organization = models.ForeignKey(
+        to=User,
+        blank=True,
+        null=True,
+        related_name='+',
+        on_delete=models.CASCADE,
+        verbose_name='所属组织'
+    )
+
+    VIEW = 0
+    COLLECT = 1
+
+    objects = AudienceRuleQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = '受众规则'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return ('排除' if self.exclude else '包含') + str(self.get_purpose_display()) + '的用户'
+
+
+# 材料提交查询集
+class SubmittingQuerySet(models.QuerySet):
+    # 提交给指定用户的非草稿提交及其本人的提交
+    def visible_to(self, user):
+        return self.filter(
+            (models.Q(collecting__in=Collecting.objects.filter(publisher=user)) & ~models.Q(status=Submitting.DRAFT))
+            | models.Q(user=user)
+        )
+
+    # 按提交时间倒序进行键集分页，cursor为上一页最后一条提交的(提交时间, id)
+    def seek(self, cursor=None):
+        return pagination.seek(self, 'submit_time', cursor)
+
 
 # 材料提交
 class Submitting(models.Model):
@@ -95,6 +430,8 @@ class Submitting(models.Model):
     file = models.FileField(
         blank=True,
         null=True,
+        max_length=255,
+        storage=attachment_storage,
         verbose_name='附件'
     )
     submit_time = models.DateTimeField(
@@ -118,12 +455,136 @@ class Submitting(models.Model):
     HANDLED = 2
     REJECTED = 3
 
+    # 各状态对应的收集计数字段，草稿不单独计数
+    STATUS_COUNTERS = {
+        SUBMITTED: 'submitted_count',
+        HANDLED: 'handled_count',
+        REJECTED: 'rejected_count'
+    }
+
+    objects = SubmittingQuerySet.as_manager()
+
     class Meta:
         verbose_name = '材料提交'
         verbose_name_plural = verbose_name
+        # 按列表页筛选和提交情况统计的查询建立复合索引
+        indexes = [
+            models.Index(fields=['collecting', 'user'], name='submitting_collecting_user_idx'),
+            models.Index(fields=['user', 'collecting'], name='submitting_user_collecting_idx'),
+            models.Index(fields=['user', 'status'], name='submitting_user_status_idx'),
+            models.Index(fields=['collecting', 'status'], name='submitting_collecting_st_idx'),
+            # 列表页按(submit_time, id)键集分页
+            models.Index(fields=['submit_time'], name='submitting_submit_time_idx'),
+            # 下载附件时按文件名查找所属提交
+            models.Index(fields=['file'], name='submitting_file_idx'),
+        ]
 
     def __str__(self):
         if self.title:
             return self.title
         else:
             return '未命名提交'
+
+    # 记录读取时的状态，保存时据此增减收集的计数
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Submitting, cls).from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    # 保存提交并在同一事务中更新所属收集的计数
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            old_status = None
+            if not self._state.adding:
+                old_status = getattr(self, '_loaded_status', None)
+                if old_status is None:
+                    old_status = Submitting.objects.filter(pk=self.pk).values_list('status', flat=True).first()
+            super(Submitting, self).save(*args, **kwargs)
+            self.update_counters(old_status, self.status)
+        self._loaded_status = self.status
+
+    # 按状态变化增减所属收集的计数，old_status为None表示新建，new_status为None表示删除
+    def update_counters(self, old_status, new_status):
+        deltas = defaultdict(int)
+        if old_status is None:
+            deltas['submit_count'] += 1
+        if new_status is None:
+            deltas['submit_count'] -= 1
+        if old_status in self.STATUS_COUNTERS:
+            deltas[self.STATUS_COUNTERS[old_status]] -= 1
+        if new_status in self.STATUS_COUNTERS:
+            deltas[self.STATUS_COUNTERS[new_status]] += 1
+        # 在草稿与非草稿之间变化时，若该用户没有其他非草稿提交且必须提交，则增减已提交人数
+        was_submitted = old_status not in (None, self.DRAFT)
+        is_submitted = new_status not in (None, self.DRAFT)
+        if was_submitted != is_submitted:
+            others = Submitting.objects.filter(collecting_id=self.collecting_id, user_id=self.user_id).exclude(
+                pk=self.pk
+            ).exclude(status=self.DRAFT)
+            if not others.exists() and Collecting.objects.filter(pk=self.collecting_id).forced_on(self.user).exists():
+                deltas['required_submitted_count'] += 1 if is_submitted else -1
+        Collecting.objects.filter(pk=self.collecting_id).adjust_counters(**deltas)
+
+
+def _new_token():
+    return uuid.uuid4().hex
+
+
+# 分块上传会话：各分块按偏移依次写入同一个临时文件，全部接收后作为提交的附件
+class UploadSession(models.Model):
+    token = models.CharField(
+        max_length=32,
+        unique=True,
+        default=_new_token,
+        verbose_name='令牌'
+    )
+    submitting = models.ForeignKey(
+        to=Submitting,
+        related_name='upload_sessions',
+        on_delete=models.CASCADE,
+        verbose_name='提交'
+    )
+    user = models.ForeignKey(
+        to=User,
+        related_name='+',
+        on_delete=models.CASCADE,
+        verbose_name='上传者'
+    )
+    filename = models.CharField(max_length=255, verbose_name='文件名')
+    size = models.BigIntegerField(verbose_name='文件大小')
+    offset = models.BigIntegerField(default=0, verbose_name='已接收')
+    # 已接收部分的SHA-256中间状态，完成上传时无需再读一遍文件
+    hash_state = models.BinaryField(
+        blank=True,
+        null=True,
+        editable=False,
+        verbose_name='哈希状态'
+    )
+    sha256 = models.CharField(
+        max_length=64,
+        blank=True,
+        verbose_name='SHA-256'
+    )
+    created_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        verbose_name = '分块上传'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return self.filename
+
+    # 接收分块的临时文件
+    def part_path(self):
+        return Submitting._meta.get_field('file').storage.temp_path('upload-%s.part' % self.token)
+
+    # 同一会话的请求依次处理所用的锁文件
+    def lock_path(self):
+        return Submitting._meta.get_field('file').storage.temp_path('upload-%s.lock' % self.token)
+
+    def discard(self):
+        for path in (self.part_path(), self.lock_path()):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,159 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+from utils import images, media, search, storage
+from utils.models import User
+from . import visibility
+from .models import AudienceRule, Collecting, Submitting, UploadSession
+
+
+# 收集、受众规则、查看或提交名单及组织关系变更时使可见收集缓存失效
+@receiver(post_save, sender=Collecting)
+@receiver(post_delete, sender=Collecting)
+@receiver(post_save, sender=AudienceRule)
+@receiver(post_delete, sender=AudienceRule)
+@receiver(m2m_changed, sender=Collecting.valid_users.through)
+@receiver(m2m_changed, sender=Collecting.collect_from.through)
+@receiver(m2m_changed, sender=User.organizations.through)
+def invalidate_visible_collectings(sender, **kwargs):
+    if kwargs.get('action', 'post_').startswith('post_'):
+        visibility.invalidate()
+
+
+# 删除提交时减少所属收集的计数
+@receiver(post_delete, sender=Submitting)
+def uncount_submitting(sender, instance, **kwargs):
+    instance.update_counters(instance.status, None)
+
+
+# 必须提交的名单或规则变更时重新统计必须提交的人数
+@receiver(post_save, sender=AudienceRule)
+@receiver(post_delete, sender=AudienceRule)
+def recount_rule_collecting(sender, instance, **kwargs):
+    Collecting.objects.filter(pk=instance.collecting_id).recount_required()
+
+
+@receiver(m2m_changed, sender=Collecting.collect_from.through)
+def recount_collect_from(sender, instance, action, reverse, pk_set, **kwargs):
+    # 从用户一侧清空时，清空前记录受影响的收集
+    if action == 'pre_clear' and reverse:
+        instance._cleared_collectings = list(instance.forced_collectings.values_list('id', flat=True))
+    elif action == 'post_clear' and reverse:
+        Collecting.objects.filter(pk__in=instance.__dict__.pop('_cleared_collectings', [])).recount_required()
+    elif action.startswith('post_'):
+        if not reverse:
+            Collecting.objects.filter(pk=instance.pk).recount_required()
+        else:
+            Collecting.objects.filter(pk__in=pk_set).recount_required()
+
+
+# 组织关系变更时，只重新统计按所涉及组织或其上级组织限定规则的收集
+@receiver(m2m_changed, sender=User.organizations.through)
+def recount_organization_rules(sender, instance, action, reverse, pk_set, **kwargs):
+    # 从用户一侧清空前记录其原有的组织
+    if action == 'pre_clear' and not reverse:
+        instance._cleared_organizations = list(instance.organizations.values_list('id', flat=True))
+    elif action.startswith('post_'):
+        if reverse:
+            organization_ids = [instance.pk]
+        elif action == 'post_clear':
+            organization_ids = instance.__dict__.pop('_cleared_organizations', [])
+        else:
+            organization_ids = list(pk_set)
+        if organization_ids:
+            Collecting.objects.ruled_forced(AudienceRule.objects.for_organizations(organization_ids)).recount_required()
+
+
+# 影响规则匹配的用户属性
+AUDIENCE_FIELDS = ('college', 'campus', 'type')
+
+
+# 保存前记录用户原有的学院、校区和类型
+@receiver(pre_save, sender=User)
+def remember_audience_fields(sender, instance, raw=False, update_fields=None, **kwargs):
+    if instance.pk and not raw and (update_fields is None or set(AUDIENCE_FIELDS) & set(update_fields)):
+        instance._saved_audience = sender.objects.filter(pk=instance.pk).values('college_id', 'campus', 'type').first()
+
+
+# 新用户或学院、校区、类型变化的用户，只重新统计规则可能匹配其新旧属性的收集
+@receiver(post_save, sender=User)
+def recount_user_rules(sender, instance, created, raw=False, **kwargs):
+    saved = instance.__dict__.pop('_saved_audience', None)
+    if raw:
+        return
+    rules = AudienceRule.objects.matching(instance)
+    if not created:
+        current = {'college_id': instance.college_id, 'campus': instance.campus, 'type': instance.type}
+        if not saved or saved == current:
+            return
+        rules = rules | AudienceRule.objects.matching(User(pk=instance.pk, **saved))
+    Collecting.objects.ruled_forced(rules).recount_required()
+
+
+# 收集和提交内容变更时更新全文索引
+search.register(Collecting, 'title', 'content')
+search.register(Submitting, 'title', 'content')
+
+
+@receiver(post_save, sender=Collecting)
+@receiver(post_save, sender=Submitting)
+def index_content(sender, instance, update_fields=None, **kwargs):
+    search.index(instance, update_fields)
+
+
+@receiver(post_delete, sender=Collecting)
+@receiver(post_delete, sender=Submitting)
+def unindex_content(sender, instance, **kwargs):
+    search.unindex(instance)
+
+
+# 收集和提交内容中的上传图片引用各宽度的图片
+images.register(Collecting, 'content')
+images.register(Submitting, 'content')
+
+
+@receiver(pre_save, sender=Collecting)
+@receiver(pre_save, sender=Submitting)
+def add_image_srcset(sender, instance, update_fields=None, **kwargs):
+    images.process(instance, update_fields)
+
+
+# 记录内容中尚未处理完的上传图片，处理完成后重新保存以补上srcset
+@receiver(post_save, sender=Collecting)
+@receiver(post_save, sender=Submitting)
+def record_pending_images(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw:
+        images.record_pending(instance, update_fields)
+
+
+# 收集和提交的附件仅允许有权查看者下载
+media.register(Submitting, 'file')
+media.register(Collecting, 'file')
+
+
+# 附件被替换、清除或所属对象被删除时释放原附件的引用
+@receiver(pre_save, sender=Collecting)
+@receiver(pre_save, sender=Submitting)
+def remember_file(sender, instance, update_fields=None, **kwargs):
+    if instance.pk and (update_fields is None or 'file' in update_fields):
+        instance._saved_file = sender.objects.filter(pk=instance.pk).values_list('file', flat=True).first()
+
+
+@receiver(post_save, sender=Collecting)
+@receiver(post_save, sender=Submitting)
+def release_replaced_file(sender, instance, **kwargs):
+    saved_file = instance.__dict__.pop('_saved_file', None)
+    if saved_file and saved_file != instance.file.name:
+        storage.release(instance.file.storage, saved_file)
+
+
+@receiver(post_delete, sender=Collecting)
+@receiver(post_delete, sender=Submitting)
+def release_file(sender, instance, **kwargs):
+    if instance.file:
+        storage.release(instance.file.storage, instance.file.name)
+
+
+# 删除上传会话时删除已接收的分块
+@receiver(post_delete, sender=UploadSession)
+def discard_upload(sender, instance, **kwargs):
+    instance.discard()
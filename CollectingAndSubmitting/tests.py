@@ -1,3 +1,501 @@
-from django.test import TestCase
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from io import StringIO
+from unittest import mock, skipIf
+from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, OperationalError, connection, transaction
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from utils.admin import CustomUserAdmin
+from utils.models import College, StoredFile, User
+from utils.storage import libcrypto
+from . import exports, uploads, visibility
+from .admin import CollectingAdmin
+from .forms import AudienceRuleForm
+from .models import AudienceRule, Collecting, Submitting, UploadSession
 
-# Create your tests here.
+
+# 非管理员的必须提交规则只能指向下级
+class AudienceRuleFormTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin1', name='管理员', type=User.ADMIN)
+        self.org = User.objects.create(username='org1', name='团委', type=User.ORGANIZATION)
+        self.club = User.objects.create(username='club1', name='社团', type=User.CLUB)
+        self.club.organizations.add(self.org)
+        self.member = User.objects.create(username='2000001', name='成员', type=User.STUDENT)
+        self.member.organizations.add(self.club)
+        self.stranger = User.objects.create(username='2000002', name='其他', type=User.STUDENT)
+        self.collecting = Collecting.objects.create(title='收集', content='内容', publisher=self.org, allow_multiple=False, private=False, forced=True)
+
+    def form(self, request_user, **data):
+        data.setdefault('collecting', self.collecting.pk)
+        data.setdefault('purpose', AudienceRule.COLLECT)
+        form_class = type('AudienceRuleForm', (AudienceRuleForm,), {'request_user': request_user})
+        return form_class(data)
+
+    def test_user_must_be_descendant(self):
+        self.assertTrue(self.form(self.org, user=self.member.pk).is_valid())
+        for user in (self.admin, self.stranger, self.org):
+            form = self.form(self.org, user=user.pk)
+            self.assertFalse(form.is_valid())
+            self.assertIn('user', form.errors)
+
+    def test_organization_must_be_self_or_descendant(self):
+        self.assertTrue(self.form(self.org, organization=self.org.pk).is_valid())
+        self.assertTrue(self.form(self.org, organization=self.club.pk).is_valid())
+        self.assertFalse(self.form(self.club, organization=self.org.pk).is_valid())
+        self.assertFalse(self.form(self.org, type=User.STUDENT).is_valid())
+
+    # 查看规则、排除规则和管理员不受限制
+    def test_unrestricted(self):
+        self.assertTrue(self.form(self.org, purpose=AudienceRule.VIEW, user=self.stranger.pk).is_valid())
+        self.assertTrue(self.form(self.org, exclude=True, user=self.stranger.pk).is_valid())
+        self.assertTrue(self.form(self.admin, user=self.stranger.pk).is_valid())
+
+
+# 批量调整组织成员后，非公开收集的可见范围随之更新
+class VisibilityTests(TestCase):
+    def setUp(self):
+        self.org = User.objects.create(username='org1', name='团委', type=User.ORGANIZATION)
+        self.student = User.objects.create(username='2000001', name='学生', type=User.STUDENT)
+        self.collecting = Collecting.objects.create(title='内部收集', content='内容', publisher=self.org, allow_multiple=False, private=True, forced=False)
+        AudienceRule.objects.create(collecting=self.collecting, purpose=AudienceRule.VIEW, organization=self.org)
+        self.user_admin = CustomUserAdmin(User, admin.site)
+        self.request = RequestFactory().get('/')
+        self.request.user = self.org
+
+    def visible(self):
+        return list(Collecting.objects.filter(visibility.visible_filter(self.student)))
+
+    def test_bulk_membership(self):
+        self.assertEqual(self.visible(), [])
+        self.user_admin.add_members(self.request, User.objects.filter(pk=self.student.pk))
+        self.assertEqual(self.visible(), [self.collecting])
+        self.user_admin.remove_members(self.request, User.objects.filter(pk=self.student.pk))
+        self.assertEqual(self.visible(), [])
+
+    # 缓存命中时以缓存的id筛选，不再执行可见范围的子查询；缓存未命中时只查询一次
+    def test_cached_ids(self):
+        self.student.organizations.add(self.org)
+        with self.assertNumQueries(1):
+            condition = visibility.visible_filter(self.student)
+        with self.assertNumQueries(0):
+            self.assertEqual(visibility.visible_filter(self.student), condition)
+        self.assertNotIn('SELECT', str(Collecting.objects.filter(condition).query).split('WHERE', 1)[1])
+        self.assertEqual(list(Collecting.objects.filter(condition)), [self.collecting])
+
+    # 发布者总能在后台看到自己发布的收集
+    def test_admin_publisher(self):
+        other = User.objects.create(username='org2', name='学生会', type=User.ORGANIZATION)
+        self.request.user = other
+        own = Collecting.objects.create(title='自己的收集', content='内容', publisher=other, allow_multiple=False, private=True, forced=False)
+        collecting_admin = CollectingAdmin(Collecting, admin.site)
+        self.assertEqual(list(collecting_admin.get_queryset(self.request)), [own])
+
+    # 可见的非公开收集超过上限时以子查询筛选，不展开为id列表
+    @override_settings(VISIBLE_COLLECTINGS_LIMIT=0)
+    def test_subquery(self):
+        self.student.organizations.add(self.org)
+        sql = str(Collecting.objects.filter(visibility.visible_filter(self.student)).query)
+        self.assertIn('IN (SELECT', sql)
+
+
+# 批量调整组织成员、导入和新增用户后，必须提交的人数随之更新
+class RequiredCountTests(TestCase):
+    def setUp(self):
+        self.org = User.objects.create(username='org1', name='团委', type=User.ORGANIZATION)
+        self.student = User.objects.create(username='2000001', name='学生', type=User.STUDENT)
+        self.collecting = Collecting.objects.create(title='收集', content='内容', publisher=self.org, allow_multiple=False, private=False, forced=True)
+        self.org_rule = AudienceRule.objects.create(collecting=self.collecting, purpose=AudienceRule.COLLECT, organization=self.org)
+        self.request = RequestFactory().get('/')
+        self.request.user = self.org
+
+    def required_count(self):
+        self.collecting.refresh_from_db()
+        return self.collecting.required_count
+
+    def test_bulk_membership(self):
+        user_admin = CustomUserAdmin(User, admin.site)
+        self.assertEqual(self.required_count(), 0)
+        user_admin.add_members(self.request, User.objects.filter(pk=self.student.pk))
+        self.assertEqual(self.required_count(), 1)
+        user_admin.remove_members(self.request, User.objects.filter(pk=self.student.pk))
+        self.assertEqual(self.required_count(), 0)
+
+    def test_new_users(self):
+        self.org_rule.delete()
+        AudienceRule.objects.create(collecting=self.collecting, purpose=AudienceRule.COLLECT, type=User.STUDENT)
+        self.assertEqual(self.required_count(), 1)
+        User.objects.create(username='2000002', name='新生', type=User.STUDENT)
+        self.assertEqual(self.required_count(), 2)
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', delete=False) as f:
+            f.write('学号,姓名\n2000003,导入一\n2000004,导入二\n')
+        self.addCleanup(os.remove, f.name)
+        call_command('import_users', f.name, '--workers', '1', stdout=StringIO())
+        self.assertEqual(self.required_count(), 4)
+
+    def test_attribute_change(self):
+        college = College.objects.create(name='计算机学院')
+        AudienceRule.objects.create(collecting=self.collecting, purpose=AudienceRule.COLLECT, college=college)
+        self.assertEqual(self.required_count(), 0)
+        self.student.college = college
+        self.student.save()
+        self.assertEqual(self.required_count(), 1)
+        self.student.college = None
+        self.student.save()
+        self.assertEqual(self.required_count(), 0)
+
+    def test_clear_organizations(self):
+        self.student.organizations.add(self.org)
+        self.assertEqual(self.required_count(), 1)
+        self.student.organizations.clear()
+        self.assertEqual(self.required_count(), 0)
+
+    # 只重新统计规则可能匹配变化用户的收集，并以一次UPDATE完成
+    def test_scoped_recount(self):
+        other_org = User.objects.create(username='org2', name='学生会', type=User.ORGANIZATION)
+        other = Collecting.objects.create(title='其他', content='内容', publisher=other_org, allow_multiple=False, private=False, forced=True)
+        AudienceRule.objects.create(collecting=other, purpose=AudienceRule.COLLECT, organization=other_org)
+        Collecting.objects.filter(pk=other.pk).update(required_count=99)
+        with CaptureQueriesContext(connection) as queries:
+            self.student.organizations.add(self.org)
+        self.assertEqual(self.required_count(), 1)
+        self.assertEqual(Collecting.objects.get(pk=other.pk).required_count, 99)
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE') and 'required_count' in q['sql']]
+        self.assertEqual(len(updates), 1)
+        User.objects.filter(pk=self.student.pk).update(last_login=None)
+        self.student.save(update_fields=['last_login'])
+        self.assertEqual(Collecting.objects.get(pk=other.pk).required_count, 99)
+
+
+# 分块上传：按偏移续传、分块校验、同一会话的请求互斥，保存失败时不遗留附件引用
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.student = User.objects.create(username='2000001', name='学生', type=User.STUDENT)
+        org = User.objects.create(username='org1', name='团委', type=User.ORGANIZATION)
+        collecting = Collecting.objects.create(title='收集', content='内容', publisher=org, allow_multiple=False, private=False, forced=False)
+        self.submitting = Submitting.objects.create(collecting=collecting, user=self.student, title='提交', content='内容')
+        self.factory = RequestFactory()
+        self.data = b'0123456789' * 10
+
+    def request(self, method, data=None, **extra):
+        request = getattr(self.factory, method)('/', data, **extra)
+        request.user = self.student
+        return request
+
+    def start(self, **data):
+        data.setdefault('filename', 'report.txt')
+        data.setdefault('size', len(self.data))
+        response = uploads.start(self.request('post', data), self.submitting)
+        return UploadSession.objects.get(token=json.loads(response.content)['token'])
+
+    def send(self, session, offset, chunk, **extra):
+        request = self.request('put', chunk, content_type='application/octet-stream', HTTP_X_UPLOAD_OFFSET=str(offset), **extra)
+        return uploads.receive(request, session)
+
+    def test_resume_and_finalize(self):
+        session = self.start(sha256=hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(self.send(session, 0, self.data[:40]).status_code, 200)
+        response = self.send(session, 0, self.data[:40])
+        self.assertEqual((response.status_code, json.loads(response.content)['offset']), (409, 40))
+        bad_checksum = self.send(session, 40, self.data[40:], HTTP_X_CHUNK_SHA256='0' * 64)
+        self.assertEqual(bad_checksum.status_code, 400)
+        self.assertEqual(self.send(session, 40, self.data[40:]).status_code, 200)
+        self.assertEqual(uploads.finalize(self.request('post'), session).status_code, 200)
+        self.submitting.refresh_from_db()
+        with self.submitting.file.open() as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(StoredFile.objects.get(hash=hashlib.sha256(self.data).hexdigest()).refcount, 1)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(uploads.finalize(self.request('post'), session).status_code, 410)
+
+    # 各分块接着保存的哈希中间状态计算，完成上传时不再读取整个文件；缺少中间状态时才读取
+    @skipIf(not libcrypto(), '系统中没有libcrypto')
+    def test_hash_without_rereading(self):
+        digest = hashlib.sha256(self.data).hexdigest()
+        session = self.start()
+        self.send(session, 0, self.data[:30])
+        self.send(session, 30, self.data[30:])
+        with mock.patch.object(uploads, 'file_digest', side_effect=AssertionError('不应重读文件')):
+            self.assertEqual(uploads.finalize(self.request('post'), session).status_code, 200)
+        self.assertEqual(StoredFile.objects.get().hash, digest)
+        other = self.start(filename='other.txt')
+        self.send(other, 0, self.data[:30])
+        UploadSession.objects.filter(pk=other.pk).update(hash_state=None)
+        self.send(other, 30, self.data[30:])
+        with mock.patch.object(uploads, 'file_digest', wraps=uploads.file_digest) as file_digest:
+            self.assertEqual(uploads.finalize(self.request('post'), other).status_code, 200)
+        file_digest.assert_called_once()
+        self.assertEqual(StoredFile.objects.get().refcount, 2)
+
+    # 同一会话已有请求在处理时，其他请求立即返回409，不写入分块文件
+    def test_concurrent_requests_rejected(self):
+        session = self.start()
+        with uploads.session_lock(session) as locked:
+            self.assertTrue(locked)
+            self.assertEqual(self.send(session, 0, self.data).status_code, 409)
+            self.assertEqual(uploads.finalize(self.request('post'), session).status_code, 409)
+        self.assertEqual(os.path.getsize(session.part_path()), 0)
+        self.assertEqual(self.send(session, 0, self.data).status_code, 200)
+
+    def test_failed_save_keeps_no_reference(self):
+        session = self.start()
+        self.send(session, 0, self.data)
+        with mock.patch.object(Submitting, 'save', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                uploads.finalize(self.request('post'), session)
+        self.assertFalse(StoredFile.objects.exists())
+        self.assertTrue(UploadSession.objects.filter(pk=session.pk).exists())
+
+
+# 导出表格时以公式字符开头的文本不会被当作公式
+class ExportTests(SimpleTestCase):
+    rows = [['=HYPERLINK("http://evil")', '+1', '-1', '@SUM(A1)', '正常', -5]]
+
+    def test_csv(self):
+        content = ''.join(exports.iter_csv(['学号', '=标题'], self.rows))
+        self.assertEqual(list(csv.reader(io.StringIO(content.lstrip('﻿')))), [
+            ['学号', "'=标题"],
+            ["'=HYPERLINK(\"http://evil\")", "'+1", "'-1", "'@SUM(A1)", '正常', '-5'],
+        ])
+
+    def test_xlsx(self):
+        with zipfile.ZipFile(io.BytesIO(b''.join(exports.iter_xlsx(['学号'], self.rows)))) as archive:
+            sheet = archive.read('xl/worksheets/sheet1.xml').decode()
+            self.assertIn('quotePrefix="1"', archive.read('xl/styles.xml').decode())
+        self.assertNotIn('<f>', sheet)
+        self.assertEqual(sheet.count('s="1"'), 4)
+        self.assertIn('<c t="inlineStr"><is><t xml:space="preserve">正常</t></is></c>', sheet)
+        self.assertIn('<c><v>-5</v></c>', sheet)
+
+
+# 提交情况页面只向可导出的发布者和管理员显示导出链接
+class SubmitStatusExportTests(TestCase):
+    def setUp(self):
+        self.org = User.objects.create(username='org1', name='团委', type=User.ORGANIZATION)
+        self.student = User.objects.create(username='2000001', name='学生', type=User.STUDENT)
+        self.collecting = Collecting.objects.create(title='收集', content='内容', publisher=self.org, allow_multiple=False, private=False, forced=True)
+        self.collecting.collect_from.add(self.student)
+        self.collecting_admin = CollectingAdmin(Collecting, admin.site)
+
+    def submit_status(self, user, **params):
+        request = RequestFactory().get('/', dict(submit_status=1, **params))
+        request.user = user
+        return self.collecting_admin.change_view(request, str(self.collecting.pk))
+
+    def test_export_links(self):
+        self.assertContains(self.submit_status(self.org), 'export=csv')
+        self.assertNotContains(self.submit_status(self.student), 'export=csv')
+        with self.assertRaises(PermissionDenied):
+            self.submit_status(self.student, export='csv')
+
+
+# 多线程同时处理请求：各角色的表单布局互不影响，并发提交时计数不丢失
+class ConcurrencyTests(TransactionTestCase):
+    threads = 8
+
+    def setUp(self):
+        self.admin = User.objects.create(username='admin1', name='管理员', type=User.ADMIN)
+        self.org = User.objects.create(username='org1', name='团委', type=User.ORGANIZATION)
+        self.students = [
+            User.objects.create(username='20000%02d' % i, name='学生', type=User.STUDENT)
+            for i in range(self.threads)
+        ]
+        self.collecting = Collecting.objects.create(title='收集', content='内容', publisher=self.org, allow_multiple=True, private=False, forced=True)
+        self.collecting.collect_from.set(self.students)
+
+    # 各线程等待同时开始，结束时关闭本线程的数据库连接；SQLite的写锁冲突时整体重试
+    def run_concurrently(self, functions):
+        barrier = threading.Barrier(len(functions))
+        errors = []
+
+        def run(function):
+            try:
+                barrier.wait()
+                for attempt in range(50):
+                    try:
+                        return function()
+                    except OperationalError as e:
+                        if 'locked' not in str(e):
+                            raise
+                        time.sleep(0.01)
+                raise AssertionError('数据库持续被锁定')
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=run, args=(function,)) for function in functions]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if errors:
+            raise errors[0]
+
+    def test_layouts_per_request(self):
+        collecting_admin = admin.site._registry[Collecting]
+        factory = RequestFactory()
+
+        def layout(user):
+            request = factory.get('/')
+            request.user = user
+            return (
+                collecting_admin.get_fieldsets(request, self.collecting),
+                list(collecting_admin.get_readonly_fields(request, self.collecting)),
+                list(collecting_admin.get_list_display(request)),
+                list(collecting_admin.get_list_filter(request)),
+            )
+
+        users = [self.admin, self.org, self.students[0]]
+        expected = {user.pk: layout(user) for user in users}
+        self.assertNotEqual(expected[self.admin.pk], expected[self.students[0].pk])
+        results = []
+
+        def check(user):
+            for i in range(50):
+                results.append(layout(user) == expected[user.pk])
+
+        self.run_concurrently([lambda user=users[i % len(users)]: check(user) for i in range(self.threads)])
+        self.assertEqual(len(results), self.threads * 50)
+        self.assertTrue(all(results))
+
+    def test_concurrent_submissions(self):
+        drafts = [
+            Submitting.objects.create(collecting=self.collecting, user=student, title='草稿', content='内容')
+            for student in self.students
+        ]
+
+        # 同一事务中新建一条提交并提交原有草稿，重试时不会重复新建
+        def submit(student, draft):
+            with transaction.atomic():
+                Submitting.objects.create(collecting=self.collecting, user=student, title='提交', content='内容', status=Submitting.SUBMITTED)
+                draft = Submitting.objects.get(pk=draft.pk)
+                draft.status = Submitting.SUBMITTED
+                draft.save()
+
+        self.run_concurrently([
+            lambda student=student, draft=draft: submit(student, draft)
+            for student, draft in zip(self.students, drafts)
+        ])
+        counted = Collecting.objects.values('submit_count', 'submitted_count', 'required_count', 'required_submitted_count').get(pk=self.collecting.pk)
+        self.assertEqual(counted, {
+            'submit_count': self.threads * 2,
+            'submitted_count': self.threads * 2,
+            'required_count': self.threads,
+            'required_submitted_count': self.threads,
+        })
+        Collecting.objects.filter(pk=self.collecting.pk).recount()
+        self.assertEqual(Collecting.objects.values(*counted).get(pk=self.collecting.pk), counted)
+
+
+# 团学组织和社团的提交列表：提交给自己的非草稿提交和自己的提交，以一次查询取得
+class SubmittingVisibilityTests(TestCase):
+    def setUp(self):
+        self.org = User.objects.create(username='org1', name='团委', type=User.ORGANIZATION)
+        self.club = User.objects.create(username='club1', name='社团', type=User.CLUB)
+        self.student = User.objects.create(username='2000001', name='学生', type=User.STUDENT)
+        self.to_org = Collecting.objects.create(title='团委收集', content='内容', publisher=self.org, allow_multiple=True, private=False, forced=False)
+        self.to_club = Collecting.objects.create(title='社团收集', content='内容', publisher=self.club, allow_multiple=True, private=False, forced=False)
+        self.submitting_admin = admin.site._registry[Submitting]
+
+    def submit(self, collecting, user, status=Submitting.SUBMITTED):
+        return Submitting.objects.create(collecting=collecting, user=user, title='提交', content='内容', status=status)
+
+    def changelist(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        return self.submitting_admin.get_queryset(request)
+
+    def test_visible_rows(self):
+        submitted = self.submit(self.to_org, self.student)
+        self.submit(self.to_org, self.student, Submitting.DRAFT)
+        own = self.submit(self.to_club, self.org, Submitting.DRAFT)
+        others = self.submit(self.to_club, self.student)
+        self.assertEqual(set(self.changelist(self.org)), {submitted, own})
+        self.assertEqual(set(self.changelist(self.club)), {others})
+
+    # 查询数和查询计划不随提交数量变化，也不逐行读取所属收集
+    def test_single_query(self):
+        for i in range(10):
+            self.submit(self.to_org, self.student)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.changelist(self.org)), 10)
+        sql = str(self.changelist(self.org).query)
+        Submitting.objects.bulk_create([
+            Submitting(collecting=self.to_club if i % 2 else self.to_org, user=self.student, title='提交', content='内容', status=Submitting.SUBMITTED)
+            for i in range(500)
+        ])
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.changelist(self.org)), 260)
+        self.assertEqual(str(self.changelist(self.org).query), sql)
+        # 两个条件分别使用collecting和user上的索引，不扫描整个提交表
+        if connection.vendor == 'sqlite':
+            sql, params = self.changelist(self.org).query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plan = [row[-1] for row in cursor.fetchall()]
+            self.assertFalse([detail for detail in plan if detail.startswith('SCAN')])
+
+
+# 随表单上传附件时边接收边按所属收集的上限计数，超出时跳过其余部分并提示错误
+class UploadLimitTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.student = User.objects.create(username='2000001', name='学生', type=User.STUDENT)
+        org = User.objects.create(username='org1', name='团委', type=User.ORGANIZATION)
+        collecting = Collecting.objects.create(title='收集', content='内容', publisher=org, allow_multiple=False, private=False, forced=False, upload_limit=1)
+        self.submitting = Submitting.objects.create(collecting=collecting, user=self.student, title='提交', content='内容')
+        self.url = '/CollectingAndSubmitting/submitting/%d/change/' % self.submitting.pk
+
+    def post(self, size, client=None):
+        client = client or self.client
+        client.force_login(self.student)
+        upload = SimpleUploadedFile('report.bin', b'x' * size)
+        return client.post(self.url, {'title': '提交', 'content': '内容', 'file': upload})
+
+    def test_over_limit(self):
+        received = []
+        original = uploads.UploadLimitHandler.receive_data_chunk
+
+        def receive_data_chunk(handler, raw_data, start):
+            received.append(start + len(raw_data))
+            return original(handler, raw_data, start)
+
+        with mock.patch.object(uploads.UploadLimitHandler, 'receive_data_chunk', receive_data_chunk):
+            response = self.post(3 * 1024 * 1024)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '附件不能超过 1 MB。')
+        # 超出上限后不再接收该文件的后续数据
+        self.assertLess(max(received), 2 * 1024 * 1024)
+        self.submitting.refresh_from_db()
+        self.assertFalse(self.submitting.file)
+
+    def test_within_limit(self):
+        self.assertEqual(self.post(1024).status_code, 302)
+        self.submitting.refresh_from_db()
+        self.assertEqual(self.submitting.file.size, 1024)
+
+    # 外层免除CSRF中间件后，修改页面仍检查CSRF令牌
+    def test_csrf_still_checked(self):
+        self.assertEqual(self.post(1024, Client(enforce_csrf_checks=True)).status_code, 403)
@@ -0,0 +1,208 @@
+import hashlib
+import os
+import re
+from contextlib import contextmanager
+from django.core.files import locks
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.db import transaction
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from utils.models import User
+from utils.storage import ResumableSHA256, file_digest
+from .models import Submitting, UploadSession
+
+# 每次从请求体读取的大小
+READ_SIZE = 64 * 1024
+
+# 客户端每个分块的大小，小于该大小的附件仍随表单一起提交
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# 单个分块请求允许的最大大小
+MAX_CHUNK_SIZE = 4 * CHUNK_SIZE
+
+SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+def error(message, status, session=None):
+    data = {'error': message}
+    if session is not None:
+        data['offset'] = session.offset
+    return JsonResponse(data, status=status)
+
+
+# 会话状态，客户端据此从offset继续上传
+def status(session):
+    return JsonResponse({
+        'token': session.token,
+        'offset': session.offset,
+        'size': session.size,
+        'url': reverse('admin:CollectingAndSubmitting_submitting_upload_chunk', args=[session.token]),
+        'finalize_url': reverse('admin:CollectingAndSubmitting_submitting_upload_finalize', args=[session.token]),
+    })
+
+
+# 创建上传会话，声明的大小超过所属收集的上限时直接拒绝
+def start(request, submitting):
+    filename = os.path.basename(request.POST.get('filename', '').replace('\\', '/')).strip()
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        size = 0
+    if not filename or size <= 0:
+        return error('缺少文件名或文件大小。', 400)
+    limit = submitting.collecting.upload_limit_bytes()
+    if size > limit:
+        return error('附件不能超过 %d MB。' % (limit // 1024 // 1024), 413)
+    sha256 = request.POST.get('sha256', '').lower()
+    session = UploadSession.objects.create(
+        submitting=submitting,
+        user=request.user,
+        filename=filename[:255],
+        size=size,
+        sha256=sha256 if SHA256.match(sha256) else ''
+    )
+    open(session.part_path(), 'wb').close()
+    return status(session)
+
+
+# 会话的独占文件锁，同一会话同时只处理一个分块或完成请求，多进程部署同样有效；未取得锁时为False
+@contextmanager
+def session_lock(session):
+    with open(session.lock_path(), 'ab') as f:
+        # 不支持文件锁时仅依靠按偏移的条件更新；fcntl在无法取得锁时抛出异常且返回值恒为False，
+        # 只有Windows的返回值表示是否取得锁
+        locked = True
+        if locks.LOCK_EX:
+            try:
+                result = locks.lock(f, locks.LOCK_EX | locks.LOCK_NB)
+                locked = bool(result) if os.name == 'nt' else True
+            except OSError:
+                locked = False
+        try:
+            yield locked
+        finally:
+            if locked and locks.LOCK_EX:
+                locks.unlock(f)
+
+
+# 取得锁后重新读取会话，其他请求可能已接收分块或完成上传
+def locked_call(function, request, session):
+    with session_lock(session) as locked:
+        if not locked:
+            return error('正在处理该文件的其他请求，请稍后重试。', 409, session)
+        session = UploadSession.objects.filter(pk=session.pk).first()
+        if session is None:
+            return error('上传已完成或已过期。', 410)
+        return function(request, session)
+
+
+# 接收从X-Upload-Offset开始的一个分块，边读边写入临时文件并计数，超出声明的大小时立即中止；
+# 提供X-Chunk-SHA256时校验分块，校验失败则丢弃该分块
+def receive(request, session):
+    return locked_call(_receive, request, session)
+
+
+def _receive(request, session):
+    try:
+        offset = int(request.META['HTTP_X_UPLOAD_OFFSET'])
+    except (KeyError, ValueError):
+        return error('缺少分块偏移。', 400, session)
+    if offset != session.offset:
+        return error('分块偏移与已接收的大小不一致。', 409, session)
+    remaining = min(session.size - offset, MAX_CHUNK_SIZE)
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length > remaining:
+        return error('分块超出文件大小。', 413, session)
+    path = session.part_path()
+    if not os.path.exists(path):
+        session.delete()
+        return error('上传已过期，请重新选择文件。', 410)
+    checksum = request.META.get('HTTP_X_CHUNK_SHA256', '').lower()
+    chunk_sha = hashlib.sha256()
+    # 接着已接收部分的哈希计算，缺少中间状态时完成上传时再读取整个文件
+    if offset == 0:
+        file_sha = ResumableSHA256.new()
+    elif session.hash_state:
+        file_sha = ResumableSHA256.new(session.hash_state)
+    else:
+        file_sha = None
+    received = 0
+    with open(path, 'r+b') as part:
+        part.seek(offset)
+        part.truncate()
+        while True:
+            data = request.read(READ_SIZE)
+            if not data:
+                break
+            received += len(data)
+            if received > remaining:
+                part.truncate(offset)
+                return error('分块超出文件大小。', 413, session)
+            chunk_sha.update(data)
+            if file_sha is not None:
+                file_sha.update(data)
+            part.write(data)
+        if checksum and chunk_sha.hexdigest() != checksum:
+            part.truncate(offset)
+            return error('分块校验失败，请重新发送。', 400, session)
+    # 以偏移作为条件更新，不支持文件锁时同一分块被重复发送也只有一个请求生效
+    updated = UploadSession.objects.filter(pk=session.pk, offset=offset).update(
+        offset=offset + received,
+        hash_state=file_sha.state() if file_sha is not None else None,
+        updated_time=timezone.now()
+    )
+    if not updated:
+        session.refresh_from_db()
+        return error('分块偏移与已接收的大小不一致。', 409, session)
+    session.offset = offset + received
+    return status(session)
+
+
+# 全部分块接收后将临时文件移入附件存储并设为提交的附件
+def finalize(request, session):
+    return locked_call(_finalize, request, session)
+
+
+def _finalize(request, session):
+    if session.offset != session.size:
+        return error('文件尚未上传完整。', 400, session)
+    path = session.part_path()
+    file_sha = ResumableSHA256.new(session.hash_state) if session.hash_state else None
+    digest = file_sha.hexdigest() if file_sha is not None else file_digest(path)
+    if session.sha256 and digest != session.sha256:
+        session.delete()
+        return error('文件校验失败，请重新上传。', 400)
+    field = Submitting._meta.get_field('file')
+    # 增加引用与保存提交在同一事务中，保存失败时引用数一并回滚
+    with transaction.atomic():
+        name = field.storage.save_temp(path, session.filename, digest, max_length=field.max_length)
+        submitting = session.submitting
+        submitting.file = name
+        # 与表单保存一致，非管理员修改后的提交恢复为草稿
+        if request.user.type != User.ADMIN:
+            submitting.status = Submitting.DRAFT
+        submitting.save()
+        session.delete()
+    return JsonResponse({'name': os.path.basename(name), 'url': submitting.file.url})
+
+
+# 随表单上传附件时边接收边计数，超过所属收集的上限即跳过该文件，不再缓存其余部分；
+# 超限的字段记录在request.upload_limit_exceeded中，由表单给出错误
+class UploadLimitHandler(FileUploadHandler):
+    def __init__(self, limit, request=None):
+        super(UploadLimitHandler, self).__init__(request)
+        self.limit = limit
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.limit:
+            self.request.upload_limit_exceeded = self.field_name
+            raise SkipFile
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
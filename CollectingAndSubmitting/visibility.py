@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import models
+from .models import Collecting
+
+# 可见收集缓存的版本号键，任何影响可见性的修改都会使版本号递增，从而使全部旧缓存失效
+VERSION_KEY = 'visible_collectings_version'
+
+
+# 缓存后端，单进程部署可使用本地内存，多进程部署应配置为文件或数据库等共享缓存
+def get_cache():
+    return caches[getattr(settings, 'VISIBLE_COLLECTINGS_CACHE', 'default')]
+
+
+# 使全部用户的可见收集缓存失效
+def invalidate():
+    cache = get_cache()
+    cache.add(VERSION_KEY, 0, None)
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+# 可见的非公开收集过多、不缓存id列表时记录的标记
+OVERFLOW = 'overflow'
+
+
+# 指定用户有权查看的收集的筛选条件；缓存中按版本号记录该用户可见的非公开收集id，
+# 数量超过上限时只记录标记，改以子查询交给数据库，不展开为过长的id列表
+def visible_filter(user):
+    cache = get_cache()
+    version = cache.get_or_set(VERSION_KEY, 0, None)
+    private = Collecting.objects.filter(private=True).visible_to(user)
+    # 用户类型、学院和校区参与受众规则匹配，一并作为键的一部分
+    key = 'visible_collectings:%s:%s:%s:%s:%s' % (version, user.id, user.type, user.college_id, user.campus)
+    ids = cache.get(key)
+    if ids is None:
+        limit = getattr(settings, 'VISIBLE_COLLECTINGS_LIMIT', 500)
+        # 多取一条即可判断是否超过上限，未超过时这一次查询的结果就是要缓存的列表
+        ids = list(private.order_by('id').values_list('id', flat=True)[:limit + 1])
+        if len(ids) > limit:
+            ids = OVERFLOW
+        cache.set(key, ids, getattr(settings, 'VISIBLE_COLLECTINGS_TIMEOUT', 3600))
+    if ids == OVERFLOW:
+        return models.Q(private=False) | models.Q(id__in=private.values('id'))
+    if not ids:
+        return models.Q(private=False)
+    return models.Q(private=False) | models.Q(id__in=ids)
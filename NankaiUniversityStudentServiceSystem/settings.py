@@ -85,6 +85,28 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # 可见收集缓存，多进程部署时应改为文件或数据库缓存，例如：
+    # 'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    # 'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    'visibility': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'visibility',
+    },
+}
+
+# 可见收集缓存使用的缓存、过期时间（秒），以及缓存id列表的最大长度，超过时改由数据库子查询筛选
+VISIBLE_COLLECTINGS_CACHE = 'visibility'
+VISIBLE_COLLECTINGS_TIMEOUT = 3600
+VISIBLE_COLLECTINGS_LIMIT = 500
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -129,10 +151,26 @@ STATICFILES_DIRS = (
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# 媒体文件由Django检查权限后交给前端服务器传输：None为由Django直接输出，
+# 'x-sendfile'适用于Apache的mod_xsendfile，'x-accel-redirect'适用于Nginx，
+# 此时需配置一个internal的location，以MEDIA_ACCEL_REDIRECT_LOCATION为前缀并alias到MEDIA_ROOT
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_REDIRECT_LOCATION = '/protected-media/'
+
+# 未设置上限的收集中单个附件的大小上限，单位为MB
+SUBMITTING_UPLOAD_LIMIT = 1024
+
 
 # 富文本编辑器
 CKEDITOR_UPLOAD_PATH = 'upload/'
-CKEDITOR_IMAGE_BACKEND = 'pillow'
+# 上传的图片摆正、去除EXIF并缩小到CKEDITOR_IMAGE_MAX_SIZE以内后重新编码为CKEDITOR_IMAGE_FORMAT，
+# 后台线程再生成CKEDITOR_IMAGE_WIDTHS中各宽度的图片，保存内容时以srcset引用
+CKEDITOR_IMAGE_BACKEND = 'utils.images.ImageBackend'
+CKEDITOR_IMAGE_MAX_SIZE = 1920
+CKEDITOR_IMAGE_WIDTHS = (480, 960)
+CKEDITOR_IMAGE_FORMAT = 'WEBP'
+CKEDITOR_IMAGE_QUALITY = 75
+CKEDITOR_IMAGE_WORKERS = 2
 CKEDITOR_BROWSE_SHOW_DIRS = True
 CKEDITOR_RESTRICT_BY_USER = True
 CKEDITOR_CONFIGS = {
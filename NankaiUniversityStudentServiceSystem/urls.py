@@ -1,18 +1,20 @@
 from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.models import Group
-from django.urls import include, path
+from django.urls import path
 from django.conf import settings
-from django.conf.urls.static import static
-from utils.views import RegisterView
+from django.views.decorators.cache import never_cache
+from utils.views import RegisterView, browse_files, serve_media, upload_file
 
 urlpatterns = [
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', serve_media, name='media'),
     path('', admin.site.urls),
-    path('ckeditor/', include('ckeditor_uploader.urls')),
+    # 富文本编辑器的上传和浏览，上传的文件记录到数据库中，浏览时分页查询
+    path('ckeditor/upload/', staff_member_required(upload_file), name='ckeditor_upload'),
+    path('ckeditor/browse/', never_cache(staff_member_required(browse_files)), name='ckeditor_browse'),
     path('register', RegisterView.as_view(), name='register')
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-
 # 设置标题
 admin.site.site_header = '南开大学团委学生服务系统'
 admin.site.site_title = '南开大学团委学生服务系统'
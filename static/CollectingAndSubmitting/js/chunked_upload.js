@@ -0,0 +1,158 @@
+// 较大的附件选择后立即分块上传，网络中断后重新选择同一文件可从已上传的位置继续
+(function () {
+    'use strict';
+    var box = document.getElementById('chunked-upload');
+    var input = document.querySelector('#submitting_form input[type=file][name=file]');
+    if (!box || !input || !window.fetch) {
+        return;
+    }
+    var startUrl = box.dataset.url;
+    var chunkSize = parseInt(box.dataset.chunkSize, 10);
+    var limit = parseInt(box.dataset.limit, 10);
+    var csrfToken = document.querySelector('#submitting_form input[name=csrfmiddlewaretoken]').value;
+    // 网络错误时的重试次数
+    var retries = 5;
+    input.parentNode.appendChild(box);
+
+    function show(text) {
+        box.textContent = text;
+    }
+
+    function setBusy(busy) {
+        var buttons = document.querySelectorAll('#submitting_form input[type=submit]');
+        for (var i = 0; i < buttons.length; i++) {
+            buttons[i].disabled = busy;
+        }
+    }
+
+    function wait(ms) {
+        return new Promise(function (resolve) {
+            setTimeout(resolve, ms);
+        });
+    }
+
+    // 发送请求并解析JSON，返回的对象带有HTTP状态码
+    function request(method, url, body, headers) {
+        headers = headers || {};
+        headers['X-CSRFToken'] = csrfToken;
+        return fetch(url, {method: method, body: body, headers: headers, credentials: 'same-origin'}).then(function (response) {
+            return response.json().then(function (data) {
+                data.status = response.status;
+                return data;
+            }, function () {
+                return {status: response.status, error: '上传失败（' + response.status + '）。'};
+            });
+        });
+    }
+
+    // 计算分块的SHA-256，浏览器不支持时不校验
+    function digest(blob) {
+        if (!(window.crypto && crypto.subtle && blob.arrayBuffer)) {
+            return Promise.resolve(null);
+        }
+        return blob.arrayBuffer().then(function (buffer) {
+            return crypto.subtle.digest('SHA-256', buffer);
+        }).then(function (hash) {
+            return Array.prototype.map.call(new Uint8Array(hash), function (b) {
+                return ('0' + b.toString(16)).slice(-2);
+            }).join('');
+        });
+    }
+
+    function storageKey(file) {
+        return 'chunked-upload:' + startUrl + ':' + file.name + ':' + file.size + ':' + file.lastModified;
+    }
+
+    // 继续之前未完成的上传，没有时新建上传会话
+    function begin(file) {
+        var saved = localStorage.getItem(storageKey(file));
+        var resumed = saved ? request('GET', saved) : Promise.resolve(null);
+        return resumed.then(function (data) {
+            if (data && data.status === 200) {
+                return data;
+            }
+            var form = new FormData();
+            form.append('filename', file.name);
+            form.append('size', file.size);
+            return request('POST', startUrl, form).then(function (data) {
+                if (data.status !== 200) {
+                    throw new Error(data.error);
+                }
+                localStorage.setItem(storageKey(file), data.url);
+                return data;
+            });
+        });
+    }
+
+    // 从offset开始依次发送分块，全部发送后完成上传
+    function send(file, session, offset, retriesLeft) {
+        if (offset >= file.size) {
+            return request('POST', session.finalize_url).then(function (data) {
+                if (data.status !== 200) {
+                    throw new Error(data.error);
+                }
+                return data;
+            });
+        }
+        show('正在上传 ' + file.name + '：' + Math.floor(offset * 100 / file.size) + '%');
+        var chunk = file.slice(offset, offset + chunkSize);
+        return digest(chunk).then(function (hash) {
+            var headers = {'Content-Type': 'application/octet-stream', 'X-Upload-Offset': String(offset)};
+            if (hash) {
+                headers['X-Chunk-SHA256'] = hash;
+            }
+            return request('PUT', session.url, chunk, headers);
+        }).then(function (data) {
+            // 成功或偏移不一致时从服务器记录的位置继续
+            if (data.status === 200 || data.status === 409) {
+                return send(file, session, data.offset, retries);
+            }
+            // 校验失败时重新发送该分块
+            if (data.status === 400 && typeof data.offset === 'number' && retriesLeft > 0) {
+                return send(file, session, data.offset, retriesLeft - 1);
+            }
+            throw new Error(data.error);
+        }, function () {
+            // 网络错误时等待后查询已接收的大小再继续
+            if (retriesLeft <= 0) {
+                throw new Error('网络中断，重新选择同一文件可继续上传。');
+            }
+            return wait(2000 * (retries - retriesLeft + 1)).then(function () {
+                return request('GET', session.url);
+            }).then(function (data) {
+                return send(file, session, data.offset, retriesLeft - 1);
+            }, function () {
+                return send(file, session, offset, retriesLeft - 1);
+            });
+        });
+    }
+
+    input.addEventListener('change', function () {
+        var file = input.files[0];
+        if (!file) {
+            return;
+        }
+        if (file.size > limit) {
+            input.value = '';
+            show('附件不能超过 ' + Math.floor(limit / 1024 / 1024) + ' MB。');
+            return;
+        }
+        // 较小的附件随表单一起提交
+        if (file.size <= chunkSize) {
+            show('');
+            return;
+        }
+        input.value = '';
+        setBusy(true);
+        begin(file).then(function (session) {
+            return send(file, session, session.offset, retries);
+        }).then(function (data) {
+            localStorage.removeItem(storageKey(file));
+            show('附件 ' + data.name + ' 已上传，提交前仍可修改其他内容。');
+        }).catch(function (e) {
+            show(e.message || '上传失败，请重试。');
+        }).then(function () {
+            setBusy(false);
+        });
+    });
+})();
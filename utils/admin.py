@@ -1,157 +1,69 @@
 from django.contrib import admin
 from django.contrib.admin import SimpleListFilter
 from django.contrib.auth.admin import UserAdmin
-from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
 from django.http import HttpResponseRedirect
 from django.utils import timezone
+from CollectingAndSubmitting import visibility
+from CollectingAndSubmitting.models import AudienceRule, Collecting
 from .models import *
+from .permissions import ALL_ROLES, Permission, PermissionMatrixMixin, requires_object
+from .pagination import KeysetPaginationMixin
+from .search import FullTextSearchMixin
+from .user_picker import UserPickerMixin
 
 
-# 学院管理
-@admin.register(College)
-class CollegeAdmin(admin.ModelAdmin):
-
-    list_per_page = 10
+# 用户本人有权限
+def is_self(request, obj):
+    if obj == request.user:
+        return True
 
-    def has_module_permission(self, request):
-        # 未登录用户无权限
-        if isinstance(request.user, AnonymousUser):
-            return False
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生无权限
-        elif request.user.type == User.STUDENT:
-            return False
-        # 团学组织无权限
-        elif request.user.type == User.ORGANIZATION:
-            return False
-        # 社团无权限
-        elif request.user.type == User.CLUB:
-            return False
 
-    def has_view_permission(self, request, obj=None):
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生无权限
-        elif request.user.type == User.STUDENT:
-            return False
-        # 团学组织无权限
-        elif request.user.type == User.ORGANIZATION:
-            return False
-        # 社团无权限
-        elif request.user.type == User.CLUB:
-            return False
+# 管理员只可回复未回复的反馈
+def admin_replies_unreplied(request, obj):
+    if request.user.type == User.ADMIN:
+        return obj.status == Feedback.NOT_REPLIED
 
-    def has_change_permission(self, request, obj=None):
-        # 首页不显示编辑按钮
-        if not obj:
-            return False
-        # 具体对象的编辑权限
-        else:
-            # 管理员有权限更改
-            if request.user.type == User.ADMIN:
-                return True
-            # 学生无权限
-            elif request.user.type == User.STUDENT:
-                return False
-            # 团学组织无权限
-            elif request.user.type == User.ORGANIZATION:
-                return False
-            # 社团无权限
-            elif request.user.type == User.CLUB:
-                return False
 
-    def has_add_permission(self, request, obj=None):
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生无权限
-        elif request.user.type == User.STUDENT:
-            return False
-        # 团学组织无权限
-        elif request.user.type == User.ORGANIZATION:
-            return False
-        # 社团无权限
-        elif request.user.type == User.CLUB:
-            return False
+# 反馈者只可删除自己未回复的反馈
+def owner_deletes_unreplied(request, obj):
+    if obj and obj.user_id == request.user.id:
+        return obj.status == Feedback.NOT_REPLIED
 
 
-@admin.register(AntiRobot)
-class AntiRobotAdmin(admin.ModelAdmin):
+# 学院管理
+@admin.register(College)
+class CollegeAdmin(PermissionMatrixMixin, admin.ModelAdmin):
 
     list_per_page = 10
-    list_display = ('question', 'hint', 'answer')
 
-    def has_module_permission(self, request):
-        # 未登录用户无权限
-        if isinstance(request.user, AnonymousUser):
-            return False
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生无权限
-        elif request.user.type == User.STUDENT:
-            return False
-        # 团学组织无权限
-        elif request.user.type == User.ORGANIZATION:
-            return False
-        # 社团无权限
-        elif request.user.type == User.CLUB:
-            return False
+    # 权限矩阵：仅管理员可查看、添加和修改
+    permissions = {
+        'module': Permission(User.ADMIN),
+        'view': Permission(User.ADMIN),
+        'add': Permission(User.ADMIN),
+        'change': Permission(User.ADMIN, rules=(requires_object,)),
+    }
 
-    def has_view_permission(self, request, obj=None):
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生无权限
-        elif request.user.type == User.STUDENT:
-            return False
-        # 团学组织无权限
-        elif request.user.type == User.ORGANIZATION:
-            return False
-        # 社团无权限
-        elif request.user.type == User.CLUB:
-            return False
 
-    def has_change_permission(self, request, obj=None):
-        # 首页不显示编辑按钮
-        if not obj:
-            return False
-        # 具体对象的编辑权限
-        else:
-            # 管理员有权限更改
-            if request.user.type == User.ADMIN:
-                return True
-            # 学生无权限
-            elif request.user.type == User.STUDENT:
-                return False
-            # 团学组织无权限
-            elif request.user.type == User.ORGANIZATION:
-                return False
-            # 社团无权限
-            elif request.user.type == User.CLUB:
-                return False
+@admin.register(AntiRobot)
+class AntiRobotAdmin(PermissionMatrixMixin, admin.ModelAdmin):
 
-    def has_add_permission(self, request, obj=None):
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生无权限
-        elif request.user.type == User.STUDENT:
-            return False
-        # 团学组织无权限
-        elif request.user.type == User.ORGANIZATION:
-            return False
-        # 社团无权限
-        elif request.user.type == User.CLUB:
-            return False
+    list_per_page = 10
+    list_display = ('question', 'hint', 'answer')
+
+    # 权限矩阵：仅管理员可查看、添加和修改
+    permissions = {
+        'module': Permission(User.ADMIN),
+        'view': Permission(User.ADMIN),
+        'add': Permission(User.ADMIN),
+        'change': Permission(User.ADMIN, rules=(requires_object,)),
+    }
 
 
 # 用户管理
 @admin.register(User)
-class CustomUserAdmin(UserAdmin):
+class CustomUserAdmin(PermissionMatrixMixin, KeysetPaginationMixin, UserPickerMixin, UserAdmin):
 
     # 自定义根据是否为成员筛选
     class Member(SimpleListFilter):
@@ -172,17 +84,17 @@ class CustomUserAdmin(UserAdmin):
                 return queryset.filter(id=user.id)
             # 下属学生
             elif self.value() == '1':
-                return (queryset.filter(type=User.STUDENT) & user.members.all()).exclude(id=user.id)
+                return queryset.filter(type=User.STUDENT, ancestor_closures__ancestor=user)
             # 下属组织和社团
             elif self.value() == '2':
-                return ((queryset.filter(type=User.STUDENT) | queryset.filter(type=User.CLUB)) & user.members.all()).exclude(id=user.id)
+                return queryset.filter(type__in=(User.ORGANIZATION, User.CLUB), ancestor_closures__ancestor=user)
 
     # 初始化列表页
     list_per_page = 10
     list_display = ('name', 'type', 'campus', 'college', 'description')
     list_filter = ('type', 'campus', Member)
     search_fields = ('username', 'name', 'college__name', 'organizations__name')
-    actions = ['set_member', 'unset_member']
+    actions = ['set_member', 'set_filtered_member', 'unset_member']
 
     # 初始化详情页全部权限
     fieldsets = (
@@ -197,7 +109,7 @@ class CustomUserAdmin(UserAdmin):
         })
     )
     add_fieldsets = fieldsets
-    filter_horizontal = ('organizations',)
+    user_picker_fields = ('organizations',)
     readonly_fields = ()
 
     # 根据用户角色筛选查询集
@@ -216,91 +128,14 @@ class CustomUserAdmin(UserAdmin):
         elif request.user.type == User.CLUB:
             return qs.exclude(type=User.ADMIN).exclude(type=User.ORGANIZATION)
 
-    # 用户模块权限
-    def has_module_permission(self, request):
-        # 未登录用户无权限
-        if isinstance(request.user, AnonymousUser):
-            return False
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生无权限
-        elif request.user.type == User.STUDENT:
-            return False
-        # 团学组织有权限
-        elif request.user.type == User.ORGANIZATION:
-            return True
-        # 社团有权限
-        elif request.user.type == User.CLUB:
-            return True
-
-    # 查看用户权限
-    def has_view_permission(self, request, obj=None):
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生无权限
-        elif request.user.type == User.STUDENT:
-            return False
-        # 团学组织有权限
-        elif request.user.type == User.ORGANIZATION:
-            return True
-        # 社团有权限
-        elif request.user.type == User.CLUB:
-            return True
-
-    # 新建用户权限
-    def has_add_permission(self, request):
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生无权限
-        elif request.user.type == User.STUDENT:
-            return False
-        # 团学组织有权限
-        elif request.user.type == User.ORGANIZATION:
-            return True
-        # 社团无权限
-        elif request.user.type == User.CLUB:
-            return False
-
-    # 修改账户权限
-    def has_change_permission(self, request, obj=None):
-        # 首页不显示编辑按钮
-        if not obj:
-            return False
-        # 具体对象的编辑权限
-        else:
-            # 用户有权更改自己的信息
-            if obj == request.user:
-                return True
-            # 管理员或自己有权限更改
-            if request.user.type == User.ADMIN:
-                return True
-            # 学生无权限
-            elif request.user.type == User.STUDENT:
-                return False
-            # 团学组织无权限
-            elif request.user.type == User.ORGANIZATION:
-                return False
-            # 社团无权限
-            elif request.user.type == User.CLUB:
-                return False
-
-    # 删除账户权限
-    def has_delete_permission(self, request, obj=None):
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生无权限
-        elif request.user.type == User.STUDENT:
-            return False
-        # 团学组织无权限
-        elif request.user.type == User.ORGANIZATION:
-            return False
-        # 社团无权限
-        elif request.user.type == User.CLUB:
-            return False
+    # 权限矩阵：学生无权进入用户模块；用户有权更改自己的信息
+    permissions = {
+        'module': Permission(User.ADMIN, User.ORGANIZATION, User.CLUB),
+        'view': Permission(User.ADMIN, User.ORGANIZATION, User.CLUB),
+        'add': Permission(User.ADMIN, User.ORGANIZATION),
+        'change': Permission(User.ADMIN, rules=(requires_object, is_self)),
+        'delete': Permission(User.ADMIN),
+    }
 
     # 根据用户角色决定下拉选单内容
     def formfield_for_choice_field(self, db_field, request, **kwargs):
@@ -321,12 +156,19 @@ class CustomUserAdmin(UserAdmin):
                 )
         return super(CustomUserAdmin, self).formfield_for_choice_field(db_field, request, **kwargs)
 
-    # 根据用户角色变更增添页面内容
-    def modify_add_form(self, request):
+    # 上级组织只能从当前用户可查看的团学组织和社团中选择
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        if db_field.name == 'organizations':
+            kwargs['queryset'] = self.get_queryset(request).filter(type__in=(User.ORGANIZATION, User.CLUB))
+        return super(CustomUserAdmin, self).formfield_for_manytomany(db_field, request, **kwargs)
+
+    # 根据用户角色决定增添页面内容
+    def get_add_layout(self, request):
+        fieldsets, readonly_fields = self.add_fieldsets, self.readonly_fields
         # 管理员允许所有权限
         if request.user.type == User.ADMIN:
-            self.readonly_fields = ()
-            self.fieldsets = (
+            readonly_fields = ()
+            fieldsets = (
                 (None, {
                     'fields': ('username', 'password1', 'password2')
                 }),
@@ -337,11 +179,10 @@ class CustomUserAdmin(UserAdmin):
                     'fields': ('type', 'organizations')
                 })
             )
-            self.add_fieldsets = self.fieldsets
         # 组织不可主动定义用户所属组织
         elif request.user.type == User.ORGANIZATION:
-            self.readonly_fields = ()
-            self.fieldsets = (
+            readonly_fields = ()
+            fieldsets = (
                 (None, {
                     'fields': ('username', 'password1', 'password2')
                 }),
@@ -352,14 +193,15 @@ class CustomUserAdmin(UserAdmin):
                     'fields': ('type',)
                 })
             )
-            self.add_fieldsets = self.fieldsets
+        return fieldsets, readonly_fields
 
-    # 根据用户角色变更修改页面内容
-    def modify_change_form(self, request, obj):
+    # 根据用户角色决定修改页面内容
+    def get_change_layout(self, request, obj):
+        fieldsets, readonly_fields = self.fieldsets, self.readonly_fields
         # 管理员拥有全部查看和修改权限
         if request.user.type == User.ADMIN:
-            self.readonly_fields = ()
-            self.fieldsets = (
+            readonly_fields = ()
+            fieldsets = (
                 (None, {
                     'fields': ('username', 'password')
                 }),
@@ -374,16 +216,16 @@ class CustomUserAdmin(UserAdmin):
         else:
             # 学生不可更改用户名，用户类别和所属组织
             if request.user.type == User.STUDENT:
-                self.readonly_fields = ('username', 'type', 'organizations')
+                readonly_fields = ('username', 'type', 'organizations')
             # 团学组织只可修改密码
             elif request.user.type == User.ORGANIZATION:
-                self.readonly_fields = ('username', 'name', 'campus', 'college', 'type', 'organizations',)
+                readonly_fields = ('username', 'name', 'campus', 'college', 'type', 'organizations',)
             # 社团只可修改密码
-            elif request.user.type == User.ORGANIZATION:
-                self.readonly_fields = ('username', 'name', 'campus', 'college', 'type', 'organizations',)
+            elif request.user.type == User.CLUB:
+                readonly_fields = ('username', 'name', 'campus', 'college', 'type', 'organizations',)
             # 自己访问时显示密码
             if obj == request.user:
-                self.fieldsets = (
+                fieldsets = (
                     (None, {
                         'fields': ('username', 'password')
                     }),
@@ -396,7 +238,7 @@ class CustomUserAdmin(UserAdmin):
                 )
             # 其他人访问时不显示密码
             else:
-                self.fieldsets = (
+                fieldsets = (
                     ('信息', {
                         'fields': ('name', 'campus', 'college', 'description')
                     }),
@@ -404,10 +246,21 @@ class CustomUserAdmin(UserAdmin):
                         'fields': ('type', 'organizations')
                     })
                 )
+        return fieldsets, readonly_fields
+
+    # 每次请求根据用户角色计算表单字段，不修改共享的实例属性
+    def get_fieldsets(self, request, obj=None):
+        if obj is None:
+            return self.get_add_layout(request)[0]
+        return self.get_change_layout(request, obj)[0]
 
-    # 增加用户前设置表单字段
+    def get_readonly_fields(self, request, obj=None):
+        if obj is None:
+            return self.get_add_layout(request)[1]
+        return self.get_change_layout(request, obj)[1]
+
+    # 增加用户时不检查修改权限
     def add_view(self, request, form_url='', extra_context=None):
-        self.modify_add_form(request)
         return self.changeform_view(request, None, form_url, extra_context)
 
     # 进入修改页面前的行为
@@ -421,8 +274,6 @@ class CustomUserAdmin(UserAdmin):
                 extra_context['show_exclude'] = True
             except User.DoesNotExist:
                 extra_context['show_include'] = True
-        # 修改表单字段
-        self.modify_change_form(request, obj)
         # 管理员显示面包屑导航
         if request.user.type == User.ADMIN:
             extra_context['show_breadcrumbs'] = True
@@ -463,45 +314,61 @@ class CustomUserAdmin(UserAdmin):
             return HttpResponseRedirect(".")
         return super().response_change(request, obj)
 
+    # 以一次批量插入将查询集中的用户添加进当前用户的组织，返回新增的数量
+    def add_members(self, request, queryset):
+        membership = User.organizations.through
+        with transaction.atomic():
+            user_ids = list(queryset.exclude(id=request.user.id).exclude(organizations=request.user).values_list('id', flat=True))
+            membership.objects.bulk_create([membership(from_user_id=user_id, to_user_id=request.user.id) for user_id in user_ids])
+            OrganizationClosure.objects.rebuild_for(user_ids)
+        # 批量写入不触发m2m_changed信号，提交后使可见收集缓存失效并重新统计必须提交的人数
+        visibility.invalidate()
+        Collecting.objects.ruled_forced(AudienceRule.objects.for_organizations([request.user.id])).recount_required()
+        return len(user_ids)
+
+    # 以一次批量删除将查询集中的用户移出当前用户的组织，返回移出的数量
+    def remove_members(self, request, queryset):
+        membership = User.organizations.through
+        with transaction.atomic():
+            user_ids = list(queryset.filter(organizations=request.user).values_list('id', flat=True))
+            membership.objects.filter(to_user=request.user, from_user__in=queryset).delete()
+            OrganizationClosure.objects.rebuild_for(user_ids)
+        # 批量写入不触发m2m_changed信号，提交后使可见收集缓存失效并重新统计必须提交的人数
+        visibility.invalidate()
+        Collecting.objects.ruled_forced(AudienceRule.objects.for_organizations([request.user.id])).recount_required()
+        return len(user_ids)
+
     # 批量添加从属关系操作
     def set_member(self, request, queryset):
-        # 管理员不拦截操作
-        if request.user.type == User.ADMIN:
-            pass
-        # 学生拦截操作
-        elif request.user.type == User.STUDENT:
+        # 学生拦截操作，其他用户不拦截
+        if request.user.type == User.STUDENT:
             self.message_user(request, "没有操作权限。")
             return
-        # 团学组织不拦截操作
-        elif request.user.type == User.ORGANIZATION:
-            pass
-        # 社团不拦截操作
-        elif request.user.type == User.CLUB:
-            pass
-        for user in queryset:
-            user.organizations.add(request.user)
-        self.message_user(request, "已成功将这些用户添加进组织。")
+        count = self.add_members(request, queryset)
+        self.message_user(request, "已成功将 %d 个用户添加进组织。" % count)
     set_member.short_description = '批量添加进组织'
 
+    # 将当前筛选条件下的全部用户添加进组织
+    def set_filtered_member(self, request, queryset):
+        # 学生拦截操作，其他用户不拦截
+        if request.user.type == User.STUDENT:
+            self.message_user(request, "没有操作权限。")
+            return
+        # 忽略勾选的用户，使用当前筛选和搜索条件下的全部用户；Django仍要求至少勾选一行才执行操作
+        queryset = self.get_changelist_instance(request).get_queryset(request)
+        count = self.add_members(request, queryset)
+        self.message_user(request, "已成功将当前筛选结果中的 %d 个用户添加进组织。" % count)
+    set_filtered_member.short_description = '将当前筛选结果全部添加进组织（任意勾选一行即可）'
+
     # 批量删除从属关系操作
     def unset_member(self, request, queryset):
-        # 管理员不拦截操作
-        if request.user.type == User.ADMIN:
-            pass
-        # 学生拦截操作
-        elif request.user.type == User.STUDENT:
+        # 学生拦截操作，其他用户不拦截
+        if request.user.type == User.STUDENT:
             self.message_user(request, "没有操作权限。")
             return
-        # 团学组织不拦截操作
-        elif request.user.type == User.ORGANIZATION:
-            pass
-        # 社团不拦截操作
-        elif request.user.type == User.CLUB:
-            pass
         # 执行操作
-        for user in queryset:
-            user.organizations.remove(request.user)
-        self.message_user(request, "已成功将这些用户移出组织。")
+        count = self.remove_members(request, queryset)
+        self.message_user(request, "已成功将 %d 个用户移出组织。" % count)
     unset_member.short_description = '批量移出组织'
 
     # 保存模型前的操作
@@ -513,7 +380,7 @@ class CustomUserAdmin(UserAdmin):
 
 
 @admin.register(Feedback)
-class FeedbackAdmin(admin.ModelAdmin):
+class FeedbackAdmin(PermissionMatrixMixin, FullTextSearchMixin, admin.ModelAdmin):
 
     # 初始化列表页
     list_per_page = 10
@@ -551,101 +418,19 @@ class FeedbackAdmin(admin.ModelAdmin):
         elif request.user.type == User.CLUB:
             return qs.filter(user=request.user)
 
-    # 反馈模块权限
-    def has_module_permission(self, request):
-        # 未登录用户无权限
-        if isinstance(request.user, AnonymousUser):
-            return False
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生无权限
-        elif request.user.type == User.STUDENT:
-            return True
-        # 团学组织有权限
-        elif request.user.type == User.ORGANIZATION:
-            return True
-        # 社团有权限
-        elif request.user.type == User.CLUB:
-            return True
-
-    # 查看反馈权限
-    def has_view_permission(self, request, obj=None):
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生有权限
-        elif request.user.type == User.STUDENT:
-            return True
-        # 团学组织有权限
-        elif request.user.type == User.ORGANIZATION:
-            return True
-        # 社团有权限
-        elif request.user.type == User.CLUB:
-            return True
-
-    # 添加反馈权限
-    def has_add_permission(self, request):
-        # 管理员无权限
-        if request.user.type == User.ADMIN:
-            return False
-        # 学生有权限
-        elif request.user.type == User.STUDENT:
-            return True
-        # 团学组织有权限
-        elif request.user.type == User.ORGANIZATION:
-            return True
-        # 社团有权限
-        elif request.user.type == User.CLUB:
-            return True
-
-    # 修改反馈的权限
-    def has_change_permission(self, request, obj=None):
-        # 首页不显示编辑按钮
-        if not obj:
-            return False
-        # 具体对象的编辑权限
-        else:
-            # 管理员有权限回复提交
-            if request.user.type == User.ADMIN:
-                if obj and obj.status == Feedback.NOT_REPLIED:
-                    return True
-                else:
-                    return False
-            # 学生无权限
-            elif request.user.type == User.STUDENT:
-                return False
-            # 团学组织无权限
-            elif request.user.type == User.ORGANIZATION:
-                return False
-            # 社团无权限
-            elif request.user.type == User.CLUB:
-                return False
-
-    # 除管理员外任何人都只可删除自己的反馈
-    def has_delete_permission(self, request, obj=None):
-        # 自己有权限删除未回复的反馈
-        if obj and (obj.user == request.user):
-            if obj.status == Feedback.NOT_REPLIED:
-                return True
-            else:
-                return False
-        # 管理员有权限
-        if request.user.type == User.ADMIN:
-            return True
-        # 学生无权限
-        elif request.user.type == User.STUDENT:
-            return False
-        # 团学组织无权限
-        elif request.user.type == User.ORGANIZATION:
-            return False
-        # 社团无权限
-        elif request.user.type == User.CLUB:
-            return False
+    # 权限矩阵：管理员只可回复，其他用户只可提交和删除自己未回复的反馈
+    permissions = {
+        'module': Permission(*ALL_ROLES),
+        'view': Permission(*ALL_ROLES),
+        'add': Permission(User.STUDENT, User.ORGANIZATION, User.CLUB),
+        'change': Permission(rules=(requires_object, admin_replies_unreplied)),
+        'delete': Permission(User.ADMIN, rules=(owner_deletes_unreplied,)),
+    }
 
     # 添加页面的内容
-    def modify_add_form(self, request):
-        self.fieldsets = (
+    def get_add_layout(self, request):
+        fieldsets, readonly_fields = self.fieldsets, self.readonly_fields
+        fieldsets = (
             (None, {
                 'fields': ('title',)
             }),
@@ -653,15 +438,17 @@ class FeedbackAdmin(admin.ModelAdmin):
                 'fields': ('type', 'content')
             })
         )
-        self.readonly_fields = ()
+        readonly_fields = ()
+        return fieldsets, readonly_fields
 
     # 修改页面的内容
-    def modify_change_form(self, request, obj):
+    def get_change_layout(self, request, obj):
+        fieldsets, readonly_fields = self.fieldsets, self.readonly_fields
         # 管理员拥有回复权限
         if request.user.type == User.ADMIN:
             if obj.status == Feedback.REPLIED:
-                self.readonly_fields = ('title', 'user', 'status', 'type', 'feedback_time', 'content', 'reply', 'reply_time')
-                self.fieldsets = (
+                readonly_fields = ('title', 'user', 'status', 'type', 'feedback_time', 'content', 'reply', 'reply_time')
+                fieldsets = (
                     (None, {
                         'fields': ('title', 'user', 'status')
                     }),
@@ -673,8 +460,8 @@ class FeedbackAdmin(admin.ModelAdmin):
                     })
                 )
             elif obj.status == Feedback.NOT_REPLIED:
-                self.readonly_fields = ('title', 'user', 'status', 'type', 'feedback_time', 'content')
-                self.fieldsets = (
+                readonly_fields = ('title', 'user', 'status', 'type', 'feedback_time', 'content')
+                fieldsets = (
                     (None, {
                         'fields': ('title', 'user', 'status')
                     }),
@@ -687,8 +474,8 @@ class FeedbackAdmin(admin.ModelAdmin):
                 )
         # 非管理员只可查看
         else:
-            self.readonly_fields = ('title', 'user', 'status', 'type', 'feedback_time', 'content', 'reply', 'reply_time')
-            self.fieldsets = (
+            readonly_fields = ('title', 'user', 'status', 'type', 'feedback_time', 'content', 'reply', 'reply_time')
+            fieldsets = (
                 (None, {
                     'fields': ('title', 'user', 'status')
                 }),
@@ -699,17 +486,18 @@ class FeedbackAdmin(admin.ModelAdmin):
                     'fields': ('reply', 'reply_time')
                 })
             )
-
-    # 增加反馈前设置表单字段
-    def add_view(self, request, form_url='', extra_context=None):
-        self.modify_add_form(request)
-        return self.changeform_view(request, None, form_url, extra_context)
-
-    # 修改反馈前设置表单字段
-    def change_view(self, request, object_id, form_url='', extra_context=None):
-        obj = self.get_object(request, object_id)
-        self.modify_change_form(request, obj)
-        return self.changeform_view(request, object_id, form_url, extra_context)
+        return fieldsets, readonly_fields
+
+    # 每次请求根据用户角色计算表单字段，不修改共享的实例属性
+    def get_fieldsets(self, request, obj=None):
+        if obj is None:
+            return self.get_add_layout(request)[0]
+        return self.get_change_layout(request, obj)[0]
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is None:
+            return self.get_add_layout(request)[1]
+        return self.get_change_layout(request, obj)[1]
 
     # 保存模型前的操作
     def save_model(self, request, obj, form, change):
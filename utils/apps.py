@@ -5,3 +5,7 @@ class UtilsConfig(AppConfig):
     name = 'utils'
     verbose_name = '基本管理'
     verbose_name_plural = verbose_name
+
+    # 注册信号
+    def ready(self):
+        from . import signals
@@ -2,24 +2,56 @@ import random
 import re
 import time
 from django import forms
+from django.conf import settings
+from django.core.cache import caches
 from .models import *
 
 
+# 验证问题缓存的版本号键，保存或删除验证问答时递增，使各进程的旧缓存失效
+ANTI_ROBOT_VERSION_KEY = 'anti_robot_version'
+
+
+# 缓存后端，多进程部署应配置为共享缓存，修改验证问答后各进程同时生效
+def get_anti_robot_cache():
+    return caches[getattr(settings, 'ANTI_ROBOT_CACHE', 'default')]
+
+
+# 获取当前小时的验证问题，每个版本每小时只查询一次数据库
+def get_anti_robot():
+    cache = get_anti_robot_cache()
+    hour = time.strftime("%Y%m%d_%H", time.localtime())
+    version = cache.get_or_set(ANTI_ROBOT_VERSION_KEY, 0, None)
+    key = 'anti_robot:%s:%s' % (version, hour)
+    anti_robot = cache.get(key)
+    if anti_robot is None:
+        questions = list(AntiRobot.objects.order_by('id').values_list('question', 'hint', 'answer'))
+        if len(questions) == 0:
+            anti_robot = ('南开大学创立于哪一年', '请输入四位阿拉伯数字', '1919')
+        else:
+            # 以小时为种子，保证各进程在同一小时内选中同一问题
+            anti_robot = random.Random(hour).choice(questions)
+        cache.set(key, anti_robot, 3600)
+    return tuple(anti_robot)
+
+
+# 使全部进程的验证问题缓存失效
+def invalidate_anti_robot_cache():
+    cache = get_anti_robot_cache()
+    cache.add(ANTI_ROBOT_VERSION_KEY, 0, None)
+    try:
+        cache.incr(ANTI_ROBOT_VERSION_KEY)
+    except ValueError:
+        cache.set(ANTI_ROBOT_VERSION_KEY, 1, None)
+
+
 # 注册表单
 class RegisterForm(forms.ModelForm):
-    # 随机选取反机器人答案
+    # 选取当前小时的反机器人问题
     def __init__(self, *args, **kwargs):
         super(RegisterForm, self).__init__(*args, **kwargs)
-        random.seed(hash(str(len(User.objects.all())) + time.strftime("%Y%m%d_%H", time.localtime())))
-        if len(AntiRobot.objects.all()) == 0:
-            self.fields['anti_robot'].label = '南开大学创立于哪一年'
-            self.fields['anti_robot'].widget.attrs['placeholder'] = '请输入四位阿拉伯数字'
-            self.answer = '1919'
-        else:
-            anti_robot = AntiRobot.objects.all()[random.randint(0, len(AntiRobot.objects.all()) - 1)]
-            self.fields['anti_robot'].label = anti_robot.question
-            self.fields['anti_robot'].widget.attrs['placeholder'] = anti_robot.hint
-            self.answer = anti_robot.answer
+        question, hint, self.answer = get_anti_robot()
+        self.fields['anti_robot'].label = question
+        self.fields['anti_robot'].widget.attrs['placeholder'] = hint
 
     # 覆写用户名
     username = forms.CharField(
@@ -94,7 +126,7 @@ class RegisterForm(forms.ModelForm):
         # 用户名校验
         if data.get('username'):
             # 用户名重复
-            if len(User.objects.filter(username=data['username'])) != 0:
+            if User.objects.filter(username=data['username']).exists():
                 raise forms.ValidationError("该学号已注册。")
             # 学号格式错误
             pattern = re.compile('^[0-9]{7}$')
@@ -0,0 +1,332 @@
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from html import unescape
+from io import BytesIO
+from urllib.parse import unquote
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.utils.functional import cached_property
+from django.utils.html import escape
+from ckeditor_uploader import utils as ckeditor_utils
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# 上传图片的最大宽高，超过时等比缩小
+MAX_SIZE = getattr(settings, 'CKEDITOR_IMAGE_MAX_SIZE', 1920)
+
+# 另外生成的各宽度图片，供srcset按屏幕选择
+WIDTHS = getattr(settings, 'CKEDITOR_IMAGE_WIDTHS', (480, 960))
+
+QUALITY = getattr(settings, 'CKEDITOR_IMAGE_QUALITY', 75)
+
+THUMBNAIL_SIZE = getattr(settings, 'CKEDITOR_THUMBNAIL_SIZE', (75, 75))
+
+# 各宽度图片所在的目录，以点开头时不出现在编辑器的浏览列表中
+VARIANT_DIR = '.variants'
+
+EXTENSIONS = {'WEBP': '.webp', 'JPEG': '.jpg', 'PNG': '.png'}
+
+# EXIF中的方向，5到8表示图片需旋转90度显示
+ORIENTATION = 0x0112
+
+IMG = re.compile(r'<img\b[^>]*>', re.I)
+SRC = re.compile(r'''\ssrc\s*=\s*(["'])(.*?)\1''', re.I | re.S)
+SRCSET = re.compile(r'\ssrcset\s*=', re.I)
+LOADING = re.compile(r'\sloading\s*=', re.I)
+
+# 含有上传图片的富文本字段
+registry = {}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# 注册需要为上传图片添加srcset的富文本字段
+def register(model, *fields):
+    registry[model] = fields
+
+
+# 生成图片的后台线程池，Pillow解码、缩放和编码时释放GIL，线程即可并行
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'CKEDITOR_IMAGE_WORKERS', 2),
+                thread_name_prefix='images'
+            )
+    return _executor
+
+
+# 宽高不超过MAX_SIZE时的尺寸
+def capped_size(width, height):
+    ratio = min(MAX_SIZE / max(width, height), 1)
+    return max(round(width * ratio), 1), max(round(height * ratio), 1)
+
+
+# 需要另外生成的宽度：小于图片宽度的各宽度，图片超过上限时再加上缩小后的宽度
+def variant_widths(width, height):
+    capped = capped_size(width, height)[0]
+    widths = [w for w in WIDTHS if w < capped]
+    if capped < width:
+        widths.append(capped)
+    return widths
+
+
+# 某一宽度的图片名：upload/.../.variants/原文件名_w宽度.格式
+def variant_name(name, width, format=None):
+    directory, filename = os.path.split(name)
+    root, ext = os.path.splitext(filename)
+    if format:
+        ext = EXTENSIONS[format]
+    return '%s/%s/%s_w%d%s' % (directory, VARIANT_DIR, root, width, ext)
+
+
+# 重新编码的格式：默认WebP，Pillow不支持时透明图片用PNG，其余用JPEG
+def output_format(image):
+    format = getattr(settings, 'CKEDITOR_IMAGE_FORMAT', 'WEBP')
+    if format == 'WEBP' and not features.check('webp'):
+        format = 'JPEG'
+    if format == 'JPEG' and image.mode == 'RGBA':
+        format = 'PNG'
+    return format
+
+
+# 缩略图的格式：WebP，Pillow不支持时用PNG以保留透明；未安装Pillow时不生成缩略图，返回None
+def thumbnail_format():
+    if Image is None:
+        return None
+    return 'WEBP' if features.check('webp') else 'PNG'
+
+
+# 缩略图名：原文件名_thumb.缩略图格式的扩展名，浏览时跳过；未安装Pillow时沿用ckeditor_uploader的缩略图名
+def thumbnail_name(name):
+    format = thumbnail_format()
+    if format is None:
+        return ckeditor_utils.get_thumb_filename(name)
+    return '%s_thumb%s' % (os.path.splitext(name)[0], EXTENSIONS[format])
+
+
+# 按方向摆正并缩小到上限以内，只保留RGB或RGBA
+def shrink(image):
+    width, height = capped_size(*image.size)
+    # JPEG直接按接近的比例解码，大图可省去大部分解码时间和内存
+    if (width, height) != image.size:
+        image.draft('RGB', (width, height))
+    image = ImageOps.exif_transpose(image)
+    transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    image = image.convert('RGBA' if transparent else 'RGB')
+    size = capped_size(*image.size)
+    if size != image.size:
+        image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+    return image
+
+
+# 编码图片，不写入EXIF，只保留色彩配置
+def encode(image, format):
+    output = BytesIO()
+    options = {'icc_profile': image.info.get('icc_profile')}
+    if format == 'PNG':
+        options['optimize'] = True
+    elif format == 'JPEG':
+        options.update(quality=QUALITY, optimize=True, progressive=True)
+    else:
+        options['quality'] = QUALITY
+    image.save(output, format, **options)
+    return output.getvalue()
+
+
+# 生成各宽度的图片和编辑器浏览用的缩略图，已存在的跳过；旧的未处理图片同样先摆正并按上限缩小
+def make_variants(storage, name):
+    with storage.open(name) as f:
+        image = Image.open(f)
+        # 动图只用第一帧生成缩略图
+        widths = [] if getattr(image, 'is_animated', False) else variant_widths(*oriented_size(image))
+        image = shrink(image)
+        image.load()
+    format = output_format(image)
+    for width in widths:
+        variant = variant_name(name, width, format)
+        if not storage.exists(variant):
+            resized = image
+            if width != image.width:
+                resized = image.resize((width, max(round(image.height * width / image.width), 1)), Image.LANCZOS)
+            storage.save(variant, ContentFile(encode(resized, format)))
+    thumb = thumbnail_name(name)
+    if not storage.exists(thumb):
+        image.thumbnail(THUMBNAIL_SIZE, Image.LANCZOS)
+        storage.save(thumb, ContentFile(encode(image, thumbnail_format())))
+
+
+# 后台生成各宽度图片，完成后为已保存的内容补上srcset，出错时只记录日志
+def process_upload(storage, name):
+    try:
+        make_variants(storage, name)
+        add_srcset_to_saved(storage, name)
+    except Exception:
+        logger.exception('处理上传图片 %s 失败', name)
+    finally:
+        # 后台线程使用独立的数据库连接，处理完即关闭
+        connection.close()
+
+
+# 按EXIF方向摆正后的宽高
+def oriented_size(image):
+    width, height = image.size
+    if image.getexif().get(ORIENTATION) in (5, 6, 7, 8):
+        return height, width
+    return width, height
+
+
+# 富文本编辑器的上传后端：图片摆正、去除EXIF、按上限缩小后重新编码保存，
+# 各宽度图片和缩略图交给后台线程生成，上传请求无需等待；未安装Pillow时原样保存
+class ImageBackend:
+    def __init__(self, storage_engine, file_object):
+        self.file_object = file_object
+        self.storage_engine = storage_engine
+
+    @cached_property
+    def is_image(self):
+        if Image is None:
+            return ckeditor_utils.is_valid_image_extension(self.file_object.name)
+        try:
+            Image.open(self.file_object).verify()
+            return True
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+            return False
+        finally:
+            self.file_object.seek(0)
+
+    def save_as(self, filepath):
+        if Image is None or not self.is_image:
+            return self.storage_engine.save(filepath, self.file_object)
+        image = Image.open(self.file_object)
+        # 动图保持原样
+        if getattr(image, 'is_animated', False):
+            self.file_object.seek(0)
+            saved_path = self.storage_engine.save(filepath, self.file_object)
+        else:
+            image = shrink(image)
+            format = output_format(image)
+            filepath = os.path.splitext(filepath)[0] + EXTENSIONS[format]
+            saved_path = self.storage_engine.save(filepath, ContentFile(encode(image, format)))
+        executor().submit(process_upload, self.storage_engine, saved_path)
+        return saved_path
+
+
+# 上传图片摆正后的宽高，不是图片或无法读取时返回None
+def image_size(storage, name):
+    if Image is None:
+        return None
+    try:
+        with Image.open(storage.path(name)) as image:
+            return oriented_size(image)
+    except (OSError, SyntaxError, ValueError, SuspiciousFileOperation, Image.DecompressionBombError):
+        return None
+
+
+# 图片标签引用的上传图片名和地址，已有srcset或不是上传图片时返回None
+def _uploaded_src(tag):
+    src = SRC.search(tag)
+    if not src or SRCSET.search(tag):
+        return None
+    url = unescape(src.group(2))
+    if not url.startswith(settings.MEDIA_URL + getattr(settings, 'CKEDITOR_UPLOAD_PATH', 'upload/')):
+        return None
+    return unquote(url[len(settings.MEDIA_URL):]), url
+
+
+def _add_srcset(match):
+    tag = match.group()
+    uploaded = _uploaded_src(tag)
+    if not uploaded:
+        return tag
+    name, url = uploaded
+    storage = ckeditor_utils.storage
+    size = image_size(storage, name)
+    if not size:
+        return tag
+    candidates = []
+    for width in variant_widths(*size):
+        for format in EXTENSIONS:
+            variant = variant_name(name, width, format)
+            if storage.exists(variant):
+                candidates.append('%s %dw' % (storage.url(variant), width))
+                break
+    if not candidates:
+        return tag
+    candidates.append('%s %dw' % (url, size[0]))
+    attrs = ' srcset="%s" sizes="(max-width: %dpx) 100vw, %dpx"' % (escape(', '.join(candidates)), size[0], size[0])
+    # 列表和详情页中的图片滚动到附近时再加载
+    if not LOADING.search(tag):
+        attrs += ' loading="lazy"'
+    end = -2 if tag.endswith('/>') else -1
+    return tag[:end].rstrip() + attrs + tag[end:]
+
+
+# 为富文本中已生成各宽度图片的上传图片添加srcset，浏览器按显示宽度选择合适的图片；已有srcset的不变
+def add_srcset(html):
+    if Image is None or not html or '<img' not in html.lower():
+        return html
+    return IMG.sub(_add_srcset, html)
+
+
+# 富文本中尚未处理完的上传图片：没有srcset且还没有缩略图，缩略图在各宽度图片之后生成
+def pending_images(html):
+    if Image is None or not html or '<img' not in html.lower():
+        return set()
+    storage = ckeditor_utils.storage
+    names = set()
+    for tag in IMG.findall(html):
+        uploaded = _uploaded_src(tag)
+        if uploaded and not storage.exists(thumbnail_name(uploaded[0])):
+            names.add(uploaded[0])
+    return names
+
+
+# 保存后记录对象引用的尚未处理完的图片；记录前后台已处理完的图片由这里补上srcset
+def record_pending(instance, update_fields=None):
+    # models导入了本模块，在函数中导入以免循环
+    from django.contrib.contenttypes.models import ContentType
+    from .models import ImageReference
+    names = set()
+    for field in registry.get(type(instance), ()):
+        if update_fields is None or field in update_fields:
+            names |= pending_images(getattr(instance, field))
+    if not names:
+        return
+    content_type = ContentType.objects.get_for_model(instance)
+    for name in names:
+        ImageReference.objects.get_or_create(path=name, content_type=content_type, object_id=instance.pk)
+    storage = ckeditor_utils.storage
+    for name in names:
+        if storage.exists(thumbnail_name(name)):
+            add_srcset_to_saved(storage, name)
+
+
+# 图片处理完成后重新保存引用它的对象，由保存前信号补上srcset，全文索引和缓存随之更新
+def add_srcset_to_saved(storage, name):
+    from .models import ImageReference
+    for reference in ImageReference.objects.filter(path=name).select_related('content_type'):
+        model = reference.content_type.model_class()
+        instance = model.objects.filter(pk=reference.object_id).first() if model in registry else None
+        reference.delete()
+        if instance is not None:
+            instance.save(update_fields=registry[model])
+
+
+# 保存前为注册的富文本字段添加srcset
+def process(instance, update_fields=None):
+    for field in registry.get(type(instance), ()):
+        if update_fields is None or field in update_fields:
+            setattr(instance, field, add_srcset(getattr(instance, field)))
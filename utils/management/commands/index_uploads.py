@@ -0,0 +1,68 @@
+import datetime
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ckeditor_uploader import utils as ckeditor_utils
+from utils import images
+from utils.models import UploadedFile, User
+
+
+# 上传目录中的文件，跳过以点开头的文件和目录（各宽度图片）及缩略图
+def _uploaded_files(storage, upload_path):
+    for directory, dirs, files in os.walk(storage.path(upload_path)):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for filename in files:
+            if filename.startswith('.') or os.path.splitext(filename)[0].endswith('_thumb'):
+                continue
+            relative = os.path.relpath(os.path.join(directory, filename), storage.location)
+            yield relative.replace(os.sep, '/')
+
+
+# 根据上传目录中已有的文件补建上传文件记录
+class Command(BaseCommand):
+    help = '遍历富文本编辑器的上传目录，为尚未记录的文件补建上传文件记录，并删除文件已不存在的记录。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-missing', action='store_true', help='保留文件已不存在的记录')
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批写入的记录数')
+
+    def handle(self, *args, **options):
+        storage = ckeditor_utils.storage
+        upload_path = getattr(settings, 'CKEDITOR_UPLOAD_PATH', 'upload/')
+        recorded = set(UploadedFile.objects.values_list('path', flat=True).iterator())
+        # 限制按用户存放时，上传目录下第一级目录为上传者的用户名
+        users = {}
+        restrict_by_user = getattr(settings, 'CKEDITOR_RESTRICT_BY_USER', False)
+        found = set()
+        batch = []
+        created = 0
+        for name in _uploaded_files(storage, upload_path):
+            found.add(name)
+            if name in recorded:
+                continue
+            user = None
+            if restrict_by_user:
+                username = name[len(upload_path):].split('/', 1)[0]
+                if username not in users:
+                    users[username] = User.objects.filter(username=username).first()
+                user = users[username]
+            # 优先使用图片处理生成的缩略图，其次是ckeditor_uploader生成的缩略图
+            thumbs = [ckeditor_utils.get_thumb_filename(name)]
+            if images.Image is not None:
+                thumbs.insert(0, images.thumbnail_name(name))
+            thumbnail = next((thumb for thumb in thumbs if storage.exists(thumb)), '')
+            created_time = datetime.datetime.fromtimestamp(os.path.getmtime(storage.path(name)), datetime.timezone.utc)
+            batch.append(UploadedFile.objects.build(storage, name, user, thumbnail, created_time))
+            if len(batch) >= options['batch_size']:
+                UploadedFile.objects.bulk_create(batch, ignore_conflicts=True)
+                created += len(batch)
+                batch = []
+        if batch:
+            UploadedFile.objects.bulk_create(batch, ignore_conflicts=True)
+            created += len(batch)
+        deleted = 0
+        if not options['keep_missing']:
+            missing = list(recorded - found)
+            for i in range(0, len(missing), options['batch_size']):
+                deleted += UploadedFile.objects.filter(path__in=missing[i:i + options['batch_size']]).delete()[0]
+        self.stdout.write('共 %d 个上传文件，新记录 %d 个，删除文件已不存在的记录 %d 个。' % (len(found), created, deleted))
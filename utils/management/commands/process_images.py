@@ -0,0 +1,70 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ckeditor_uploader import utils as ckeditor_utils
+from utils import images
+from utils.models import UploadedFile
+
+# 可处理的图片扩展名
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+
+
+# 上传目录中的原图，跳过各宽度图片目录和缩略图
+def _uploaded_images(storage):
+    upload_path = getattr(settings, 'CKEDITOR_UPLOAD_PATH', 'upload/')
+    root = storage.path(upload_path)
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for filename in files:
+            root_name, ext = os.path.splitext(filename)
+            if filename.startswith('.') or root_name.endswith('_thumb') or ext.lower() not in IMAGE_EXTENSIONS:
+                continue
+            relative = os.path.relpath(os.path.join(directory, filename), storage.location)
+            yield relative.replace(os.sep, '/')
+
+
+# 为已上传的图片生成各宽度的图片，并为已保存的内容添加srcset
+class Command(BaseCommand):
+    help = '为富文本编辑器已上传的图片生成各宽度的图片和缩略图，并为收集和提交内容中的图片添加srcset（需要Pillow）。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='并行处理图片的线程数')
+        parser.add_argument('--skip-content', action='store_true', help='只生成图片，不修改已保存的内容')
+
+    def handle(self, *args, **options):
+        if images.Image is None:
+            raise CommandError('未安装Pillow，无法处理图片。')
+        storage = ckeditor_utils.storage
+        names = list(_uploaded_images(storage))
+        failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for name, error in zip(names, pool.map(self.make_variants, [storage] * len(names), names)):
+                if error:
+                    failed += 1
+                    self.stderr.write('处理图片 %s 失败：%s' % (name, error))
+                elif storage.exists(images.thumbnail_name(name)):
+                    UploadedFile.objects.filter(path=name, thumbnail='').update(thumbnail=images.thumbnail_name(name))
+        self.stdout.write('已处理 %d 张图片，失败 %d 张。' % (len(names) - failed, failed))
+        if options['skip_content']:
+            return
+        # 只更新内容字段，不触发保存信号和自动更新时间
+        for model, fields in images.registry.items():
+            updated = 0
+            for row in model.objects.values_list('pk', *fields).iterator():
+                changes = {}
+                for field, html in zip(fields, row[1:]):
+                    new_html = images.add_srcset(html)
+                    if new_html != html:
+                        changes[field] = new_html
+                if changes:
+                    model.objects.filter(pk=row[0]).update(**changes)
+                    updated += 1
+            self.stdout.write('已为 %d 条%s的内容添加srcset。' % (updated, model._meta.verbose_name))
+
+    @staticmethod
+    def make_variants(storage, name):
+        try:
+            images.make_variants(storage, name)
+        except Exception as e:
+            return e
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from CollectingAndSubmitting import visibility
+from utils.models import OrganizationClosure
+
+
+# 根据现有上级组织关系重建组织关系闭包
+class Command(BaseCommand):
+    help = '根据现有上级组织关系重建组织关系闭包'
+
+    def handle(self, *args, **options):
+        OrganizationClosure.objects.rebuild_all()
+        visibility.invalidate()
+        self.stdout.write('已重建 %d 条组织关系。' % OrganizationClosure.objects.count())
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from utils import search
+
+
+# 根据现有记录重建全文索引
+class Command(BaseCommand):
+    help = '根据现有记录重建收集、提交和反馈内容的全文索引（需要支持FTS5的SQLite）。'
+
+    def handle(self, *args, **options):
+        if not search.available():
+            raise CommandError('当前数据库不支持FTS5全文索引。')
+        for model in search.registry:
+            with transaction.atomic():
+                if not search.ready(model):
+                    search.create_table(model)
+                search.rebuild(model)
+            self.stdout.write('已重建 %s 的全文索引，共 %d 条。' % (model._meta.verbose_name, model.objects.count()))
@@ -0,0 +1,96 @@
+import mimetypes
+from collections import Counter
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from utils.models import StoredFile
+from utils.storage import ContentAddressedStorage, blob_name, parse_hash
+
+
+# 使用内容寻址存储的文件字段
+def _storage_fields():
+    for model in apps.get_models():
+        for field in model._meta.fields:
+            if isinstance(field, models.FileField) and isinstance(field.storage, ContentAddressedStorage):
+                yield model, field
+
+
+# 存储文件总大小
+def _stored_size():
+    return StoredFile.objects.aggregate(size=models.Sum('size'))['size'] or 0
+
+
+# 将旧附件转入内容寻址存储并校正引用数
+class Command(BaseCommand):
+    help = '将平铺在MEDIA_ROOT中的旧附件转入内容寻址存储，再根据数据库中的引用校正引用数并回收无引用的文件。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', action='store_true', help='转入后保留旧文件')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='每批校正的存储文件数')
+
+    def handle(self, *args, **options):
+        fields = list(_storage_fields())
+        size_before = _stored_size()
+        legacy = {}
+        missing = 0
+        # 逐个转入旧附件，只更新文件字段，不触发保存信号和自动更新时间
+        for model, field in fields:
+            storage = field.storage
+            rows = model.objects.exclude(**{field.name: ''}).exclude(**{field.name: None}).values_list('pk', field.name)
+            for pk, name in rows.iterator():
+                if parse_hash(name):
+                    continue
+                if not storage.exists(name):
+                    missing += 1
+                    self.stderr.write('%s %s 的附件 %s 不存在。' % (model._meta.verbose_name, pk, name))
+                    continue
+                with storage.open(name) as content:
+                    new_name = storage.save(name, content, max_length=field.max_length)
+                model.objects.filter(pk=pk).update(**{field.name: new_name})
+                legacy[name] = (storage, storage.size(new_name))
+        if not options['keep']:
+            for name, (storage, size) in legacy.items():
+                storage.delete(name)
+        # 统计实际引用
+        references = Counter()
+        names = {}
+        for model, field in fields:
+            for name in model.objects.values_list(field.name, flat=True).iterator():
+                digest = parse_hash(name)
+                if digest:
+                    references[digest] += 1
+                    names[digest] = (field.storage, name)
+        # 分批校正引用数，无引用的文件连同实际文件一起删除
+        seen = set()
+        last = 0
+        while True:
+            batch = list(StoredFile.objects.filter(pk__gt=last).order_by('pk')[:options['chunk_size']])
+            if not batch:
+                break
+            with transaction.atomic():
+                for stored in batch:
+                    seen.add(stored.hash)
+                    count = references.get(stored.hash, 0)
+                    if count == 0:
+                        stored.delete()
+                        for storage in {field.storage for model, field in fields}:
+                            super(ContentAddressedStorage, storage).delete(blob_name(stored.hash))
+                    elif count != stored.refcount:
+                        StoredFile.objects.filter(pk=stored.pk).update(refcount=count)
+            last = batch[-1].pk
+        # 补建缺失的记录
+        for digest in set(references) - seen:
+            storage, name = names[digest]
+            if not storage.exists(name):
+                self.stderr.write('附件 %s 的实际文件不存在。' % name)
+                continue
+            StoredFile.objects.create(
+                hash=digest,
+                size=storage.size(name),
+                mime=mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                refcount=references[digest]
+            )
+        legacy_size = sum(size for storage, size in legacy.values())
+        self.stdout.write('已转入 %d 个旧附件（%d 字节），存储文件总大小变化 %+d 字节，缺失 %d 个；共 %d 个存储文件被 %d 处引用。' % (
+            len(legacy), legacy_size, _stored_size() - size_before, missing, len(references), sum(references.values())
+        ))
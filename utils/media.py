@@ -0,0 +1,149 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.contrib import admin
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+from .storage import parse_hash
+
+# 每次读取并输出的块大小
+CHUNK_SIZE = 64 * 1024
+
+# 受保护的文件字段，所属对象在管理后台可见时才允许下载
+registry = []
+
+# 单个字节范围
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# 可在浏览器中直接显示的类型，其余均作为附件下载
+INLINE_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/bmp', 'application/pdf'}
+
+# 可能在本站域名下执行脚本的类型，不使用猜测的类型
+ACTIVE_TYPES = {'text/html', 'application/xhtml+xml', 'image/svg+xml', 'text/xml', 'application/xml', 'application/javascript', 'text/javascript'}
+
+
+# 注册受保护的文件字段
+def register(model, field):
+    registry.append((model, field))
+
+
+# 规范化请求的文件名，绝对路径或含有..的路径返回None
+def normalize(name):
+    name = name.replace('\\', '/')
+    if name.startswith('/') or '..' in name.split('/'):
+        return None
+    name = posixpath.normpath(name)
+    if name in ('', '.') or name.startswith('/'):
+        return None
+    return name
+
+
+# 用户能否下载该文件：被受保护字段引用的文件须在管理后台可见，未被引用的只允许下载富文本编辑器上传的图片
+def can_access(request, name):
+    referenced = False
+    for model, field in registry:
+        model_admin = admin.site._registry.get(model)
+        if model_admin and model_admin.has_view_permission(request):
+            if model_admin.get_queryset(request).filter(**{field: name}).exists():
+                return True
+        if not referenced:
+            referenced = model._default_manager.filter(**{field: name}).exists()
+    if referenced:
+        return False
+    return name.startswith(getattr(settings, 'CKEDITOR_UPLOAD_PATH', 'upload/'))
+
+
+# 内容寻址文件以哈希作为强ETag，旧文件使用修改时间和大小
+def make_etag(name, stat):
+    digest = parse_hash(name)
+    if digest:
+        return '"%s"' % digest
+    return '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+
+
+# 解析Range请求头，只支持单个范围；返回(起点, 长度)，整个文件返回None，无法满足返回False
+def parse_range(header, size):
+    match = RANGE.match(header.replace(' ', ''))
+    if not match or not any(match.groups()):
+        return None
+    start, end = match.groups()
+    if not start:
+        # 最后若干字节
+        length = min(int(end), size)
+        if length == 0:
+            return False
+        return size - length, length
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        return False
+    end = min(int(end), size - 1) if end else size - 1
+    return start, end - start + 1
+
+
+# 按块读取文件的指定范围
+def iter_range(path, start, length, chunk_size=CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+# 输出文件，处理条件请求和断点续传；配置MEDIA_SENDFILE后交给前端服务器传输
+def serve(request, name, storage):
+    path = storage.path(name)
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404
+    etag = make_etag(name, stat)
+    last_modified = int(stat.st_mtime)
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    if content_type in ACTIVE_TYPES:
+        content_type = 'application/octet-stream'
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        sendfile = getattr(settings, 'MEDIA_SENDFILE', None)
+        byte_range = None
+        if_range = request.META.get('HTTP_IF_RANGE')
+        # If-Range与当前版本不一致时忽略Range，返回整个文件
+        if 'HTTP_RANGE' in request.META and (not if_range or if_range == etag or parse_http_date_safe(if_range) == last_modified):
+            byte_range = parse_range(request.META['HTTP_RANGE'], stat.st_size)
+        if sendfile == 'x-accel-redirect':
+            response = HttpResponse(content_type=content_type)
+            location = getattr(settings, 'MEDIA_ACCEL_REDIRECT_LOCATION', '/protected-media/')
+            response['X-Accel-Redirect'] = location + quote(os.path.relpath(path, storage.location).replace(os.sep, '/'))
+        elif sendfile == 'x-sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = path
+        elif byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % stat.st_size
+        elif byte_range:
+            start, length = byte_range
+            response = StreamingHttpResponse(iter_range(path, start, length), status=206, content_type=content_type)
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, start + length - 1, stat.st_size)
+            response['Content-Length'] = length
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+            response.block_size = CHUNK_SIZE
+            response['Content-Length'] = stat.st_size
+        response['Accept-Ranges'] = 'bytes'
+        # 只有图片和PDF在浏览器中打开，HTML、SVG等上传文件不能以本站身份执行脚本
+        disposition = 'inline' if content_type in INLINE_TYPES else 'attachment'
+        response['Content-Disposition'] = disposition + "; filename*=UTF-8''" + quote(os.path.basename(name))
+        response['X-Content-Type-Options'] = 'nosniff'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # 文件受权限保护，不允许共享缓存，浏览器每次使用前须重新验证
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
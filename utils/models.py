@@ -1,7 +1,11 @@
+from collections import defaultdict, deque
 from django.contrib.auth.base_user import BaseUserManager, AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin
 from django.contrib.auth.validators import UnicodeUsernameValidator
-from django.db import models
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, transaction
+from django.utils import timezone
+from . import images
 
 
 # 学院
@@ -112,7 +116,7 @@ class User(AbstractBaseUser, PermissionsMixin):
         blank=True,
         related_name='members',
         symmetrical=False,
-        help_text='可添加多个；组织关系不递归，间接上级组织需另外添加。',
+        help_text='可添加多个；间接上级组织将自动继承，无需另外添加。',
         verbose_name='上级组织',
     )
     is_active = models.BooleanField(
@@ -137,10 +141,131 @@ class User(AbstractBaseUser, PermissionsMixin):
     class Meta:
         verbose_name = '用户'
         verbose_name_plural = verbose_name
+        # 用户选择控件按名称前缀查询，用户名已有唯一索引
+        indexes = [
+            models.Index(fields=['name'], name='user_name_idx'),
+        ]
 
     def __str__(self):
         return str(self.name) + '(' + str(self.get_type_display()) + ')'
 
+    # 所有直接和间接上级组织
+    def ancestors(self):
+        return User.objects.filter(descendant_closures__descendant=self)
+
+    # 所有直接和间接下级用户
+    def descendants(self):
+        return User.objects.filter(ancestor_closures__ancestor=self)
+
+
+# 组织关系闭包管理器
+class OrganizationClosureManager(models.Manager):
+    # 重建指定用户及其所有下级的上级组织闭包，修改某用户的上级组织只影响其自身和下级
+    def rebuild_for(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        affected = set(user_ids)
+        for ids in _chunks(user_ids):
+            affected.update(self.filter(ancestor__in=ids).values_list('descendant', flat=True))
+        self._rebuild(affected)
+
+    # 重建全部闭包
+    def rebuild_all(self):
+        self._rebuild(set(User.objects.values_list('id', flat=True)))
+
+    def _rebuild(self, affected):
+        membership = User.organizations.through
+        parents = defaultdict(set)
+        for ids in _chunks(affected):
+            for member, organization in membership.objects.filter(from_user__in=ids).values_list('from_user', 'to_user'):
+                parents[member].add(organization)
+        # 受影响范围外的上级组织闭包不变，直接读取
+        ancestors = defaultdict(dict)
+        outside = set().union(*parents.values()) - affected
+        for ids in _chunks(outside):
+            for ancestor, descendant, depth in self.filter(descendant__in=ids).values_list('ancestor', 'descendant', 'depth'):
+                ancestors[descendant][ancestor] = depth
+        # 按拓扑顺序计算，保证上级组织先于下级完成计算
+        children = defaultdict(set)
+        waiting = {}
+        for user in affected:
+            inside = parents[user] & affected
+            waiting[user] = len(inside)
+            for parent in inside:
+                children[parent].add(user)
+        queue = deque(user for user, count in waiting.items() if count == 0)
+        order = []
+        while queue:
+            user = queue.popleft()
+            order.append(user)
+            for child in children[user]:
+                waiting[child] -= 1
+                if waiting[child] == 0:
+                    queue.append(child)
+        for user in order:
+            ancestors[user] = self._ancestors_from_parents(user, parents, ancestors)
+        # 环路上及其下级的用户无法排序，反复计算直至不再变化；每轮只会增加上级或缩短距离，必然收敛
+        visited = set(order)
+        remaining = [user for user in affected if user not in visited]
+        changed = True
+        while remaining and changed:
+            changed = False
+            for user in remaining:
+                result = self._ancestors_from_parents(user, parents, ancestors)
+                if result != ancestors[user]:
+                    ancestors[user] = result
+                    changed = True
+        with transaction.atomic():
+            for ids in _chunks(affected):
+                self.filter(descendant__in=ids).delete()
+            self.bulk_create([
+                self.model(ancestor_id=ancestor, descendant_id=user, depth=depth)
+                for user in affected for ancestor, depth in ancestors[user].items()
+            ])
+
+    # 由直接上级组织及其已计算的闭包得出用户的全部上级组织和最短距离
+    @staticmethod
+    def _ancestors_from_parents(user, parents, ancestors):
+        result = {}
+        for parent in parents[user]:
+            for ancestor, depth in [(parent, 0)] + list(ancestors[parent].items()):
+                if ancestor != user and depth + 1 < result.get(ancestor, depth + 2):
+                    result[ancestor] = depth + 1
+        return result
+
+
+# 按批次切分id，避免超出数据库的参数数量限制
+def _chunks(ids, size=500):
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+# 组织关系闭包：记录每个用户的全部直接和间接上级组织及层级距离
+class OrganizationClosure(models.Model):
+    ancestor = models.ForeignKey(
+        to=User,
+        related_name='descendant_closures',
+        on_delete=models.CASCADE,
+        verbose_name='上级组织'
+    )
+    descendant = models.ForeignKey(
+        to=User,
+        related_name='ancestor_closures',
+        on_delete=models.CASCADE,
+        verbose_name='下级用户'
+    )
+    depth = models.PositiveIntegerField(verbose_name='层级距离')
+
+    objects = OrganizationClosureManager()
+
+    class Meta:
+        verbose_name = '组织关系闭包'
+        verbose_name_plural = verbose_name
+        unique_together = (('ancestor', 'descendant'),)
+        index_together = (('descendant', 'ancestor'),)
+
 
 # 反馈
 class Feedback(models.Model):
@@ -195,3 +320,92 @@ class Feedback(models.Model):
 
     def __str__(self):
         return '由用户 ' + str(self.user) + ' 提交的反馈 ' + str(self.title)
+
+
+# 内容寻址存储中的文件，相同内容只保存一份，按引用数回收
+class StoredFile(models.Model):
+    hash = models.CharField(max_length=64, unique=True, verbose_name='SHA-256')
+    size = models.BigIntegerField(verbose_name='大小')
+    mime = models.CharField(max_length=100, verbose_name='类型')
+    refcount = models.PositiveIntegerField(default=0, verbose_name='引用数')
+    created_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+
+    class Meta:
+        verbose_name = '存储文件'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return self.hash
+
+
+# 上传文件管理器
+class UploadedFileManager(models.Manager):
+    # 根据存储中的文件构造记录，图片同时记录宽高；缩略图未指定时使用图片处理后台将生成的缩略图
+    def build(self, storage, name, user=None, thumbnail=None, created_time=None):
+        size = images.image_size(storage, name)
+        if thumbnail is None:
+            thumbnail = images.thumbnail_name(name) if size else ''
+        return self.model(
+            user=user,
+            path=name,
+            size=storage.size(name),
+            width=size[0] if size else None,
+            height=size[1] if size else None,
+            thumbnail=thumbnail,
+            created_time=created_time or timezone.now()
+        )
+
+    def record(self, storage, name, user=None):
+        uploaded = self.build(storage, name, user)
+        uploaded.save()
+        return uploaded
+
+
+# 富文本编辑器上传的文件，浏览时按上传者和时间从此表分页读取，无需遍历上传目录
+class UploadedFile(models.Model):
+    user = models.ForeignKey(
+        to=User,
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
+        verbose_name='上传者'
+    )
+    path = models.CharField(max_length=255, unique=True, verbose_name='路径')
+    size = models.BigIntegerField(verbose_name='大小')
+    width = models.PositiveIntegerField(blank=True, null=True, verbose_name='宽度')
+    height = models.PositiveIntegerField(blank=True, null=True, verbose_name='高度')
+    thumbnail = models.CharField(max_length=255, blank=True, verbose_name='缩略图')
+    created_time = models.DateTimeField(default=timezone.now, verbose_name='上传时间')
+
+    objects = UploadedFileManager()
+
+    class Meta:
+        verbose_name = '上传文件'
+        verbose_name_plural = verbose_name
+        # 浏览时按上传者筛选后按时间倒序分页，管理员浏览全部
+        indexes = [
+            models.Index(fields=['user', '-created_time', '-id'], name='uploadedfile_user_idx'),
+            models.Index(fields=['-created_time', '-id'], name='uploadedfile_created_idx'),
+        ]
+
+    def __str__(self):
+        return self.path
+
+
+# 富文本中引用了尚未处理完的上传图片的对象，图片处理完成后据此重新保存这些对象以补上srcset，无需扫描内容
+class ImageReference(models.Model):
+    path = models.CharField(max_length=255, db_index=True, verbose_name='图片路径')
+    content_type = models.ForeignKey(
+        to=ContentType,
+        on_delete=models.CASCADE,
+        verbose_name='对象类型'
+    )
+    object_id = models.PositiveIntegerField(verbose_name='对象ID')
+
+    class Meta:
+        verbose_name = '待处理图片引用'
+        verbose_name_plural = verbose_name
+        unique_together = ('path', 'content_type', 'object_id')
+
+    def __str__(self):
+        return self.path
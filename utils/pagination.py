@@ -0,0 +1,117 @@
+from django.contrib.admin.views.main import ORDER_VAR, PAGE_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.db import models
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+# 键集分页的游标参数
+CURSOR_VAR = 'cursor'
+
+
+# 将(时间, id)编码为游标
+def format_cursor(value, pk):
+    return value.isoformat() + '_' + str(pk)
+
+
+# 解析游标，格式错误时返回None
+def parse_cursor(cursor):
+    if not cursor:
+        return None
+    value, _, pk = cursor.rpartition('_')
+    value = parse_datetime(value)
+    if value is None or not pk.isdigit():
+        return None
+    return value, int(pk)
+
+
+# 按(field, id)倒序取游标之后的记录
+def seek(queryset, field, cursor=None):
+    queryset = queryset.order_by('-' + field, '-pk')
+    if cursor:
+        value, pk = cursor
+        queryset = queryset.filter(models.Q(**{field + '__lt': value}) | models.Q(**{field: value, 'pk__lt': pk}))
+    return queryset
+
+
+# 计数最多统计到上限，超过上限时不再精确计数
+class CappedCountPaginator(Paginator):
+    count_cap = 10000
+
+    @cached_property
+    def count(self):
+        return self.object_list.order_by()[:self.count_cap + 1].count()
+
+    @property
+    def capped(self):
+        return self.count > self.count_cap
+
+    # 用于显示的总数，超过上限时显示为“10,000+”
+    @property
+    def count_display(self):
+        if self.capped:
+            return '{:,}+'.format(self.count_cap)
+        return '{:,}'.format(self.count)
+
+
+# 未按列排序时使用键集分页的列表页
+class KeysetChangeList(ChangeList):
+    cursor = None
+    next_cursor = None
+
+    @property
+    def keyset(self):
+        return bool(self.model_admin.keyset_field) and ORDER_VAR not in self.params
+
+    # 游标不是筛选条件，与页码一样在筛选前从参数中移除
+    def get_queryset(self, request):
+        self.cursor = parse_cursor(self.params.pop(CURSOR_VAR, None))
+        return super(KeysetChangeList, self).get_queryset(request)
+
+    def get_ordering(self, request, queryset):
+        if self.keyset:
+            return ['-' + self.model_admin.keyset_field, '-pk']
+        return super(KeysetChangeList, self).get_ordering(request, queryset)
+
+    def get_results(self, request):
+        if not self.keyset:
+            super(KeysetChangeList, self).get_results(request)
+            self.count_display = self.paginator.count_display
+            return
+        field = self.model_admin.keyset_field
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        # 多取一条判断是否有下一页
+        page = list(seek(self.queryset, field, self.cursor)[:self.list_per_page + 1])
+        if len(page) > self.list_per_page:
+            page = page[:self.list_per_page]
+            self.next_cursor = format_cursor(getattr(page[-1], field), page[-1].pk)
+        self.result_count = paginator.count
+        self.count_display = paginator.count_display
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = page
+        self.can_show_all = False
+        self.multi_page = bool(self.cursor or self.next_cursor)
+        self.paginator = paginator
+
+    def first_page_url(self):
+        return self.get_query_string(remove=[CURSOR_VAR, PAGE_VAR])
+
+    def next_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.next_cursor}, [PAGE_VAR])
+
+
+# 为ModelAdmin启用上限计数，设置keyset_field后未按列排序时按(keyset_field, id)键集分页
+class KeysetPaginationMixin:
+    keyset_field = None
+    count_cap = 10000
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        paginator = super(KeysetPaginationMixin, self).get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+        paginator.count_cap = self.count_cap
+        return paginator
@@ -0,0 +1,80 @@
+from django.contrib.admin.options import InlineModelAdmin
+from django.contrib.auth.models import AnonymousUser
+from .models import User
+
+
+# 单项操作的权限：先依次判断对象级规则，规则均返回None时按角色查表
+class Permission:
+    def __init__(self, *roles, rules=()):
+        # 编译为按用户类型索引的元组，查表为常数时间
+        self.roles = tuple(role in roles for role, _ in User.TYPE_CHOICE)
+        self.rules = tuple(rules)
+
+    def check(self, request, obj=None):
+        for rule in self.rules:
+            result = rule(request, obj)
+            if result is not None:
+                return result
+        return self.roles[request.user.type]
+
+
+# 所有角色
+ALL_ROLES = tuple(role for role, _ in User.TYPE_CHOICE)
+
+
+# 常用对象级规则：首页不显示对应按钮
+def requires_object(request, obj):
+    if obj is None:
+        return False
+
+
+# 由权限矩阵决定ModelAdmin的各项权限，同一请求内对同一对象的重复判断只计算一次
+class PermissionMatrixMixin:
+    # 操作名（module/view/add/change/delete）到Permission的映射，未声明的操作使用默认权限
+    permissions = {}
+
+    def check_permission(self, action, request, obj=None):
+        # 未登录用户无权限
+        if isinstance(request.user, AnonymousUser):
+            return False
+        # 未保存的对象不缓存
+        if obj is not None and obj.pk is None:
+            return self.permissions[action].check(request, obj)
+        cache = request.__dict__.setdefault('_permission_cache', {})
+        key = (self.model, action, None if obj is None else obj.pk)
+        if key not in cache:
+            cache[key] = self.permissions[action].check(request, obj)
+        return cache[key]
+
+    def has_module_permission(self, request):
+        if 'module' not in self.permissions:
+            return super(PermissionMatrixMixin, self).has_module_permission(request)
+        return self.check_permission('module', request)
+
+    def has_view_permission(self, request, obj=None):
+        if 'view' not in self.permissions:
+            return super(PermissionMatrixMixin, self).has_view_permission(request, obj)
+        return self.check_permission('view', request, obj)
+
+    # 内联对象的obj为所属的父对象
+    def has_add_permission(self, request, obj=None):
+        if 'add' not in self.permissions:
+            if isinstance(self, InlineModelAdmin):
+                return super(PermissionMatrixMixin, self).has_add_permission(request, obj)
+            return super(PermissionMatrixMixin, self).has_add_permission(request)
+        return self.check_permission('add', request, obj)
+
+    def has_change_permission(self, request, obj=None):
+        if 'change' not in self.permissions:
+            return super(PermissionMatrixMixin, self).has_change_permission(request, obj)
+        return self.check_permission('change', request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        if 'delete' not in self.permissions:
+            return super(PermissionMatrixMixin, self).has_delete_permission(request, obj)
+        return self.check_permission('delete', request, obj)
+
+    # 对象保存后其状态可能改变，清空本请求的权限缓存
+    def save_model(self, request, obj, form, change):
+        request.__dict__.pop('_permission_cache', None)
+        super(PermissionMatrixMixin, self).save_model(request, obj, form, change)
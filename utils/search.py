@@ -0,0 +1,196 @@
+import re
+from html import unescape
+from django.db import OperationalError, connection, models
+from django.utils.html import strip_tags
+from django.utils.text import smart_split, unescape_string_literal
+
+# 已建立全文索引的模型及其字段
+registry = {}
+
+# 本进程中已确认存在的索引表
+_ready_tables = set()
+
+# 当前数据库是否支持FTS5，首次使用时检测
+_available = None
+
+# 连续的中日韩字符
+CJK = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+
+
+# 注册需要建立全文索引的模型字段
+def register(model, *fields):
+    registry[model] = fields
+
+
+# 当前数据库是否支持FTS5全文索引
+def available():
+    global _available
+    if _available is None:
+        _available = False
+        if connection.vendor == 'sqlite':
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(body)')
+                    cursor.execute('DROP TABLE temp.fts5_probe')
+                _available = True
+            except OperationalError:
+                pass
+    return _available
+
+
+def table_name(model):
+    return model._meta.db_table + '_fts'
+
+
+# 去除HTML标签和实体，中日韩字符切分为单字和相邻两字，其余文本交给unicode61分词器
+def tokenize(text):
+    text = unescape(strip_tags(text or ''))
+    tokens = []
+    position = 0
+    for match in CJK.finditer(text):
+        tokens.append(text[position:match.start()])
+        run = match.group()
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        position = match.end()
+    tokens.append(text[position:])
+    return ' '.join(token for token in tokens if token.strip())
+
+
+# 将单个搜索词转换为FTS5查询：中日韩字符按相邻两字匹配，其余单词按前缀匹配，各部分须同时满足
+def build_query(word):
+    clauses = []
+    position = 0
+    for match in CJK.finditer(word):
+        clauses.extend('"%s"*' % part for part in re.findall(r'\w+', word[position:match.start()]))
+        run = match.group()
+        if len(run) == 1:
+            clauses.append('"%s"' % run)
+        else:
+            clauses.extend('"%s"' % run[i:i + 2] for i in range(len(run) - 1))
+        position = match.end()
+    clauses.extend('"%s"*' % part for part in re.findall(r'\w+', word[position:]))
+    return ' AND '.join(clauses)
+
+
+def document(instance):
+    return ' '.join(tokenize(getattr(instance, field)) for field in registry[type(instance)])
+
+
+# 索引表是否存在，只检查不创建；缺少时由迁移或rebuild_search_index命令创建
+def ready(model):
+    table = table_name(model)
+    if table in _ready_tables:
+        return True
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [table])
+        if cursor.fetchone() is None:
+            return False
+    _ready_tables.add(table)
+    return True
+
+
+def create_table(model):
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE VIRTUAL TABLE %s USING fts5(body)' % connection.ops.quote_name(table_name(model)))
+
+
+# 创建缺少的索引表并为已有记录建立索引，返回新建索引的模型
+def create_tables():
+    if not available():
+        return []
+    created = []
+    for model in registry:
+        if not ready(model):
+            create_table(model)
+            rebuild(model)
+            created.append(model)
+    return created
+
+
+# 重建指定模型的全文索引
+def rebuild(model, chunk_size=1000):
+    table = connection.ops.quote_name(table_name(model))
+    fields = registry[model]
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s' % table)
+        rows = []
+        for values in model.objects.order_by().values_list('pk', *fields).iterator(chunk_size=chunk_size):
+            rows.append((values[0], ' '.join(tokenize(value) for value in values[1:])))
+            if len(rows) >= chunk_size:
+                cursor.executemany('INSERT INTO %s (rowid, body) VALUES (%%s, %%s)' % table, rows)
+                rows = []
+        if rows:
+            cursor.executemany('INSERT INTO %s (rowid, body) VALUES (%%s, %%s)' % table, rows)
+
+
+# 更新单个对象的索引，update_fields不含已注册字段时跳过
+def index(instance, update_fields=None):
+    model = type(instance)
+    if not (available() and ready(model)):
+        return
+    if update_fields is not None and not set(update_fields) & set(registry[model]):
+        return
+    table = connection.ops.quote_name(table_name(model))
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % table, [instance.pk])
+        cursor.execute('INSERT INTO %s (rowid, body) VALUES (%%s, %%s)' % table, [instance.pk, document(instance)])
+
+
+# 删除单个对象的索引
+def unindex(instance):
+    model = type(instance)
+    if not (available() and ready(model)):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % connection.ops.quote_name(table_name(model)), [instance.pk])
+
+
+# 原样输出的子查询，RawSQL自带的括号在IN中会被当作标量子查询
+class RawSubquery(models.expressions.RawSQL):
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+# 全文索引中匹配搜索词的对象主键子查询
+def matching(model, word):
+    query = build_query(word)
+    if not query:
+        return models.Q(pk__in=[])
+    table = connection.ops.quote_name(table_name(model))
+    return models.Q(pk__in=RawSubquery(
+        'SELECT rowid FROM %s WHERE %s MATCH %%s' % (table, table), [query]
+    ))
+
+
+# 以全文索引代替已注册字段的LIKE查询，其余关联字段改为子查询，避免扫描整张表
+class FullTextSearchMixin:
+    # 索引表尚未创建时使用原有的LIKE查询
+    def full_text_ready(self):
+        return available() and self.model in registry and ready(self.model)
+
+    def get_search_fields(self, request):
+        search_fields = super(FullTextSearchMixin, self).get_search_fields(request)
+        if not self.full_text_ready():
+            return search_fields
+        return [field for field in search_fields if field not in registry[self.model]]
+
+    def get_search_results(self, request, queryset, search_term):
+        if not self.full_text_ready():
+            return super(FullTextSearchMixin, self).get_search_results(request, queryset, search_term)
+        condition = models.Q()
+        for word in smart_split(search_term):
+            if word.startswith(('"', "'")) and word[0] == word[-1]:
+                word = unescape_string_literal(word)
+            word_condition = matching(self.model, word)
+            for field in self.get_search_fields(request):
+                relation, _, lookup = field.partition('__')
+                if lookup:
+                    related = self.model._meta.get_field(relation).related_model
+                    word_condition |= models.Q(**{
+                        relation + '__in': related.objects.filter(**{lookup + '__icontains': word}).values('pk')
+                    })
+                else:
+                    word_condition |= models.Q(**{field + '__icontains': word})
+            condition &= word_condition
+        return queryset.filter(condition), False
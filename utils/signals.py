@@ -0,0 +1,58 @@
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+from CollectingAndSubmitting import visibility
+from . import search
+from .forms import invalidate_anti_robot_cache
+from .models import AntiRobot, Feedback, OrganizationClosure, User
+
+
+# 上级组织变更时更新组织关系闭包
+@receiver(m2m_changed, sender=User.organizations.through)
+def update_organization_closure(sender, instance, action, reverse, pk_set, **kwargs):
+    # 从组织一侧清空成员前记录原有成员
+    if action == 'pre_clear' and reverse:
+        instance._cleared_members = list(instance.members.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        OrganizationClosure.objects.rebuild_for(pk_set if reverse else [instance.pk])
+    elif action == 'post_clear':
+        OrganizationClosure.objects.rebuild_for(getattr(instance, '_cleared_members', []) if reverse else [instance.pk])
+
+
+# 删除用户前记录其所有下级
+@receiver(pre_delete, sender=User)
+def record_descendants(sender, instance, **kwargs):
+    instance._closure_descendants = list(instance.descendants().values_list('id', flat=True))
+
+
+# 删除用户后重建其原有下级的闭包
+@receiver(post_delete, sender=User)
+def rebuild_descendants(sender, instance, **kwargs):
+    OrganizationClosure.objects.rebuild_for(getattr(instance, '_closure_descendants', []))
+    visibility.invalidate()
+
+
+# 验证问答变更时清空验证问题缓存
+@receiver(post_save, sender=AntiRobot)
+@receiver(post_delete, sender=AntiRobot)
+def invalidate_anti_robot(sender, **kwargs):
+    invalidate_anti_robot_cache()
+
+
+# 反馈内容变更时更新全文索引
+search.register(Feedback, 'title', 'content')
+
+
+@receiver(post_save, sender=Feedback)
+def index_feedback(sender, instance, update_fields=None, **kwargs):
+    search.index(instance, update_fields)
+
+
+@receiver(post_delete, sender=Feedback)
+def unindex_feedback(sender, instance, **kwargs):
+    search.unindex(instance)
+
+
+# 迁移后创建缺少的全文索引表并建立索引，请求中只使用已有的索引表
+@receiver(post_migrate)
+def create_search_tables(sender, **kwargs):
+    search.create_tables()
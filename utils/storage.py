@@ -0,0 +1,190 @@
+import ctypes
+import ctypes.util
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+from django.core.files.storage import FileSystemStorage
+from django.db import models, transaction
+from django.utils.deconstruct import deconstructible
+from .models import StoredFile
+
+# 内容寻址文件的存放目录
+CAS_DIR = 'files'
+
+# 内容寻址文件名：files/哈希前两位/哈希三四位/哈希/原文件名，实际文件保存在去掉原文件名的路径
+CAS_NAME = re.compile(r'^%s/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})/[^/]+$' % CAS_DIR)
+
+# 文件名中原文件名之前部分的长度
+PREFIX_LENGTH = len(CAS_DIR) + len('/00/00/') + 64 + 1
+
+
+# 哈希对应的实际文件路径
+def blob_name(digest):
+    return '%s/%s/%s/%s' % (CAS_DIR, digest[:2], digest[2:4], digest)
+
+
+# 解析内容寻址文件名中的哈希，旧的平铺文件名返回None
+def parse_hash(name):
+    match = CAS_NAME.match(name or '')
+    return match.group(1) if match else None
+
+
+# 逐块读取文件计算SHA-256
+def file_digest(path, chunk_size=64 * 1024):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+# libcrypto中SHA256_CTX的大小，中间状态即该结构体的全部字节
+SHA256_STATE_SIZE = 112
+
+_libcrypto = None
+
+
+# 加载libcrypto的SHA-256函数，系统中没有时返回False
+def libcrypto():
+    global _libcrypto
+    if _libcrypto is None:
+        _libcrypto = False
+        name = ctypes.util.find_library('crypto')
+        if name:
+            try:
+                lib = ctypes.CDLL(name)
+                lib.SHA256_Init.argtypes = [ctypes.c_char_p]
+                lib.SHA256_Update.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t]
+                lib.SHA256_Final.argtypes = [ctypes.c_char_p, ctypes.c_char_p]
+                _libcrypto = lib
+            except (OSError, AttributeError):
+                pass
+    return _libcrypto
+
+
+# 可保存中间状态的SHA-256，分块上传的各请求可在不同进程中接着计算，无需重读已接收的部分；
+# hashlib的状态无法取出，因此直接使用libcrypto，没有libcrypto时new()返回None
+class ResumableSHA256:
+    def __init__(self, lib, ctx):
+        self.lib = lib
+        self.ctx = ctx
+
+    # 从保存的状态继续计算，未提供状态时从头开始；状态无效或不支持时返回None
+    @classmethod
+    def new(cls, state=None):
+        lib = libcrypto()
+        if not lib:
+            return None
+        if state is None:
+            ctx = ctypes.create_string_buffer(SHA256_STATE_SIZE)
+            lib.SHA256_Init(ctx)
+        elif len(state) == SHA256_STATE_SIZE:
+            ctx = ctypes.create_string_buffer(bytes(state), SHA256_STATE_SIZE)
+        else:
+            return None
+        return cls(lib, ctx)
+
+    def update(self, data):
+        self.lib.SHA256_Update(self.ctx, data, len(data))
+
+    # 当前的中间状态
+    def state(self):
+        return self.ctx.raw
+
+    # 完成计算的十六进制哈希，不影响中间状态
+    def hexdigest(self):
+        ctx = ctypes.create_string_buffer(self.ctx.raw, SHA256_STATE_SIZE)
+        digest = ctypes.create_string_buffer(32)
+        self.lib.SHA256_Final(digest, ctx)
+        return digest.raw.hex()
+
+
+# 按内容哈希分两级目录保存文件，相同内容只保存一份并在StoredFile中记录引用数
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    chunk_size = 64 * 1024
+
+    def path(self, name):
+        digest = parse_hash(name)
+        if digest:
+            name = blob_name(digest)
+        return super(ContentAddressedStorage, self).path(name)
+
+    # 同一文件名可对应不同内容，无需避让重名，只需保证加上哈希目录后不超过字段长度
+    def get_available_name(self, name, max_length=None):
+        name = os.path.basename(name)
+        if max_length and PREFIX_LENGTH + len(name) > max_length:
+            root, ext = os.path.splitext(name)
+            name = root[:max(max_length - PREFIX_LENGTH - len(ext), 1)] + ext
+            name = name[:max_length - PREFIX_LENGTH]
+        return name
+
+    # 临时文件目录中的路径，与实际文件位于同一文件系统，可直接移入
+    def temp_path(self, name):
+        temp_dir = super(ContentAddressedStorage, self).path(CAS_DIR + '/tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+        return os.path.join(temp_dir, name)
+
+    # 边计算哈希边写入临时文件，内容已存在时丢弃临时文件只增加引用数
+    def _save(self, name, content):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.temp_path('')))
+        try:
+            sha = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as temp:
+                for chunk in content.chunks(self.chunk_size):
+                    sha.update(chunk)
+                    temp.write(chunk)
+            return self.save_temp(temp_path, name, sha.hexdigest(), getattr(content, 'content_type', None))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    # 将已写好的临时文件移入存储，未提供哈希时读取一遍计算；返回文件名，临时文件被移走或删除
+    def save_temp(self, temp_path, name, digest=None, content_type=None, max_length=None):
+        name = self.get_available_name(name, max_length)
+        if digest is None:
+            digest = file_digest(temp_path, self.chunk_size)
+        try:
+            os.chmod(temp_path, 0o644 if self.file_permissions_mode is None else self.file_permissions_mode)
+            mime = mimetypes.guess_type(name)[0] or content_type or 'application/octet-stream'
+            self.acquire(digest, os.path.getsize(temp_path), mime, temp_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return blob_name(digest) + '/' + name
+
+    # 增加一次引用，实际文件不存在时将临时文件移入，与删除在同一事务中进行以免刚移入的文件被回收
+    def acquire(self, digest, size, mime, temp_path):
+        with transaction.atomic():
+            stored, created = StoredFile.objects.get_or_create(hash=digest, defaults={'size': size, 'mime': mime})
+            StoredFile.objects.filter(pk=stored.pk).update(refcount=models.F('refcount') + 1)
+            full_path = super(ContentAddressedStorage, self).path(blob_name(digest))
+            if not os.path.exists(full_path):
+                directory = os.path.dirname(full_path)
+                os.makedirs(directory, exist_ok=True)
+                if self.directory_permissions_mode is not None:
+                    os.chmod(directory, self.directory_permissions_mode)
+                os.replace(temp_path, full_path)
+
+    # 内容寻址文件减少一次引用，引用数归零时删除实际文件；旧的平铺文件直接删除
+    def delete(self, name):
+        digest = parse_hash(name)
+        if not digest:
+            return super(ContentAddressedStorage, self).delete(name)
+        with transaction.atomic():
+            if StoredFile.objects.filter(hash=digest, refcount__gt=1).update(refcount=models.F('refcount') - 1):
+                return
+            StoredFile.objects.filter(hash=digest).delete()
+            super(ContentAddressedStorage, self).delete(blob_name(digest))
+
+
+# 收集和提交的附件存储
+attachment_storage = ContentAddressedStorage()
+
+
+# 提交事务后释放内容寻址文件的一次引用，旧的平铺文件保持原样
+def release(storage, name):
+    if isinstance(storage, ContentAddressedStorage) and parse_hash(name):
+        transaction.on_commit(lambda: storage.delete(name))
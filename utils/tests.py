@@ -1,3 +1,405 @@
-from django.test import TestCase
+import datetime
+import os
+import re
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import mock, skipIf
+from django.contrib import admin
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from ckeditor_uploader import utils as ckeditor_utils
+from CollectingAndSubmitting.models import Collecting, Submitting
+from . import images, media, pagination, search
+from .forms import RegisterForm, get_anti_robot, invalidate_anti_robot_cache
+from .models import AntiRobot, Feedback, ImageReference, OrganizationClosure, UploadedFile, User
 
-# Create your tests here.
+
+# 媒体文件的路径检查、范围请求和响应头
+class MediaTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        os.makedirs(os.path.join(self.media_root, 'upload'))
+        for name, content in (('secret_grades.xlsx', b'grades'), ('upload/a.png', b'png'), ('upload/evil.html', b'<script></script>')):
+            with open(os.path.join(self.media_root, name), 'wb') as f:
+                f.write(content)
+        self.student = User.objects.create(username='2000001', name='学生', type=User.STUDENT)
+        self.client.force_login(self.student)
+
+    def test_normalize(self):
+        self.assertEqual(media.normalize('upload/./a.png'), 'upload/a.png')
+        self.assertIsNone(media.normalize('upload/../secret_grades.xlsx'))
+        self.assertIsNone(media.normalize('upload/..\\secret_grades.xlsx'))
+        self.assertIsNone(media.normalize('/etc/passwd'))
+        self.assertIsNone(media.normalize('.'))
+
+    # upload/../之类的路径不能绕过权限检查
+    def test_traversal(self):
+        self.assertEqual(self.client.get('/media/secret_grades.xlsx').status_code, 404)
+        self.assertEqual(self.client.get('/media/upload/../secret_grades.xlsx').status_code, 404)
+        self.assertEqual(self.client.get('/media/upload/%2e%2e/secret_grades.xlsx').status_code, 404)
+        self.assertEqual(self.client.get('/media/upload/%2E%2E%2Fsecret_grades.xlsx').status_code, 404)
+
+    def test_inline_image(self):
+        response = self.client.get('/media/upload/a.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'png')
+        self.assertTrue(response['Content-Disposition'].startswith('inline;'))
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+    # HTML等文件作为附件下载，不以text/html输出
+    def test_active_content_is_attachment(self):
+        response = self.client.get('/media/upload/evil.html')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        self.assertTrue(response['Content-Disposition'].startswith('attachment;'))
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+    def test_range(self):
+        response = self.client.get('/media/upload/evil.html', HTTP_RANGE='bytes=1-6')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'script')
+        self.assertEqual(response['Content-Range'], 'bytes 1-6/17')
+        self.assertEqual(self.client.get('/media/upload/a.png', HTTP_RANGE='bytes=10-').status_code, 416)
+
+    def test_parse_range(self):
+        self.assertEqual(media.parse_range('bytes=0-9', 100), (0, 10))
+        self.assertEqual(media.parse_range('bytes=90-', 100), (90, 10))
+        self.assertEqual(media.parse_range('bytes=-10', 100), (90, 10))
+        self.assertEqual(media.parse_range('bytes=-200', 100), (0, 100))
+        self.assertEqual(media.parse_range('bytes=95-200', 100), (95, 5))
+        self.assertIs(media.parse_range('bytes=100-', 100), False)
+        self.assertIs(media.parse_range('bytes=-0', 100), False)
+        self.assertIsNone(media.parse_range('bytes=5-1', 100))
+        self.assertIsNone(media.parse_range('bytes=0-1,5-6', 100))
+        self.assertIsNone(media.parse_range('items=0-1', 100))
+        self.assertIsNone(media.parse_range('bytes=-', 100))
+
+
+# 全文索引表在迁移后已存在，保存时同步更新
+class SearchTests(TestCase):
+    def setUp(self):
+        if not search.available():
+            self.skipTest('SQLite不支持FTS5')
+        self.user = User.objects.create(username='2000001', name='学生', type=User.STUDENT)
+
+    def test_tables_created_by_migrate(self):
+        for model in search.registry:
+            self.assertTrue(search.ready(model))
+
+    def test_index_and_match(self):
+        feedback = Feedback.objects.create(title='宿舍报修', content='<p>空调<b>漏水</b> leaking</p>', user=self.user)
+        found = lambda word: list(Feedback.objects.filter(search.matching(Feedback, word)).values_list('pk', flat=True))
+        self.assertEqual(found('漏水'), [feedback.pk])
+        self.assertEqual(found('leak'), [feedback.pk])
+        self.assertEqual(found('宿舍'), [feedback.pk])
+        self.assertEqual(found('b'), [])
+        feedback.delete()
+        self.assertEqual(found('漏水'), [])
+
+
+# 用户选择接口只对表单中可编辑的字段开放，可选范围与表单一致
+class UserPickerTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin1', name='管理员', type=User.ADMIN)
+        self.org = User.objects.create(username='org1', name='团委', type=User.ORGANIZATION)
+        self.club = User.objects.create(username='club1', name='社团', type=User.CLUB)
+        self.member = User.objects.create(username='2000001', name='成员', type=User.STUDENT)
+        self.member.organizations.add(self.org)
+        self.stranger = User.objects.create(username='2000002', name='其他', type=User.STUDENT)
+
+    def pick(self, user, url):
+        self.client.force_login(user)
+        response = self.client.get(url, {'term': ''})
+        if response.status_code != 200:
+            return response.status_code
+        return sorted(result['text'].split()[-1] for result in response.json()['results'])
+
+    def test_hidden_field_forbidden(self):
+        url = '/CollectingAndSubmitting/collecting/user_picker/publisher/'
+        self.assertEqual(self.pick(self.org, url), 403)
+        self.assertEqual(self.pick(self.club, url), 403)
+        self.assertEqual(self.pick(self.member, url), 403)
+        self.assertIn('admin1', self.pick(self.admin, url))
+        self.assertEqual(self.pick(self.club, '/CollectingAndSubmitting/collecting/user_picker/collect_from/'), 403)
+        self.assertEqual(self.pick(self.org, '/utils/user/user_picker/organizations/'), 403)
+
+    def test_scoped_choices(self):
+        self.assertEqual(self.pick(self.org, '/CollectingAndSubmitting/collecting/user_picker/collect_from/'), ['2000001'])
+        self.assertNotIn('admin1', self.pick(self.club, '/CollectingAndSubmitting/collecting/user_picker/valid_users/'))
+        self.assertEqual(self.pick(self.admin, '/utils/user/user_picker/organizations/'), ['club1', 'org1'])
+
+    # 受众规则内联的可选范围与规则表单的校验一致
+    def test_inline_choices(self):
+        url = '/CollectingAndSubmitting/collecting/audiencerule/user_picker/%s/'
+        self.assertEqual(self.pick(self.org, url % 'user'), ['2000001'])
+        self.assertEqual(self.pick(self.org, url % 'organization'), ['2000001', 'org1'])
+        self.assertEqual(len(self.pick(self.admin, url % 'user')), 5)
+        self.assertEqual(self.pick(self.member, url % 'user'), 403)
+        self.assertEqual(self.pick(self.org, url % 'college'), 404)
+        self.assertContains(self.client.get('/CollectingAndSubmitting/collecting/add/'), url % 'organization')
+
+
+# 组织关系闭包：最短距离、增量重建和环路
+class OrganizationClosureTests(TestCase):
+    def setUp(self):
+        self.users = {
+            name: User.objects.create(username=name, name=name, type=User.ORGANIZATION)
+            for name in ('a', 'b', 'c', 'd', 'e')
+        }
+
+    # 直接写入上级组织关系，不触发信号，由测试显式重建
+    def link(self, member, *organizations):
+        through = User.organizations.through
+        through.objects.bulk_create([
+            through(from_user_id=self.users[member].pk, to_user_id=self.users[organization].pk)
+            for organization in organizations
+        ])
+
+    def closure(self):
+        names = {user.pk: name for name, user in self.users.items()}
+        return {
+            (names[ancestor], names[descendant]): depth
+            for ancestor, descendant, depth in OrganizationClosure.objects.values_list('ancestor', 'descendant', 'depth')
+        }
+
+    def test_shortest_depth(self):
+        # a <- b <- c <- d，同时d直接属于a
+        self.link('b', 'a')
+        self.link('c', 'b')
+        self.link('d', 'c', 'a')
+        OrganizationClosure.objects.rebuild_all()
+        self.assertEqual(self.closure(), {
+            ('a', 'b'): 1, ('b', 'c'): 1, ('a', 'c'): 2,
+            ('c', 'd'): 1, ('b', 'd'): 2, ('a', 'd'): 1,
+        })
+
+    def test_rebuild_for_descendants(self):
+        self.link('b', 'a')
+        self.link('c', 'b')
+        OrganizationClosure.objects.rebuild_all()
+        self.link('a', 'e')
+        OrganizationClosure.objects.rebuild_for([self.users['a'].pk])
+        self.assertEqual(self.closure()[('e', 'c')], 3)
+        self.assertEqual(len(self.closure()), 6)
+
+    # 环路上的用户互为上级，环路下级的用户同样得到完整的上级
+    def test_cycle(self):
+        self.link('a', 'c')
+        self.link('b', 'a')
+        self.link('c', 'b')
+        self.link('d', 'c')
+        self.link('e', 'd')
+        OrganizationClosure.objects.rebuild_all()
+        closure = self.closure()
+        for member, organization, depth in (('b', 'a', 1), ('c', 'a', 2), ('a', 'c', 1), ('a', 'b', 2), ('d', 'a', 3), ('e', 'a', 4), ('e', 'b', 3)):
+            self.assertEqual(closure[(organization, member)], depth)
+        self.assertFalse(any(ancestor == descendant for ancestor, descendant in closure))
+        self.assertEqual(len(closure), 6 + 3 + 4)
+
+
+# 注册页的验证问题缓存：构造表单不查询数据库，修改验证问答后立即生效
+class AntiRobotTests(TestCase):
+    def setUp(self):
+        invalidate_anti_robot_cache()
+        AntiRobot.objects.create(question='问题一', hint='提示', answer='答案一')
+
+    def test_cached(self):
+        question = get_anti_robot()
+        self.assertEqual(question, ('问题一', '提示', '答案一'))
+        with self.assertNumQueries(0):
+            RegisterForm()
+            self.assertEqual(get_anti_robot(), question)
+
+    def test_invalidated_on_change(self):
+        get_anti_robot()
+        AntiRobot.objects.update(question='问题二')
+        self.assertEqual(get_anti_robot()[0], '问题一')
+        AntiRobot.objects.get().save()
+        self.assertEqual(get_anti_robot()[0], '问题二')
+        AntiRobot.objects.all().delete()
+        self.assertEqual(get_anti_robot()[2], '1919')
+
+    # 注册页的查询数不随用户数增加
+    def test_register_page_queries(self):
+        self.assertEqual(self.client.get('/register').status_code, 200)
+        with CaptureQueriesContext(connection) as few_users:
+            self.client.get('/register')
+        User.objects.bulk_create([User(username='%07d' % i, name='学生', type=User.STUDENT) for i in range(500)])
+        with CaptureQueriesContext(connection) as many_users:
+            self.client.get('/register')
+        self.assertEqual(len(many_users), len(few_users))
+        self.assertFalse(any('FROM "utils_user"' in query['sql'] for query in many_users.captured_queries))
+
+
+# 上传图片的缩略图名和srcset
+class ImageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.publisher = User.objects.create(username='org1', name='团委', type=User.ORGANIZATION)
+
+    # 未安装Pillow时沿用ckeditor_uploader的缩略图名，记录上传文件不出错
+    def test_without_pillow(self):
+        with mock.patch.object(images, 'Image', None):
+            self.assertIsNone(images.thumbnail_format())
+            self.assertEqual(images.thumbnail_name('upload/a.jpg'), 'upload/a_thumb.jpg')
+            with open(os.path.join(self.media_root, 'a.jpg'), 'wb') as f:
+                f.write(b'jpg')
+            self.assertEqual(UploadedFile.objects.build(ckeditor_utils.storage, 'a.jpg').thumbnail, '')
+
+    @skipIf(images.Image is None, '未安装Pillow')
+    def test_thumbnail_name_uses_thumbnail_format(self):
+        self.assertEqual(images.thumbnail_name('upload/a.jpg'), 'upload/a_thumb' + images.EXTENSIONS[images.thumbnail_format()])
+
+    # 保存时各宽度图片尚未生成，生成完成后为已保存的内容补上srcset
+    @skipIf(images.Image is None, '未安装Pillow')
+    def test_srcset_added_after_processing(self):
+        storage = ckeditor_utils.storage
+        output = BytesIO()
+        images.Image.new('RGB', (1200, 600), 'red').save(output, 'PNG')
+        name = storage.save('upload/big.png', ContentFile(output.getvalue()))
+        html = '<p><img src="%s"></p>' % storage.url(name)
+        collecting = Collecting.objects.create(title='收集', content=html, publisher=self.publisher, allow_multiple=False, private=False, forced=False)
+        self.assertNotIn('srcset', Collecting.objects.get(pk=collecting.pk).content)
+        self.assertEqual(list(ImageReference.objects.values_list('path', 'object_id')), [(name, collecting.pk)])
+        # 未经保存信号写入的内容没有引用记录，处理完成后不扫描内容表
+        unrecorded = Collecting.objects.create(title='其他', content='', publisher=self.publisher, allow_multiple=False, private=False, forced=False)
+        Collecting.objects.filter(pk=unrecorded.pk).update(content=html)
+        images.make_variants(storage, name)
+        with mock.patch.object(search, 'index', wraps=search.index) as index:
+            images.add_srcset_to_saved(storage, name)
+        content = Collecting.objects.get(pk=collecting.pk).content
+        self.assertIn('srcset=', content)
+        self.assertIn('_w480', content)
+        self.assertEqual(Collecting.objects.get(pk=unrecorded.pk).content, html)
+        self.assertEqual([call.args[0].pk for call in index.call_args_list], [collecting.pk])
+        self.assertFalse(ImageReference.objects.exists())
+
+
+# 需要检查查询计划的列表页筛选器：(模型, 筛选器在ModelAdmin中的名称)
+PLAN_FILTERS = (
+    (Collecting, 'DueTimeMissedFilter'),
+    (Collecting, 'Submitted'),
+    (Submitting, 'Type'),
+    (User, 'Member'),
+)
+
+# 允许按列表页排序顺序扫描主表的筛选：(筛选器名称, 取值)，分页取满一页即可停止
+ORDERED_WALKS = {
+    # 未提交和已超期的收集接近全表
+    ('Submitted', '0'),
+    ('DueTimeMissedFilter', '5'),
+    # 截止时间在一周后的收集集中在最新发布的记录中
+    ('DueTimeMissedFilter', '1'),
+}
+
+SCAN = re.compile(r'^SCAN (TABLE )?(?P<table>\S+)')
+
+
+# 各角色使用列表页筛选器时的查询不出现全表扫描，索引失效时测试失败
+@skipIf(connection.vendor != 'sqlite', '仅在SQLite上检查查询计划')
+class QueryPlanTests(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create(username='plan_%d' % role, name=name, type=role)
+            for role, name in User.TYPE_CHOICE
+        ]
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    # 查询计划中的全表扫描，allow_ordered_walk为True时不计入无需额外排序的主表顺序扫描
+    def full_scans(self, plan, table, allow_ordered_walk=False):
+        ordered = not any('TEMP B-TREE FOR ORDER BY' in detail for detail in plan)
+        scans = []
+        for detail in plan:
+            match = SCAN.match(detail)
+            if match and not (allow_ordered_walk and ordered and match.group('table') == table):
+                scans.append(detail)
+        return scans
+
+    def test_changelist_filters_use_indexes(self):
+        factory = RequestFactory()
+        checked = 0
+        for model, name in PLAN_FILTERS:
+            model_admin = admin.site._registry[model]
+            list_filter = getattr(model_admin, name)
+            for user in self.users:
+                request = factory.get('/')
+                request.user = user
+                if not model_admin.has_module_permission(request) or list_filter not in model_admin.get_list_filter(request):
+                    continue
+                for value, title in list_filter(request, {}, model, model_admin).lookup_choices:
+                    with self.subTest(admin=model_admin.__class__.__name__, filter=name, value=value, role=user.get_type_display()):
+                        request = factory.get('/', {list_filter.parameter_name: value})
+                        request.user = user
+                        plan = self.explain(model_admin.get_changelist_instance(request).queryset)
+                        self.assertEqual(self.full_scans(plan, model._meta.db_table, (name, value) in ORDERED_WALKS), [])
+                        checked += 1
+        self.assertGreater(checked, 0)
+
+
+# 键集分页：游标编码、按(时间, id)逐页取完且不重复，计数超过上限时显示为“上限+”
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin1', name='管理员', type=User.ADMIN)
+        publisher = User.objects.create(username='org1', name='团委', type=User.ORGANIZATION)
+        collecting = Collecting.objects.create(title='收集', content='内容', publisher=publisher, allow_multiple=True, private=False, forced=False)
+        Submitting.objects.bulk_create([
+            Submitting(collecting=collecting, user=self.admin, title='提交', content='内容') for i in range(25)
+        ])
+        # 多条提交时间相同，由id区分先后
+        base = timezone.now()
+        for i, pk in enumerate(Submitting.objects.order_by('pk').values_list('pk', flat=True)):
+            Submitting.objects.filter(pk=pk).update(submit_time=base - datetime.timedelta(minutes=i // 4))
+        self.submitting_admin = admin.site._registry[Submitting]
+
+    def changelist(self, **params):
+        request = RequestFactory().get('/', params)
+        request.user = self.admin
+        return self.submitting_admin.get_changelist_instance(request)
+
+    def test_cursor(self):
+        value = timezone.now()
+        self.assertEqual(pagination.parse_cursor(pagination.format_cursor(value, 42)), (value, 42))
+        for cursor in ('', 'abc', '2024-01-01T00:00:00_x', 'not-a-date_3'):
+            self.assertIsNone(pagination.parse_cursor(cursor))
+
+    def test_walk_pages(self):
+        expected = list(Submitting.objects.order_by('-submit_time', '-pk').values_list('pk', flat=True))
+        seen = []
+        changelist = self.changelist()
+        self.assertEqual(changelist.count_display, '25')
+        while True:
+            seen += [submitting.pk for submitting in changelist.result_list]
+            if not changelist.next_cursor:
+                break
+            self.assertLessEqual(len(changelist.result_list), changelist.list_per_page)
+            changelist = self.changelist(**{pagination.CURSOR_VAR: changelist.next_cursor})
+        self.assertEqual(seen, expected)
+
+    # 按列排序时退回页码分页
+    def test_ordered_by_column(self):
+        changelist = self.changelist(o='1')
+        self.assertIsNone(changelist.next_cursor)
+        self.assertEqual(len(changelist.result_list), changelist.list_per_page)
+
+    def test_capped_count(self):
+        paginator = pagination.CappedCountPaginator(Submitting.objects.order_by('id'), 10)
+        paginator.count_cap = 20
+        self.assertEqual(paginator.count_display, '20+')
+        self.assertTrue(paginator.capped)
@@ -0,0 +1,125 @@
+from django.contrib.admin.utils import flatten_fieldsets
+from django.contrib.admin.widgets import AutocompleteSelect, AutocompleteSelectMultiple
+from django.core.exceptions import PermissionDenied
+from django.db import models
+from django.http import Http404, JsonResponse
+from django.urls import path, reverse
+
+# 字符串比较的上界，term到term+该字符之间即为以term开头的字符串
+PREFIX_END = '\U0010ffff'
+
+
+# 以范围条件实现前缀匹配，可直接使用字段上的B树索引
+def prefix_q(field, term):
+    return models.Q(**{field + '__gte': term, field + '__lt': term + PREFIX_END})
+
+
+# 只渲染已选用户的控件，其余用户由select2按需从接口加载
+class UserPickerWidget(AutocompleteSelect):
+    def __init__(self, rel, admin_site, url, attrs=None, choices=(), using=None):
+        self.url = url
+        super(UserPickerWidget, self).__init__(rel, admin_site, attrs, choices, using)
+
+    def get_url(self):
+        return self.url
+
+
+class UserPickerMultipleWidget(UserPickerWidget, AutocompleteSelectMultiple):
+    pass
+
+
+# 为ModelAdmin中指向用户的外键和多对多字段提供按需加载的选择控件，可选范围与formfield_for_foreignkey/formfield_for_manytomany一致
+class UserPickerMixin:
+    # 使用选择控件的字段
+    user_picker_fields = ()
+    # 每次加载的用户数
+    user_picker_per_page = 20
+
+    def get_user_picker_url_name(self):
+        return '%s_%s_user_picker' % (self.model._meta.app_label, self.model._meta.model_name)
+
+    def get_urls(self):
+        urls = [
+            path(
+                'user_picker/<str:field>/',
+                self.admin_site.admin_view(self.user_picker_view),
+                name=self.get_user_picker_url_name()
+            ),
+        ]
+        # 内联没有自己的URL，由所属的ModelAdmin提供其选择控件的接口
+        for inline_class in self.inlines:
+            if issubclass(inline_class, InlineUserPickerMixin):
+                inline = inline_class(self.model, self.admin_site)
+                urls.append(path(
+                    '%s/user_picker/<str:field>/' % inline.model._meta.model_name,
+                    self.admin_site.admin_view(inline.user_picker_view),
+                    name=inline.get_user_picker_url_name()
+                ))
+        return urls + super(UserPickerMixin, self).get_urls()
+
+    def get_user_picker_widget(self, db_field, **kwargs):
+        widget = UserPickerMultipleWidget if db_field.many_to_many else UserPickerWidget
+        return widget(
+            db_field.remote_field,
+            self.admin_site,
+            url=reverse('%s:%s' % (self.admin_site.name, self.get_user_picker_url_name()), args=[db_field.name]),
+            using=kwargs.get('using')
+        )
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name in self.user_picker_fields and 'widget' not in kwargs:
+            kwargs['widget'] = self.get_user_picker_widget(db_field, **kwargs)
+        return super(UserPickerMixin, self).formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        if db_field.name in self.user_picker_fields and 'widget' not in kwargs:
+            kwargs['widget'] = self.get_user_picker_widget(db_field, **kwargs)
+        return super(UserPickerMixin, self).formfield_for_manytomany(db_field, request, **kwargs)
+
+    # 当前用户的表单中显示且可编辑的字段，各角色修改页面可编辑的用户字段与添加页面一致
+    def user_picker_editable(self, request, field):
+        if not self.has_add_permission(request):
+            return False
+        return field in flatten_fieldsets(self.get_fieldsets(request)) and field not in self.get_readonly_fields(request)
+
+    # 按用户名或名称前缀分页查询可选用户，返回select2格式的结果
+    def user_picker_view(self, request, field):
+        if field not in self.user_picker_fields:
+            raise Http404
+        if not self.user_picker_editable(request, field):
+            raise PermissionDenied
+        db_field = self.model._meta.get_field(field)
+        if db_field.many_to_many:
+            formfield = self.formfield_for_manytomany(db_field, request)
+        else:
+            formfield = self.formfield_for_foreignkey(db_field, request)
+        queryset = formfield.queryset
+        term = request.GET.get('term', '').strip()
+        if term:
+            queryset = queryset.filter(prefix_q('username', term) | prefix_q('name', term))
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        start = (page - 1) * self.user_picker_per_page
+        users = list(queryset.order_by('username')[start:start + self.user_picker_per_page + 1])
+        return JsonResponse({
+            'results': [
+                {'id': str(user.pk), 'text': formfield.label_from_instance(user) + ' ' + user.username}
+                for user in users[:self.user_picker_per_page]
+            ],
+            'pagination': {'more': len(users) > self.user_picker_per_page},
+        })
+
+
+# 内联中的用户选择控件，接口挂在所属ModelAdmin的URL下
+class InlineUserPickerMixin(UserPickerMixin):
+    def get_user_picker_url_name(self):
+        return '%s_%s_%s_user_picker' % (self.parent_model._meta.app_label, self.parent_model._meta.model_name, self.model._meta.model_name)
+
+    # 未知所属对象，需同时有新建所属对象和新建内联对象的权限
+    def user_picker_editable(self, request, field):
+        parent_admin = self.admin_site._registry.get(self.parent_model)
+        if parent_admin is None or not parent_admin.has_add_permission(request) or not self.has_add_permission(request, None):
+            return False
+        return field in self.get_fields(request) and field not in self.get_readonly_fields(request)
@@ -1,8 +1,27 @@
+import os
+from ckeditor_uploader import utils as ckeditor_utils
+from ckeditor_uploader.backends import get_backend
+from ckeditor_uploader.forms import SearchForm
+from ckeditor_uploader.views import get_upload_filename
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.models import AnonymousUser
-from django.shortcuts import redirect
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import redirect, render
+from django.urls import reverse
+from django.utils.html import escape
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.views.generic import FormView
+from . import media
 from .forms import RegisterForm
+from .models import UploadedFile
+from .pagination import CURSOR_VAR, format_cursor, parse_cursor, seek
+from .storage import attachment_storage
+
+# 文件浏览每页显示的文件数
+BROWSE_PER_PAGE = 60
 
 
 # 注册视图
@@ -31,3 +50,92 @@ class RegisterView(FormView):
             return self.form_valid(form)
         else:
             return self.form_invalid(form)
+
+
+# 媒体文件：只允许下载有权查看的附件，支持条件请求和断点续传
+def serve_media(request, path):
+    if not request.user.is_authenticated:
+        return redirect_to_login(request.get_full_path(), reverse('admin:login'))
+    # 先规范化再检查权限，避免upload/../之类的路径绕过检查
+    name = media.normalize(path)
+    if name is None or not media.can_access(request, name):
+        raise Http404
+    return media.serve(request, name, attachment_storage)
+
+
+# 富文本编辑器上传文件：与ckeditor_uploader的上传相同，保存后记录到上传文件表
+@csrf_exempt
+@require_POST
+def upload_file(request):
+    uploaded_file = request.FILES['upload']
+    ck_func_num = escape(request.GET.get('CKEditorFuncNum', ''))
+    backend = get_backend()(ckeditor_utils.storage, uploaded_file)
+    if not backend.is_image and not getattr(settings, 'CKEDITOR_ALLOW_NONIMAGE_FILES', True):
+        message = '只能上传图片。'
+        if ck_func_num:
+            return HttpResponse(
+                "<script type='text/javascript'>window.parent.CKEDITOR.tools.callFunction(%s, '', '%s');</script>"
+                % (ck_func_num, message)
+            )
+        return JsonResponse({'uploaded': '0', 'error': {'message': message}})
+    saved_path = backend.save_as(get_upload_filename(uploaded_file.name, request))
+    UploadedFile.objects.record(ckeditor_utils.storage, saved_path, request.user)
+    url = ckeditor_utils.get_media_url(saved_path)
+    if ck_func_num:
+        return HttpResponse(
+            "<script type='text/javascript'>window.parent.CKEDITOR.tools.callFunction(%s, '%s');</script>"
+            % (ck_func_num, url)
+        )
+    return JsonResponse({'url': url, 'uploaded': '1', 'fileName': os.path.basename(saved_path)})
+
+
+# 富文本编辑器浏览文件：从上传文件表按时间倒序分页读取，只显示自己上传的文件，超级用户显示全部
+def browse_files(request):
+    uploads = UploadedFile.objects.all()
+    if not request.user.is_superuser:
+        uploads = uploads.filter(user=request.user)
+    form = SearchForm(request.GET)
+    query = form.cleaned_data['q'] if form.is_valid() else ''
+    if query:
+        uploads = uploads.filter(path__icontains=query)
+    page = list(seek(uploads, 'created_time', parse_cursor(request.GET.get(CURSOR_VAR)))[:BROWSE_PER_PAGE + 1])
+    next_url = None
+    if len(page) > BROWSE_PER_PAGE:
+        page = page[:BROWSE_PER_PAGE]
+        params = request.GET.copy()
+        params[CURSOR_VAR] = format_cursor(page[-1].created_time, page[-1].id)
+        next_url = request.path + '?' + params.urlencode()
+    # 第一页和搜索均不带游标，搜索时保留编辑器传入的参数
+    params = request.GET.copy()
+    params.pop(CURSOR_VAR, None)
+    first_url = None
+    if request.GET.get(CURSOR_VAR):
+        first_url = request.path + '?' + params.urlencode()
+    params.pop('q', None)
+    files = []
+    for uploaded in page:
+        src = ckeditor_utils.get_media_url(uploaded.path)
+        is_image = uploaded.width is not None or ckeditor_utils.is_valid_image_extension(uploaded.path)
+        if uploaded.thumbnail:
+            thumb = ckeditor_utils.get_media_url(uploaded.thumbnail)
+        elif is_image:
+            thumb = src
+        else:
+            thumb = ckeditor_utils.get_icon_filename(uploaded.path)
+        filename = os.path.basename(uploaded.path)
+        files.append({
+            'src': src,
+            'thumb': thumb,
+            'is_image': is_image,
+            'dir': os.path.dirname(uploaded.path),
+            'visible_filename': filename if len(filename) <= 20 else filename[:19] + '...',
+        })
+    content = {
+        'show_dirs': getattr(settings, 'CKEDITOR_BROWSE_SHOW_DIRS', False),
+        'files': files,
+        'form': form,
+        'hidden_params': [(key, value) for key in params for value in params.getlist(key)],
+        'first_url': first_url,
+        'next_url': next_url,
+    }
+    return render(request, 'admin/utils/CustomPages/browse.html', content)